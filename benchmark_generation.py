@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+# Benchmarks text generation with a tiny, randomly initialised GPT-2 model,
+# so the throughput of backends and batch settings can be compared between commits.
+# Nothing is downloaded, the tokenizer is trained on the benchmark's own prompts.
+# Usage, from the project root:
+# python benchmark_generation.py --batch-size 4 --output benchmark.json
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+
+from configparser import ConfigParser
+
+import torch
+
+from tokenizers import ByteLevelBPETokenizer
+from transformers import GPT2Config, GPT2LMHeadModel, GPT2Tokenizer
+
+from generators.text import ModelTextGenerator, default_text_generation_parameters
+from generators.text.backends import ONNX_SUBDIRECTORY, export_onnx
+from reddit_io.logic_mixin import LogicMixin
+from reddit_io.thread_snapshots import CommentSnapshot, SubmissionSnapshot
+from utils.memory import PeakMemorySampler
+
+BENCHMARK_BOT = 'benchmark_bot'
+
+_words = ['the', 'bot', 'subreddit', 'model', 'reply', 'thread', 'people', 'really', 'think', 'this', 'that', 'would',
+	'about', 'what', 'when', 'why', 'how', 'you', 'they', 'post', 'comment', 'image', 'game', 'time', 'never', 'always',
+	'good', 'bad', 'funny', 'weird', 'learn', 'train', 'text', 'write', 'read', 'question', 'answer', 'yes', 'no', 'maybe']
+
+
+class PromptBuilder(LogicMixin):
+	"""
+	Builds prompts with the same tagging as the bots, from made up submissions and comment chains.
+	"""
+
+	_image_post_frequency = 0.2
+
+	def __init__(self, tokenizer=None, token_budget=768):
+		self._prompt_tokenizer = tokenizer
+		self._prompt_token_budget = token_budget
+
+	def reply_prompt(self, rng, depth, use_reply_sense=True):
+		submission = SubmissionSnapshot('t3_benchmark', 'op_user', _sentence(rng, 4, 12), _sentence(rng, 0, 60),
+			True, 'subsimgpt2interactive', None, 0)
+
+		# The thread newest first, the same as get_comment_thread
+		thread = [submission]
+		for i in range(depth):
+			thread.insert(0, CommentSnapshot(f't1_benchmark{i}', f'user_{rng.randint(1, 20)}', _sentence(rng, 3, 80),
+				thread[0].name, submission.name, i + 1))
+
+		# Tagged newest first, the same as _collate_tagged_comment_history
+		tagged_segments = [self.tag_comment(comment, use_reply_sense, thread[i:]) for i, comment in enumerate(thread[:-1])]
+		tagged_segments.append(self.tag_submission(submission, use_reply_sense))
+
+		if self._prompt_tokenizer:
+			history = self._pack_tagged_segments(tagged_segments, self._prompt_token_budget)
+		else:
+			history = ''.join(reversed(tagged_segments))[-1450:]
+
+		return history + self._reply_start_tag
+
+	def new_submission_prompt(self, use_reply_sense=True):
+		return self._get_random_new_submission_tag('subsimgpt2interactive', use_reply_sense)
+
+
+def _sentence(rng, min_words, max_words):
+	return ' '.join(rng.choice(_words) for _ in range(rng.randint(min_words, max_words)))
+
+
+def build_prompt_corpus(num_prompts, seed=0, tokenizer=None, token_budget=768):
+	"""
+	A list of (source_name, prompt) jobs, mostly replies at varying depths with some new submissions.
+	"""
+	rng = random.Random(seed)
+	prompt_builder = PromptBuilder(tokenizer, token_budget)
+
+	# _get_random_new_submission_tag uses the random module
+	random.seed(seed)
+
+	corpus = []
+	for i in range(num_prompts):
+		if rng.random() < 0.2:
+			corpus.append(('t3_new_submission', prompt_builder.new_submission_prompt()))
+		else:
+			corpus.append((f't1_{i}', prompt_builder.reply_prompt(rng, depth=rng.randint(1, 6))))
+
+	return corpus
+
+
+def build_tiny_model(model_path, corpus, n_layer=2, n_embd=128, n_head=2, vocab_size=2000, seed=0):
+	"""
+	Save a randomly initialised GPT-2 and a byte level BPE tokenizer trained on the corpus' prompts.
+	"""
+	tokenizer = ByteLevelBPETokenizer()
+	tokenizer.train_from_iterator([prompt for _, prompt in corpus], vocab_size=vocab_size, special_tokens=['<|endoftext|>'])
+	tokenizer.save_model(model_path)
+
+	gpt2_tokenizer = GPT2Tokenizer(os.path.join(model_path, 'vocab.json'), os.path.join(model_path, 'merges.txt'))
+	gpt2_tokenizer.save_pretrained(model_path)
+
+	torch.manual_seed(seed)
+	config = GPT2Config(vocab_size=len(gpt2_tokenizer), n_positions=1024, n_embd=n_embd, n_layer=n_layer, n_head=n_head,
+		bos_token_id=gpt2_tokenizer.eos_token_id, eos_token_id=gpt2_tokenizer.eos_token_id)
+	GPT2LMHeadModel(config).save_pretrained(model_path)
+
+	return gpt2_tokenizer
+
+
+def percentile(values, percent):
+	# Nearest rank percentile
+	ordered = sorted(values)
+	rank = math.ceil(percent / 100 * len(ordered))
+	return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def run_benchmark(model_path, corpus, tokenizer, backend='pytorch', batch_size=1, num_candidates=1, workers=0,
+		prefix_cache_size=4, max_length=64, seed=0):
+	"""
+	Replay the corpus through ModelTextGenerator, batch_size jobs at a time, and return the report as a dict.
+	"""
+	if backend == 'onnx' and not os.path.isdir(os.path.join(model_path, ONNX_SUBDIRECTORY)):
+		# The onnx backend loads the graph exported into the model directory
+		export_onnx(model_path)
+
+	config = ConfigParser()
+	config['DEFAULT'] = {'text_generation_workers': str(workers), 'prefix_cache_size': str(prefix_cache_size)}
+	config[BENCHMARK_BOT] = {'text_model_path': os.path.abspath(model_path), 'text_generation_backend': backend}
+
+	memory_sampler = PeakMemorySampler()
+	memory_sampler.start()
+
+	mtg = ModelTextGenerator(config=config)
+
+	text_generation_parameters = default_text_generation_parameters.copy()
+	text_generation_parameters['max_length'] = max_length
+	text_generation_parameters['num_return_sequences'] = num_candidates
+
+	# The first generation loads the model, in this process or the worker
+	start_time = time.time()
+	mtg.generate_text_batch(BENCHMARK_BOT, [corpus[0][1]], dict(text_generation_parameters, max_length=1), [corpus[0][0]])
+	model_load_time = time.time() - start_time
+
+	# Worker processes are seeded by their own start up, so only in-process runs are exactly repeatable
+	random.seed(seed)
+	torch.manual_seed(seed)
+
+	job_latencies = []
+	generated_tokens = 0
+
+	start_time = time.time()
+
+	for i in range(0, len(corpus), batch_size):
+		batch = corpus[i:i + batch_size]
+		source_names = [source_name for source_name, _ in batch]
+		prompts = [prompt for _, prompt in batch]
+
+		batch_start_time = time.time()
+		output_list = mtg.generate_text_batch(BENCHMARK_BOT, prompts, text_generation_parameters.copy(), source_names)
+		batch_duration = time.time() - batch_start_time
+
+		# Every job in the batch waits for the whole batch
+		job_latencies += [batch_duration] * len(batch)
+
+		for prompt, generated_texts in zip(prompts, output_list):
+			for generated_text in generated_texts:
+				generated_tokens += len(tokenizer.encode(generated_text[len(prompt):]))
+
+	total_time = time.time() - start_time
+	peak_memory = memory_sampler.stop()
+
+	if mtg._worker_pool:
+		mtg._worker_pool.shutdown()
+
+	return {
+		'settings': {'backend': backend, 'batch_size': batch_size, 'candidates': num_candidates, 'workers': workers,
+			'prefix_cache_size': prefix_cache_size, 'max_length': max_length, 'jobs': len(corpus), 'seed': seed},
+		'model_load_seconds': round(model_load_time, 3),
+		'total_seconds': round(total_time, 3),
+		'generated_tokens': generated_tokens,
+		'tokens_per_second': round(generated_tokens / total_time, 1),
+		'latency_seconds': {'p50': round(percentile(job_latencies, 50), 3),
+			'p95': round(percentile(job_latencies, 95), 3),
+			'p99': round(percentile(job_latencies, 99), 3)},
+		'peak_rss_kb': round(peak_memory),
+	}
+
+
+def main():
+
+	logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.WARNING)
+
+	parser = argparse.ArgumentParser(description="Benchmark text generation with a tiny random GPT-2 model")
+	parser.add_argument('--jobs', type=int, default=32, help="the number of prompts to generate text for")
+	parser.add_argument('--backend', default='pytorch', help="the text_generation_backend to benchmark")
+	parser.add_argument('--batch-size', type=int, default=1)
+	parser.add_argument('--candidates', type=int, default=1)
+	parser.add_argument('--workers', type=int, default=0)
+	parser.add_argument('--prefix-cache-size', type=int, default=4)
+	parser.add_argument('--max-length', type=int, default=64, help="the number of new tokens generated for each job")
+	parser.add_argument('--n-layer', type=int, default=2)
+	parser.add_argument('--n-embd', type=int, default=128)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--output', help="file to write the JSON report to, instead of printing it")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as model_path:
+		corpus = build_prompt_corpus(args.jobs, seed=args.seed)
+		tokenizer = build_tiny_model(model_path, corpus, n_layer=args.n_layer, n_embd=args.n_embd, seed=args.seed)
+
+		# Pack the prompts into the token budget with the model's tokenizer, as the bots do
+		corpus = build_prompt_corpus(args.jobs, seed=args.seed, tokenizer=tokenizer)
+
+		report = run_benchmark(model_path, corpus, tokenizer, backend=args.backend, batch_size=args.batch_size,
+			num_candidates=args.candidates, workers=args.workers, prefix_cache_size=args.prefix_cache_size,
+			max_length=args.max_length, seed=args.seed)
+
+	report['model'] = {'n_layer': args.n_layer, 'n_embd': args.n_embd}
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+	else:
+		print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+	main()
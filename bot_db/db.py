@@ -1,6 +1,12 @@
+import logging
+import os
+import socket
+import threading
 import time
+import uuid
 
-from peewee import IntegerField, TextField, TimestampField
+from peewee import FloatField, IntegerField, TextField, TimestampField
+from playhouse.migrate import SqliteMigrator, migrate
 from playhouse.signals import Model, pre_save
 from playhouse.sqlite_ext import JSONField
 from playhouse.sqliteq import SqliteQueueDatabase
@@ -38,6 +44,11 @@ class Thing(Model):
 	text_generation_attempts = IntegerField(default=0)
 	# text generated by model and returned to the job
 	generated_text = TextField(null=True)
+	# json list recording whether each generated candidate passed validation, and why not
+	text_generation_candidates = JSONField(null=True)
+	# The priority class of the text generation job, where 0 is the most urgent.
+	# See generators/text/scheduler.py
+	priority = IntegerField(null=True)
 
 	# Image generation parameters; scraper or text2img GAN
 	image_generation_parameters = JSONField(null=True)
@@ -53,6 +64,11 @@ class Thing(Model):
 	# where t3_ prefix = submission, t1_ = comment, t4_ = message
 	posted_name = TextField(null=True)
 
+	# The generator worker that has claimed this job, and the unix time its claim runs out.
+	# An expired lease can be claimed by another worker.
+	lease_owner = TextField(null=True)
+	lease_expires = FloatField(null=True)
+
 	class Meta:
 		database = db
 
@@ -104,9 +120,99 @@ def on_presave_handler(model_class, instance, created):
 	# print(f'updating status of {instance} from {before_status} to {instance.status}')
 
 
+# How long a worker's claim on a job lasts, in seconds, unless it is extended
+default_lease_seconds = 600
+
+
+def get_worker_id(name):
+	# Identifies a worker claiming jobs, unique across processes and hosts sharing the database
+	return f"{socket.gethostname()}:{os.getpid()}:{name}:{uuid.uuid4().hex[:8]}"
+
+
+def claim_jobs(query, worker_id, lease_seconds, limit=None):
+	"""
+	Lease the jobs selected by query to worker_id, in a single UPDATE so that
+	two workers can never claim the same job. Jobs with an expired lease are claimed again.
+	Jobs the worker has already claimed are included, and their leases renewed.
+	Returns the claimed jobs, in the order of the query.
+	"""
+	now = time.time()
+
+	claimable = query.select(Thing.id).where(
+		(Thing.lease_owner.is_null()) | (Thing.lease_expires < now) | (Thing.lease_owner == worker_id))
+	if limit:
+		claimable = claimable.limit(limit)
+
+	Thing.update(lease_owner=worker_id, lease_expires=now + lease_seconds).\
+		where(Thing.id.in_(claimable)).\
+		execute()
+
+	return list(query.where(Thing.lease_owner == worker_id))
+
+
+def extend_leases(jobs, worker_id, lease_seconds):
+	# Renew the leases of jobs that are taking longer than expected
+	lease_expires = time.time() + lease_seconds
+
+	Thing.update(lease_expires=lease_expires).\
+		where(Thing.id.in_([job.id for job in jobs])).\
+		where(Thing.lease_owner == worker_id).\
+		execute()
+
+	for job in jobs:
+		job.lease_expires = lease_expires
+
+
+class LeaseKeeper(threading.Thread):
+	"""
+	Renews the leases of jobs on a timer, for work that can take longer than a lease.
+	Use it as a context manager around the work on the jobs.
+	"""
+
+	daemon = True
+
+	def __init__(self, jobs, worker_id, lease_seconds):
+		super().__init__(name=f"LeaseKeeper-{worker_id}")
+		self._jobs = jobs
+		self._worker_id = worker_id
+		self._lease_seconds = lease_seconds
+		self._stop_event = threading.Event()
+
+	def run(self):
+		# Renew well before the lease runs out
+		while not self._stop_event.wait(self._lease_seconds / 3):
+			try:
+				extend_leases(self._jobs, self._worker_id, self._lease_seconds)
+			except Exception:
+				logging.exception("Renewing the job leases failed")
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc_info):
+		self._stop_event.set()
+		self.join()
+
+
+def release_job(job):
+	# Clear the lease, so it is saved with the rest of the job
+	job.lease_owner = None
+	job.lease_expires = None
+
+
 def create_db_tables():
 
 	db.create_tables(models=[Thing])
+
+	# attempt to add any columns that are new, to the database
+	migrator = SqliteMigrator(db)
+	thing_table_cols = [i.name for i in db.get_columns(Thing._meta.table_name)]
+
+	for field in [Thing.text_generation_candidates, Thing.priority, Thing.lease_owner, Thing.lease_expires]:
+		if field.column_name not in thing_table_cols:
+			migrate(migrator.add_column(Thing._meta.table_name, field.column_name, field))
+
 	# these stop/start calls are required
 	# because of nuance in SqliteQueueDatabase
 	db.stop()
@@ -9,6 +9,7 @@ import time
 import urllib.parse
 
 from collections import OrderedDict
+from configparser import ConfigParser
 
 from bs4 import BeautifulSoup
 from nltk.tokenize import sent_tokenize
@@ -17,6 +18,7 @@ from nltk import pos_tag, TweetTokenizer
 from reddit_io.tagging_mixin import TaggingMixin
 
 from bot_db.db import Thing as db_Thing
+from bot_db.db import LeaseKeeper, claim_jobs, default_lease_seconds, get_worker_id, release_job
 
 
 class ImageScraper(threading.Thread, TaggingMixin):
@@ -24,45 +26,66 @@ class ImageScraper(threading.Thread, TaggingMixin):
 	daemon = True
 	name = "ImageScraper"
 
+	# The number of jobs worked on between the longer pauses
+	_jobs_per_round = 10
+
 	def __init__(self):
 		threading.Thread.__init__(self)
 
+		self._config = ConfigParser()
+		self._config.read('ssi-bot.ini')
+
+		# Jobs are leased from the queue, so several scrapers can share it.
+		# Each job is claimed just before it is worked on, as each one is followed by a pause.
+		self._worker_id = get_worker_id(self.name)
+		self._lease_seconds = self._config['DEFAULT'].getint('job_lease_seconds', default_lease_seconds)
+
 	def run(self):
 
 		while True:
 
-			# get the top job in the list
-			jobs = self.top_pending_jobs()
+			for _ in range(self._jobs_per_round):
+
+				# get the top job in the list
+				jobs = self.top_pending_jobs()
+				if not jobs:
+					break
+
+				self.process_job(jobs[0])
 
-			for job in jobs:
+				# Sleep a bit here to not hammer the servers
+				time.sleep(10)
 
-				try:
-					logging.info(f"Starting to find an image for job_id {job.id}.")
+			# Sleep a bit more to be nice to dem servers
+			time.sleep(120)
 
-					if not job.image_generation_parameters['prompt'] and job.generated_text:
-						# If there is no prompt, but is generated text, attempt to extract the title
-						# from the generated text and use it as the prompt
-						job.image_generation_parameters['prompt'] = self.extract_title_from_generated_text(job.generated_text)
+	def process_job(self, job):
 
-					image_url = self._download_image_for_search_string(job.bot_username, job.image_generation_parameters.copy(), job.image_generation_attempts)
+		try:
+			logging.info(f"Starting to find an image for job_id {job.id}.")
 
-					if image_url:
-						logging.info(f'Using image url for job {job}: {image_url}')
-						job.generated_image_path = image_url
-						job.save()
+			# The search has no time limit, so the lease is renewed while it runs
+			with LeaseKeeper([job], self._worker_id, self._lease_seconds):
 
-					# Sleep a bit here to not hammer the servers
-					time.sleep(10)
+				if not job.image_generation_parameters['prompt'] and job.generated_text:
+					# If there is no prompt, but is generated text, attempt to extract the title
+					# from the generated text and use it as the prompt
+					job.image_generation_parameters['prompt'] = self.extract_title_from_generated_text(job.generated_text)
 
-				except:
-					logging.exception(f"Scraping image for a {job} failed")
+				image_url = self._download_image_for_search_string(job.bot_username, job.image_generation_parameters.copy(), job.image_generation_attempts)
 
-				finally:
-					job.image_generation_attempts += 1
-					job.save()
+			if image_url:
+				logging.info(f'Using image url for job {job}: {image_url}')
+				job.generated_image_path = image_url
+				job.save()
 
-			# Sleep a bit more to be nice to dem servers
-			time.sleep(120)
+		except:
+			logging.exception(f"Scraping image for a {job} failed")
+
+		finally:
+			job.image_generation_attempts += 1
+			release_job(job)
+			job.save()
 
 	def _download_image_for_search_string(self, bot_username, image_generation_parameters, attempt):
 
@@ -132,7 +155,8 @@ class ImageScraper(threading.Thread, TaggingMixin):
 
 	def top_pending_jobs(self):
 		"""
-		Get a list of jobs that need an image to be found via the scraper
+		Get a list of jobs that need an image to be found via the scraper.
+		The jobs are leased to this scraper.
 
 		"""
 
@@ -140,4 +164,4 @@ class ImageScraper(threading.Thread, TaggingMixin):
 					where(db_Thing.image_generation_parameters['type'] == 'scraper').\
 					where(db_Thing.status == 5).\
 					order_by(db_Thing.created_utc)
-		return list(query)
+		return claim_jobs(query, self._worker_id, self._lease_seconds, limit=1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import functools
+import inspect
+import logging
+
+from contextlib import contextmanager
+from pathlib import Path
+
+import torch
+
+from simpletransformers.language_generation import LanguageGenerationModel
+from transformers import GPT2Tokenizer
+from transformers.pytorch_utils import Conv1D
+
+# Where the exported ONNX graph is saved, inside the model's own directory
+ONNX_SUBDIRECTORY = 'onnx'
+
+BACKENDS = ['pytorch', 'quantized', 'onnx']
+
+
+def load_model(model_path, backend='pytorch', use_gpu=False):
+	"""
+	Load the model in model_path with an inference backend:
+	pytorch - the fp32 model, as finetuned
+	quantized - linear layers dynamically quantized to int8, CPU only
+	onnx - the ONNX Runtime graph exported by export_onnx, CPU only
+
+	Every backend returns an object with the model, tokenizer and device attributes
+	of simpletransformers' LanguageGenerationModel.
+	"""
+	if backend == 'pytorch':
+		# if you are generating on CPU, keep use_cuda and fp16 both false.
+		# If you have a nvidia GPU you may enable these features
+		return LanguageGenerationModel("gpt2", model_path, use_cuda=use_gpu, args={'fp16': False})
+
+	elif backend == 'quantized':
+		model = LanguageGenerationModel("gpt2", model_path, use_cuda=False, args={'fp16': False})
+		model.model = quantize_model(model.model)
+		return model
+
+	elif backend == 'onnx':
+		return OnnxGenerationModel(model_path)
+
+	raise ValueError(f"Unknown text generation backend {backend}, use one of {', '.join(BACKENDS)}")
+
+
+def quantize_model(model):
+	"""
+	Dynamically quantize the weights of the model's linear layers to int8.
+	GPT-2 implements its linear layers as Conv1D, which torch can't quantize,
+	so they are converted to the equivalent Linear layers first.
+	"""
+	_replace_conv1d_with_linear(model)
+	model.eval()
+	return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _replace_conv1d_with_linear(module):
+	for name, child in module.named_children():
+		if isinstance(child, Conv1D):
+			# Conv1D stores its weight as (in_features, out_features), Linear as (out_features, in_features)
+			in_features, out_features = child.weight.shape
+			linear = torch.nn.Linear(in_features, out_features)
+			linear.weight.data = child.weight.data.t().contiguous()
+			linear.bias.data = child.bias.data
+			setattr(module, name, linear)
+		else:
+			_replace_conv1d_with_linear(child)
+
+
+class OnnxGenerationModel():
+	"""
+	An exported ONNX Runtime graph of the model, with past key value inputs and outputs,
+	so it can be used for the same incremental decoding as the pytorch model.
+	"""
+
+	device = 'cpu'
+
+	def __init__(self, model_path):
+		# onnxruntime and optimum are only needed for this backend
+		from optimum.onnxruntime import ORTModelForCausalLM
+
+		onnx_path = Path(model_path) / ONNX_SUBDIRECTORY
+		if not onnx_path.is_dir():
+			raise FileNotFoundError(f"No ONNX export found at {onnx_path}. Export it first with: python -m generators.text.export_onnx {model_path}")
+
+		self.tokenizer = GPT2Tokenizer.from_pretrained(model_path)
+		self.model = ORTModelForCausalLM.from_pretrained(onnx_path, use_cache=True)
+
+		# The graph isn't a torch module, so its size is taken from the files on disk, in KB
+		self.footprint = sum(f.stat().st_size for f in onnx_path.iterdir() if f.is_file()) / 1024
+
+
+def export_onnx(model_path):
+	"""
+	Export a finetuned model directory to an ONNX graph with past key values,
+	saved into an onnx directory inside the model directory.
+	"""
+	from optimum.onnxruntime import ORTModelForCausalLM
+
+	onnx_path = Path(model_path) / ONNX_SUBDIRECTORY
+
+	logging.info(f"Exporting {model_path} to ONNX..")
+	with _torchscript_onnx_exporter():
+		model = ORTModelForCausalLM.from_pretrained(model_path, export=True, use_cache=True)
+	model.save_pretrained(onnx_path)
+
+	logging.info(f"Saved the ONNX graph to {onnx_path}")
+	return onnx_path
+
+
+@contextmanager
+def _torchscript_onnx_exporter():
+	# optimum exports with the TorchScript based exporter, but newer versions of torch default to the dynamo exporter,
+	# which saves the weights in a separate file that optimum doesn't expect.
+	export = torch.onnx.export
+	if 'dynamo' in inspect.signature(export).parameters:
+		torch.onnx.export = functools.partial(export, dynamo=False)
+
+	try:
+		yield
+	finally:
+		torch.onnx.export = export
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+from reddit_io.tagging_mixin import TaggingMixin
+
+
+class EarlyAbortCheck(TaggingMixin):
+	"""
+	Checks the text generated so far for a candidate, while it is still being generated.
+	A candidate that already contains a negative keyword, or reads as toxic, would be rejected
+	once it was complete, so it is abandoned and the rest of its token budget goes to a fresh sample.
+
+	The check is passed to the generation worker processes, so the toxicity helper is only
+	given when generating in the main process, where the model is already loaded.
+	"""
+
+	def __init__(self, keyword_helper, toxicity_helper=None, toxicity_interval=0, threshold_profile=None):
+		self._keyword_helper = keyword_helper
+		# Detoxify is much slower than a keyword search, so it only runs every toxicity_interval tokens
+		self._toxicity_helper = toxicity_helper
+		self._toxicity_interval = toxicity_interval
+		self._threshold_profile = threshold_profile
+
+	def __call__(self, new_text, num_tokens):
+		"""
+		Returns the reason the text generated so far will fail validation, or None if it can continue.
+		"""
+		negative_keyword_matches = self._keyword_helper.negative_keyword_matches(new_text)
+		if negative_keyword_matches:
+			return f"negative keywords {', '.join(negative_keyword_matches)}"
+
+		if self._toxicity_helper and self._toxicity_interval and num_tokens % self._toxicity_interval == 0:
+			tagless_new_text = self.remove_tags_from_string(new_text)
+			if tagless_new_text and self._toxicity_helper.text_above_toxicity_threshold(tagless_new_text, self._threshold_profile):
+				return 'failed toxicity test'
+
+		return None
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+# Exports a finetuned model directory for the onnx text generation backend.
+# Usage, from the project root:
+# python -m generators.text.export_onnx models/path_to_model/
+
+import argparse
+import logging
+
+from .backends import export_onnx
+
+
+def main():
+
+	logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+	parser = argparse.ArgumentParser(description="Export a finetuned GPT-2 model to ONNX Runtime")
+	parser.add_argument('model_path', help="directory path to the GPT-2 model, the same as text_model_path in ssi-bot.ini")
+	args = parser.parse_args()
+
+	export_onnx(args.model_path)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import gc
+import logging
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+from transformers import GPT2Tokenizer
+
+from .backends import ONNX_SUBDIRECTORY, load_model
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+class ModelCache():
+	"""
+	A registry of loaded text generation models, keyed by model path and inference backend.
+	Loading GPT-2 weights and the tokenizer from disk is slower than generating a reply,
+	so models are kept resident between jobs and shared by every bot using the same directory and backend.
+	When the total footprint goes over the memory budget, the least recently used model is evicted.
+	"""
+
+	def __init__(self, memory_budget=0, use_gpu=False, loader=None):
+		# memory_budget is in KB, the same unit used by utils.memory
+		# A budget of 0 means models are never evicted
+		self._memory_budget = memory_budget
+		self._use_gpu = use_gpu
+		self._loader = loader or self._load_model
+
+		# model_path -> (model, footprint in KB), in least to most recently used order
+		self._models = OrderedDict()
+		self._lock = threading.RLock()
+		# Different models can load at the same time, so each has its own loading lock
+		self._loading_locks = {}
+
+		# The measured footprint of every model loaded so far, kept after eviction
+		self._footprints = {}
+
+		self.loads = 0
+		self.hits = 0
+		self.evictions = 0
+
+	def get(self, model_path, backend='pytorch'):
+		"""
+		Return the model for this path and backend, loading it if it isn't already resident.
+		"""
+		key = model_cache_key(model_path, backend)
+
+		with self._lock:
+			loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+		with loading_lock:
+			with self._lock:
+				if key in self._models:
+					self.hits += 1
+					self._models.move_to_end(key)
+					return self._models[key][0]
+
+			logging.info(f"Loading text generation model from {key}")
+			model = self._loader(model_path, backend)
+			footprint = self.measure_footprint(model)
+
+			with self._lock:
+				self.loads += 1
+				self._models[key] = (model, footprint)
+				self._footprints[key] = footprint
+				logging.info(f"Loaded text generation model {key}, footprint {footprint:.0f} KB. {self.stats()}")
+
+				self._evict_to_budget(keep=key)
+			return model
+
+	def evict(self, key):
+		"""
+		Remove a model from the cache by its key, if it is resident.
+		"""
+		with self._lock:
+			entry = self._models.pop(key, None)
+			if entry is None:
+				return False
+
+			self.evictions += 1
+			logging.info(f"Evicted text generation model {key}, releasing {entry[1]:.0f} KB")
+
+		del entry
+		gc.collect()
+		if self._use_gpu:
+			torch.cuda.empty_cache()
+		return True
+
+	def evict_lru(self, keep=None):
+		"""
+		Evict the least recently used model, other than the model with the key keep.
+		Returns the footprint released in KB, or 0 if there was nothing to evict.
+		"""
+		with self._lock:
+			lru_key = next((k for k in self._models if k != keep), None)
+			if lru_key is None:
+				return 0
+
+			footprint = self._models[lru_key][1]
+			self.evict(lru_key)
+			return footprint
+
+	def is_resident(self, key):
+		with self._lock:
+			return key in self._models
+
+	def estimate_footprint(self, model_path, backend='pytorch'):
+		# The measured footprint if the model has been loaded before, otherwise the size on disk, in KB
+		key = model_cache_key(model_path, backend)
+		return self._footprints.get(key) or estimate_model_footprint(model_path, backend)
+
+	def resident_paths(self):
+		with self._lock:
+			return list(self._models.keys())
+
+	def resident_memory(self):
+		# Sum of the footprints of every resident model, in KB
+		with self._lock:
+			return sum(footprint for _, footprint in self._models.values())
+
+	def stats(self):
+		with self._lock:
+			return {'resident': len(self._models), 'resident_kb': round(self.resident_memory()),
+					'loads': self.loads, 'hits': self.hits, 'evictions': self.evictions}
+
+	def measure_footprint(self, model):
+		# The size of the weights and buffers, in KB
+		if hasattr(model, 'footprint'):
+			# Models that aren't torch modules report their own size
+			return model.footprint
+
+		torch_model = getattr(model, 'model', model)
+		if not isinstance(torch_model, torch.nn.Module):
+			return 0
+
+		# The state dict is used rather than parameters(),
+		# because quantized layers keep their packed weights out of the parameters
+		tensors = []
+		for value in torch_model.state_dict().values():
+			if isinstance(value, torch.Tensor):
+				tensors.append(value)
+			elif isinstance(value, tuple):
+				tensors += [t for t in value if isinstance(t, torch.Tensor)]
+
+		return sum(t.nelement() * t.element_size() for t in tensors) / 1024
+
+	def _evict_to_budget(self, keep):
+		if not self._memory_budget:
+			return
+
+		while self.resident_memory() > self._memory_budget:
+			if not self.evict_lru(keep=keep):
+				# Only the model in use is left
+				logging.warning(f"Text generation model {keep} is larger than the model cache budget of {self._memory_budget} KB")
+				return
+
+	def _load_model(self, model_path, backend):
+		return load_model(model_path, backend, use_gpu=self._use_gpu)
+
+
+def model_cache_key(model_path, backend='pytorch'):
+	if backend == 'pytorch':
+		return str(model_path)
+	return f"{model_path}:{backend}"
+
+
+def estimate_model_footprint(model_path, backend='pytorch'):
+	"""
+	Estimate the memory a model will take before it is loaded, from the size of its weights on disk, in KB.
+	The quantized backend loads the fp32 weights before quantizing them, so it needs the full size to load.
+	"""
+	weights_path = Path(model_path)
+	if backend == 'onnx':
+		weights_path = weights_path / ONNX_SUBDIRECTORY
+
+	if not weights_path.is_dir():
+		return 0
+
+	weight_files = [f for f in weights_path.iterdir() if f.suffix in ('.bin', '.safetensors', '.onnx', '.onnx_data', '.data')]
+	return sum(f.stat().st_size for f in weight_files) / 1024
+
+
+def get_tokenizer(model_path):
+	"""
+	Return the tokenizer for a model directory without loading the model weights.
+	Tokenizers are shared between every caller using the same model path.
+	"""
+	key = str(model_path)
+
+	with _tokenizers_lock:
+		if key not in _tokenizers:
+			_tokenizers[key] = GPT2Tokenizer.from_pretrained(key)
+		return _tokenizers[key]
@@ -4,20 +4,26 @@ import logging
 import threading
 import time
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from configparser import ConfigParser
 
-from simpletransformers.language_generation import LanguageGenerationModel
-
 from reddit_io.tagging_mixin import TaggingMixin
 from bot_db.db import Thing as db_Thing
+from bot_db.db import LeaseKeeper, claim_jobs, default_lease_seconds, get_worker_id, release_job
 
-from utils.keyword_helper import KeywordHelper
+from utils.keyword_helper import get_keyword_helper
 from utils.toxicity_helper import ToxicityHelper
 
-from utils.memory import get_available_memory
+from utils.memory import MemoryAdmission
 from utils import ROOT_DIR
 
+from .early_abort import EarlyAbortCheck
+from .model_cache import estimate_model_footprint, model_cache_key
+from .scheduler import PRIORITY_MENTION, GenerationScheduler, get_job_priority, parse_deadlines
+from .text_generator import TextGenerator
+from .worker_pool import GenerationWorkerPool
+
 
 class ModelTextGenerator(threading.Thread, TaggingMixin):
 
@@ -30,24 +36,81 @@ class ModelTextGenerator(threading.Thread, TaggingMixin):
 
 	_config = None
 
-	# The amount of memory required to start generation, in KB
-	# This is the default for GPT-2 Small (117M parameters)
-	# This will need to be increased for larger GPT-2 models
-	_memory_required = 1400000
-
-	def __init__(self):
+	def __init__(self, config=None):
 		threading.Thread.__init__(self)
 
-		self._config = ConfigParser()
-		self._config.read('ssi-bot.ini')
-
-		# Configure the keyword helper to check negative keywords in the generated text
-		self._toxicity_helper = ToxicityHelper()
+		# A config can be passed in to run the generator outside of the bots, eg. to benchmark it
+		if config is None:
+			config = ConfigParser()
+			config.read('ssi-bot.ini')
+		self._config = config
+
+		# The model cache budget is configured in MB and a value of 0 keeps every model loaded.
+		# The prefix cache keeps the processed state of recent prompts. Set to 0 to disable.
+		generator_args = {'memory_budget': self._config['DEFAULT'].getint('model_cache_memory_budget', 0) * 1024,
+						'use_gpu': self._use_gpu,
+						'prefix_cache_size': self._config['DEFAULT'].getint('prefix_cache_size', 4)}
+
+		# With warm_up_models set, every configured model is loaded and run once before any job is taken.
+		# Until then, ready is not set and the bots don't queue new jobs.
+		self._warm_up_models = self._config['DEFAULT'].getboolean('warm_up_models', False)
+		self.ready = threading.Event()
+		if not self._warm_up_models:
+			self.ready.set()
+
+		# With text_generation_workers set, generation runs in separate processes, each with its own models.
+		# Otherwise it runs in this thread.
+		num_workers = self._config['DEFAULT'].getint('text_generation_workers', 0)
+		if num_workers > 0:
+			self._text_generator = None
+			self._worker_pool = GenerationWorkerPool(num_workers, generator_args,
+								self.configured_models() if self._warm_up_models else None)
+		else:
+			self._text_generator = TextGenerator(**generator_args)
+			self._worker_pool = None
+
+		# Pending jobs for the same model are generated together in batches of up to this size.
+		# A partial batch is held back for up to batch_wait seconds, to give it a chance to fill.
+		self._batch_size = max(1, self._config['DEFAULT'].getint('text_generation_batch_size', 1))
+		self._batch_wait = self._config['DEFAULT'].getfloat('text_generation_batch_wait', 10)
+		self._batch_wait_started = None
+
+		# The number of candidate texts generated for each job in a single call.
+		# The first candidate to pass validation is used, saving a retry on the next loop.
+		self._num_candidates = max(1, self._config['DEFAULT'].getint('text_generation_candidates', 1))
+
+		# A batch is only started when there's memory for its model, if it isn't already loaded,
+		# plus the working memory of each sequence being generated, configured in MB.
+		self._memory_admission = MemoryAdmission(self._use_gpu)
+		self._sequence_memory = self._config['DEFAULT'].getint('text_generation_sequence_memory', 100) * 1024
+
+		# Jobs are generated in order of priority class, taking turns between bots.
+		# Jobs older than their class' deadline, in minutes, are dropped. Only the classes listed in the config have one.
+		self._scheduler = GenerationScheduler(parse_deadlines(self._config['DEFAULT'].get('text_generation_deadlines', '')))
+
+		# Jobs are leased from the queue, so several generators can share it without taking the same jobs.
+		# Each loop claims as many jobs as it can generate at once.
+		self._worker_id = get_worker_id(self.name)
+		self._lease_seconds = self._config['DEFAULT'].getint('job_lease_seconds', default_lease_seconds)
+		self._claim_limit = self._batch_size * max(1, num_workers)
+
+		# The toxicity helper checks the generated text.
+		# Its model is loaded when the first generated text is validated.
+		self._toxicity_helper = None
+
+		# Candidates are checked for negative keywords while they are generated, and abandoned as soon as one appears.
+		# With text_generation_toxicity_interval set, they are also checked for toxicity every that many tokens.
+		# The toxicity check is only made when generating in this process.
+		self._early_abort = self._config['DEFAULT'].getboolean('text_generation_early_abort', True)
+		self._early_abort_toxicity_interval = self._config['DEFAULT'].getint('text_generation_toxicity_interval', 0)
 
 	def run(self):
 
 		logging.info("Starting GPT-2 text generator daemon")
 
+		if not self.ready.is_set():
+			self.warm_up()
+
 		while True:
 
 			jobs = self.top_pending_jobs()
@@ -58,94 +121,342 @@ class ModelTextGenerator(threading.Thread, TaggingMixin):
 				time.sleep(30)
 				continue
 
-			if get_available_memory(self._use_gpu) < self._memory_required:
-				# Not enough memory.. Sleep and start again
-				logging.info('Insufficient memory to generate text')
-				time.sleep(30)
-				continue
+			if self._batch_size > 1 and len(jobs) < self._batch_size and\
+				not any(get_job_priority(job) == PRIORITY_MENTION for job in jobs):
+				# Hold a partial batch back for a short while, in case more jobs arrive.
+				# Mentions don't wait.
+				if self._batch_wait_started is None:
+					self._batch_wait_started = time.time()
+				if time.time() - self._batch_wait_started < self._batch_wait:
+					time.sleep(1)
+					continue
 
-			for job in jobs:
+			self._batch_wait_started = None
 
-				try:
-					logging.info(f"Starting to generate text for bot {job.bot_username}, job_id {job.id}.")
-
-					# use the model to generate the text
-					# pass a copy of the parameters to keep the job values intact
-					generated_text = self.generate_text(job.bot_username, job.text_generation_parameters.copy())
-
-					if generated_text:
-
-						# Check for any negative keywords in the generated text and if so, return nothing
-						negative_keyword_matches = self.test_text_against_keywords(job.bot_username, generated_text)
-						if negative_keyword_matches:
-							# A negative keyword was found, so don't post this text back to reddit
-							logging.info(f"Negative keywords {negative_keyword_matches} found in generated text, this text will be rejected.")
-							continue
-
-						# Perform a very basic validation of the generated text
-						prompt = job.text_generation_parameters.get('prompt', '')
-						valid = self.validate_generated_text(job.source_name, prompt, generated_text)
-						if not valid:
-							logging.info(f"Generated text for {job} failed validation, this text will be rejected.")
-							continue
-
-						toxicity_failure = self.validate_toxicity(job.bot_username, prompt, generated_text)
-						if toxicity_failure:
-							logging.info(f"Generated text for {job} failed toxicity test, this text will be rejected.-> {generated_text}")
-							continue
-
-						# if the model generated text, set it into the 'job'
-						job.generated_text = generated_text
-						job.save()
-
-				except:
-					logging.exception(f"Generating text for job {job} failed")
-
-				finally:
-					# Increment the counter because we're about to generate text
-					job.text_generation_attempts += 1
+			# Generation can take longer than a lease, so the claim on the jobs is renewed until each one is released
+			with LeaseKeeper(jobs, self._worker_id, self._lease_seconds):
+				dispatched_batches = self.dispatch_batches(jobs)
+
+				for batch, future in dispatched_batches:
+					self.process_batch(batch, future)
+
+			if not dispatched_batches:
+				# Not enough memory for any of the batches.. Sleep and start again
+				time.sleep(5)
+
+	def dispatch_batches(self, jobs):
+		"""
+		Dispatch every batch of the jobs that there is memory for, before waiting on any,
+		so that generation workers can run them in parallel.
+		The jobs in a batch that has to wait for memory are released, so another generator can take them.
+		Returns a list of each dispatched batch and the Future of its candidates.
+		"""
+		dispatched_batches = []
+		reserved_memory = 0
+
+		for batch in self.batch_jobs(jobs):
+			required_memory = self.admit_batch(batch, reserved_memory)
+			if required_memory is None:
+				# Not enough memory for this batch, it goes back to the queue
+				for job in batch:
+					release_job(job)
 					job.save()
+				continue
 
-	def generate_text(self, bot_username, text_generation_parameters):
+			dispatched_batches.append((batch, self.dispatch_batch(batch)))
 
-		model_path = ROOT_DIR / self._config[bot_username]['text_model_path']
+			if self._worker_pool:
+				# The workers allocate the memory after this returns, so it is held back from later batches
+				reserved_memory += required_memory
 
-		# if you are generating on CPU, keep use_cuda and fp16 both false.
-		# If you have a nvidia GPU you may enable these features
-		# TODO shift these parameters into the ssi-bot.ini file
-		model = LanguageGenerationModel("gpt2", model_path, use_cuda=self._use_gpu, args={'fp16': False})
+		return dispatched_batches
 
+	def reload_config(self, config):
+		"""
+		Called by the config watcher when ssi-bot.ini changes.
+		Each job reads its bot's options from the config and gets its keyword helper from the shared registry,
+		so replacing the config is enough for the next jobs to use the new values.
+		The generator's DEFAULT settings, like the batch size and workers, still need a restart.
+		"""
+		self._config = config
+
+	def configured_models(self):
+		# The distinct (model path, backend) used by the bots in the config
+		models = []
+		for bot_username in self._config.sections():
+			if 'text_model_path' in self._config[bot_username]:
+				model = (self._get_model_path(bot_username), self._get_backend(bot_username))
+				if model not in models:
+					models.append(model)
+		return models
+
+	def warm_up(self):
+		"""
+		Load every configured model in parallel and run a short generation through each,
+		then set ready. A model that fails to load is logged, and will be loaded again by its first job.
+		"""
 		start_time = time.time()
+		logging.info("Warming up the text generation models..")
+
+		if self._worker_pool:
+			# Each worker warms up every model as it starts
+			for i, warm_up_times in enumerate(self._worker_pool.warm_up()):
+				for (model_path, backend), (load_time, generation_time) in warm_up_times.items():
+					logging.info(f"Worker {i} warmed up {model_path} ({backend}): loaded in {load_time:.1f}s, first generation in {generation_time:.1f}s")
+
+		else:
+			models = self.configured_models()
+			with ThreadPoolExecutor(max_workers=max(1, len(models))) as executor:
+				futures = {model: executor.submit(self._text_generator.warm_up, *model) for model in models}
+
+			for (model_path, backend), future in futures.items():
+				try:
+					load_time, generation_time = future.result()
+					logging.info(f"Warmed up {model_path} ({backend}): loaded in {load_time:.1f}s, first generation in {generation_time:.1f}s")
+				except Exception:
+					logging.exception(f"Warming up {model_path} ({backend}) failed")
+
+		logging.info(f"Text generation models warmed up in {time.time() - start_time:.1f} seconds")
+		self.ready.set()
+
+	def batch_jobs(self, jobs):
+		"""
+		Group the jobs into batches that can share a single generate call.
+		Jobs in a batch use the same model and the same generation parameters, apart from the prompt.
+		"""
+		groups = {}
+
+		for job in jobs:
+			parameters = {k: v for k, v in job.text_generation_parameters.items() if k != 'prompt'}
+			key = (self._get_model_path(job.bot_username), self._get_backend(job.bot_username), tuple(sorted(parameters.items())))
+			groups.setdefault(key, []).append(job)
+
+		for group in groups.values():
+			for i in range(0, len(group), self._batch_size):
+				yield group[i:i + self._batch_size]
+
+	def admit_batch(self, jobs, reserved_memory=0):
+		"""
+		Check there is enough memory to generate text for a batch of jobs,
+		evicting other cached models if that would free enough.
+		Returns the memory in KB the batch needs, or None if it has to wait.
+		"""
+		model_path = self._get_model_path(jobs[0].bot_username)
+		backend = self._get_backend(jobs[0].bot_username)
+		key = model_cache_key(model_path, backend)
+
+		model_cache = self._text_generator.model_cache if self._text_generator else None
+
+		if model_cache:
+			resident = model_cache.is_resident(key)
+			model_memory = model_cache.estimate_footprint(model_path, backend)
+			evict = lambda: model_cache.evict_lru(keep=key)
+		else:
+			# Each worker process loads its own copy of the model, which can't be evicted from here.
+			# Any worker may take the batch, so the model is charged until every one of them has loaded it.
+			resident = self._worker_pool.is_loaded_by_every_worker(model_path, backend)
+			model_memory = estimate_model_footprint(model_path, backend)
+			evict = None
+
+		required_memory = len(jobs) * self._num_candidates * self._sequence_memory
+		if not resident:
+			required_memory += model_memory
+
+		if not self._memory_admission.admit(key, required_memory, reserved_memory, evict):
+			return None
+
+		return required_memory
+
+	def dispatch_batch(self, jobs):
+		"""
+		Start generating text for a batch of jobs.
+		Returns a Future of the candidate texts for each job.
+		"""
+		logging.info(f"Starting to generate text for job_ids {', '.join(str(job.id) for job in jobs)}.")
+
+		# pass a copy of the parameters to keep the job values intact
+		text_generation_parameters = jobs[0].text_generation_parameters.copy()
+		if self._num_candidates > 1:
+			# Generate several candidates per job in the same call, any one of them can pass validation
+			text_generation_parameters['num_return_sequences'] = self._num_candidates
+
+		# The jobs share the model and parameters so the first job's bot is used to generate the batch.
+		prompts = [job.text_generation_parameters.get('prompt', '') for job in jobs]
+		source_names = [job.source_name for job in jobs]
+		abort_checks = [self.get_abort_check(job.bot_username) for job in jobs] if self._early_abort else None
+		return self.generate_text_batch_async(jobs[0].bot_username, prompts, text_generation_parameters, source_names, abort_checks)
+
+	def get_abort_check(self, bot_username):
+		"""
+		The check made on each candidate while it is being generated, with the bot's keywords and thresholds.
+		"""
+		if self._worker_pool or not self._early_abort_toxicity_interval:
+			return EarlyAbortCheck(get_keyword_helper(bot_username))
+
+		toxicity_helper = self._get_toxicity_helper()
+		return EarlyAbortCheck(get_keyword_helper(bot_username), toxicity_helper, self._early_abort_toxicity_interval,
+			toxicity_helper.get_threshold_profile(bot_username))
+
+	def process_batch(self, jobs, future):
+
+		try:
+			candidates_list = future.result()
+
+		except:
+			logging.exception(f"Generating text for jobs {jobs} failed")
+			candidates_list = [[]] * len(jobs)
+
+		for job, candidates in zip(jobs, candidates_list):
+
+			try:
+				self.process_candidates(job, candidates)
+
+			except:
+				logging.exception(f"Generating text for job {job} failed")
+
+			finally:
+				# Increment the counter because we're about to generate text
+				job.text_generation_attempts += 1
+				release_job(job)
+				job.save()
+
+	def process_candidates(self, job, candidates):
+		"""
+		Run each generated candidate through the validators in turn.
+		The first candidate that passes is set as the job's generated_text.
+		The outcome of every candidate is recorded on the job.
+		"""
+		candidate_log = job.text_generation_candidates or []
+
+		for i, generated_text in enumerate(candidates):
+
+			rejection_reason = self.get_rejection_reason(job, generated_text) if generated_text else 'no text generated'
+			candidate_log.append({'attempt': job.text_generation_attempts, 'candidate': i, 'passed': rejection_reason is None, 'reason': rejection_reason})
+
+			if rejection_reason is None:
+				# if the model generated text, set it into the 'job'
+				job.generated_text = generated_text
+				break
+
+		job.text_generation_candidates = candidate_log
+
+	def get_rejection_reason(self, job, generated_text):
+		"""
+		Returns the reason the generated text fails validation,
+		or None if the text can be posted.
+		"""
+
+		# Check for any negative keywords in the generated text and if so, return nothing
+		negative_keyword_matches = self.test_text_against_keywords(job.bot_username, generated_text)
+		if negative_keyword_matches:
+			# A negative keyword was found, so don't post this text back to reddit
+			logging.info(f"Negative keywords {negative_keyword_matches} found in generated text, this text will be rejected.")
+			return f"negative keywords {', '.join(negative_keyword_matches)}"
+
+		# Perform a very basic validation of the generated text
+		prompt = job.text_generation_parameters.get('prompt', '')
+		valid = self.validate_generated_text(job.source_name, prompt, generated_text)
+		if not valid:
+			logging.info(f"Generated text for {job} failed validation, this text will be rejected.")
+			return 'failed validation'
+
+		toxicity_failure = self.validate_toxicity(job.bot_username, prompt, generated_text)
+		if toxicity_failure:
+			logging.info(f"Generated text for {job} failed toxicity test, this text will be rejected.-> {generated_text}")
+			return 'failed toxicity test'
+
+		return None
+
+	def generate_text(self, bot_username, text_generation_parameters, source_name=None):
 
 		# pop the prompt out from the args
 		prompt = text_generation_parameters.pop('prompt', '')
 
-		output_list = model.generate(prompt=prompt, args=text_generation_parameters)
+		output_list = self.generate_text_batch(bot_username, [prompt], text_generation_parameters, [source_name])
+
+		if output_list and output_list[0]:
+			return output_list[0][0]
+
+	def generate_text_batch(self, bot_username, prompts, text_generation_parameters, source_names=None, abort_checks=None):
+		"""
+		Generate text for a list of prompts in one padded generate call.
+		The source_names are the job types, used to stop generating once each text is complete.
+		The optional abort_checks, one per prompt, abandon candidates as soon as they will fail validation.
+		Returns a list of the num_return_sequences texts generated for each prompt, in the same order as the prompts.
+		"""
+		return self.generate_text_batch_async(bot_username, prompts, text_generation_parameters, source_names, abort_checks).result()
+
+	def generate_text_batch_async(self, bot_username, prompts, text_generation_parameters, source_names=None, abort_checks=None):
+		"""
+		The same as generate_text_batch, but returns a Future of the result.
+		In worker mode the generation runs in a worker process, otherwise it has finished by the time this returns.
+		"""
+		model_path = self._get_model_path(bot_username)
+		backend = self._get_backend(bot_username)
+		source_names = source_names or [None] * len(prompts)
+
+		if self._worker_pool:
+			return self._worker_pool.submit(model_path, prompts, text_generation_parameters, source_names, backend, abort_checks)
+
+		future = Future()
 
-		end_time = time.time()
-		duration = round(end_time - start_time, 1)
+		try:
+			start_time = time.time()
 
-		logging.info(f'{len(output_list)} sample(s) of text generated in {duration} seconds.')
+			output_list = self._text_generator.generate(model_path, prompts, text_generation_parameters, source_names, backend, abort_checks)
 
-		if output_list:
-			return output_list[0]
+			end_time = time.time()
+			duration = round(end_time - start_time, 1)
+
+			logging.info(f'{sum(len(sequences) for sequences in output_list)} sample(s) of text generated in {duration} seconds.')
+			future.set_result(output_list)
+
+		except Exception as e:
+			future.set_exception(e)
+
+		return future
 
 	def top_pending_jobs(self):
 		"""
 		Get a list of jobs that need text to be generated, by treating
 		each database Thing record as a 'job'.
 		Three attempts at text generation are allowed.
+		The jobs are in the order the scheduler has given them,
+		and jobs past their deadline are failed instead of being returned.
+		The returned jobs are leased to this generator, jobs leased to other generators are left alone.
 
 		"""
 
 		query = db_Thing.select(db_Thing).\
 					where(db_Thing.status == 3).\
+					where((db_Thing.lease_owner.is_null()) | (db_Thing.lease_expires < time.time()) | (db_Thing.lease_owner == self._worker_id)).\
 					order_by(db_Thing.created_utc)
-		return list(query)
+
+		jobs, expired_jobs = self._scheduler.schedule(list(query))
+
+		for job in expired_jobs:
+			self._scheduler.expire(job)
+
+		# Another generator may claim some of the jobs first
+		scheduled_jobs = jobs[:self._claim_limit]
+		if not scheduled_jobs:
+			return []
+
+		claimed_jobs = {job.id: job for job in claim_jobs(db_Thing.select(db_Thing).where(db_Thing.id.in_([job.id for job in scheduled_jobs])),
+						self._worker_id, self._lease_seconds)}
+
+		return [claimed_jobs[job.id] for job in scheduled_jobs if job.id in claimed_jobs]
+
+	def _get_model_path(self, bot_username):
+		return (ROOT_DIR / self._config[bot_username]['text_model_path']).resolve()
+
+	def _get_backend(self, bot_username):
+		# The GPU can only be used with the default pytorch backend
+		return self._config[bot_username].get('text_generation_backend', 'pytorch')
 
 	def test_text_against_keywords(self, bot_username, generated_text):
-		# Load the keyword helper with this bot's config
-		keyword_helper = KeywordHelper(bot_username)
+		# The shared keyword helper for this bot's config
+		keyword_helper = get_keyword_helper(bot_username)
 		return keyword_helper.negative_keyword_matches(generated_text)
 
 	def validate_toxicity(self, bot_username, prompt, generated_text):
@@ -154,9 +465,14 @@ class ModelTextGenerator(threading.Thread, TaggingMixin):
 		new_text = generated_text[len(prompt):]
 		tagless_new_text = self.remove_tags_from_string(new_text)
 
-		# Reconfigure the toxicity helper to use the bot's config
-		self._toxicity_helper.load_config_section(bot_username)
-		return self._toxicity_helper.text_above_toxicity_threshold(tagless_new_text)
+		# Score the text against the bot's own thresholds
+		toxicity_helper = self._get_toxicity_helper()
+		return toxicity_helper.text_above_toxicity_threshold(tagless_new_text, toxicity_helper.get_threshold_profile(bot_username))
+
+	def _get_toxicity_helper(self):
+		if self._toxicity_helper is None:
+			self._toxicity_helper = ToxicityHelper()
+		return self._toxicity_helper
 
 	def validate_generated_text(self, source_name, prompt, generated_text):
 
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import threading
+
+from collections import OrderedDict
+
+
+class PrefixCache():
+	"""
+	An LRU cache of transformer past key values for prompts that have already been processed.
+	Replies in the same thread share the submission and the first comments at the start of the prompt,
+	so a new prompt only needs to run its new suffix through the model.
+
+	A prompt's past is stored once, and indexed by a hash of its tokens at every block_size boundary.
+	Because attention is causal, the past of the first n tokens is the same whatever follows them,
+	so a slice of a stored past can be used for any prompt sharing those first n tokens.
+	"""
+
+	def __init__(self, max_entries=4, block_size=32):
+		self._max_entries = max_entries
+		self._block_size = block_size
+
+		# entry key -> (model key, token ids, past key values)
+		self._entries = OrderedDict()
+		# (model key, hash of the first n tokens) -> (entry key, n)
+		self._block_index = {}
+		self._lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+
+	def longest_prefix(self, model_key, input_ids):
+		"""
+		Find the longest cached prefix of input_ids.
+		Returns the prefix length and the past key values sliced to that length,
+		or (0, None) if no prefix is cached.
+		At least one token of input_ids is always left over, to produce the next token's logits.
+		"""
+		with self._lock:
+			for length in self._block_lengths(len(input_ids) - 1, reverse=True):
+				block = self._block_index.get((model_key, hash(tuple(input_ids[:length]))))
+				if block is None:
+					continue
+
+				entry_key, _ = block
+				_, entry_ids, past_key_values = self._entries[entry_key]
+				if entry_ids[:length] != tuple(input_ids[:length]):
+					# Hash collision
+					continue
+
+				self._entries.move_to_end(entry_key)
+				self.hits += 1
+				return length, slice_past_key_values(past_key_values, length)
+
+			self.misses += 1
+			return 0, None
+
+	def add(self, model_key, input_ids, past_key_values):
+		"""
+		Store the past key values of a processed prompt.
+		"""
+		if self._max_entries < 1:
+			return
+
+		input_ids = tuple(input_ids)
+		entry_key = (model_key, hash(input_ids))
+
+		with self._lock:
+			if entry_key in self._entries:
+				self._entries.move_to_end(entry_key)
+				return
+
+			self._entries[entry_key] = (model_key, input_ids, past_key_values)
+			for length in self._block_lengths(len(input_ids)):
+				self._block_index[(model_key, hash(input_ids[:length]))] = (entry_key, length)
+
+			while len(self._entries) > self._max_entries:
+				self._remove(next(iter(self._entries)))
+
+	def clear(self, model_key=None):
+		with self._lock:
+			for entry_key in [k for k, v in self._entries.items() if model_key is None or v[0] == model_key]:
+				self._remove(entry_key)
+
+	def stats(self):
+		return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+	def _remove(self, entry_key):
+		model_key, input_ids, _ = self._entries.pop(entry_key)
+		for length in self._block_lengths(len(input_ids)):
+			block_key = (model_key, hash(input_ids[:length]))
+			if self._block_index.get(block_key, (None,))[0] == entry_key:
+				del self._block_index[block_key]
+
+	def _block_lengths(self, max_length, reverse=False):
+		lengths = range(self._block_size, max_length + 1, self._block_size)
+		return reversed(lengths) if reverse else lengths
+
+
+def slice_past_key_values(past_key_values, length):
+	# The past is a (key, value) pair per layer, shaped [batch, heads, sequence, head size]
+	return tuple((key[:, :, :length], value[:, :, :length]) for key, value in past_key_values)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import torch
+
+
+def legacy_past_key_values(past_key_values):
+	# Newer versions of transformers return a Cache object instead of tuples
+	if hasattr(past_key_values, 'to_legacy_cache'):
+		return past_key_values.to_legacy_cache()
+	return past_key_values
+
+
+def step_inputs(input_ids, sequence_length):
+	"""
+	The inputs for a forward pass of input_ids, a [batch, new tokens] tensor, that continues a past
+	and ends at sequence_length. Nothing is padded, so every position is attended to.
+	The position ids and attention mask are always passed, because an ONNX Runtime graph
+	exported with past key values requires them.
+	"""
+	batch_size, new_length = input_ids.shape
+	position_ids = torch.arange(sequence_length - new_length, sequence_length, device=input_ids.device).expand(batch_size, -1)
+	attention_mask = torch.ones((batch_size, sequence_length), dtype=torch.long, device=input_ids.device)
+
+	return {'input_ids': input_ids, 'attention_mask': attention_mask, 'position_ids': position_ids}
+
+
+def prefill(model, input_ids, past_key_values=None, prefix_length=0):
+	"""
+	Run the prompt through the model, skipping the first prefix_length tokens that are already in past_key_values.
+	input_ids is a list of token ids.
+	Returns the logits for the token after the prompt and the past key values of the whole prompt.
+	"""
+	suffix_ids = torch.tensor([input_ids[prefix_length:]], device=model.device)
+
+	with torch.no_grad():
+		outputs = model(**step_inputs(suffix_ids, len(input_ids)), past_key_values=past_key_values, use_cache=True)
+
+	return outputs.logits[:, -1, :], legacy_past_key_values(outputs.past_key_values)
+
+
+def sample_tokens(model, input_ids, next_token_logits, past_key_values, max_new_tokens, num_return_sequences=1,
+		temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0, eos_token_id=None, stopped_rows=None):
+	"""
+	Sample new tokens one step at a time, continuing from a prefilled prompt.
+	The same logits processing as transformers' generate is applied: repetition penalty, temperature, top-k, then top-p.
+	Every sequence starts from the same prompt, so the prompt's past is shared by expanding it across the batch.
+	Yields the row numbers of the sequences still being generated, and a tensor of their new tokens, at every step.
+	A sequence stops once it produces eos_token_id, or when the caller adds its row to stopped_rows.
+	Stopped sequences are dropped from the batch, so no more time is spent on them.
+	"""
+	stopped_rows = stopped_rows if stopped_rows is not None else set()
+	rows = list(range(num_return_sequences))
+
+	next_token_logits = next_token_logits.expand(num_return_sequences, -1)
+	past_key_values = tuple((key.expand(num_return_sequences, -1, -1, -1), value.expand(num_return_sequences, -1, -1, -1)) for key, value in past_key_values)
+
+	sequences = torch.tensor([input_ids], device=model.device).expand(num_return_sequences, -1)
+
+	for _ in range(max_new_tokens):
+
+		scores = next_token_logits.float()
+
+		if repetition_penalty != 1.0:
+			previous_scores = torch.gather(scores, 1, sequences)
+			previous_scores = torch.where(previous_scores < 0, previous_scores * repetition_penalty, previous_scores / repetition_penalty)
+			scores = scores.scatter(1, sequences, previous_scores)
+
+		if temperature != 1.0:
+			scores = scores / temperature
+
+		if top_k:
+			kth_best_score = torch.topk(scores, min(top_k, scores.shape[-1]))[0][..., -1, None]
+			scores = scores.masked_fill(scores < kth_best_score, -float('inf'))
+
+		if top_p < 1.0:
+			# Remove the least likely tokens whose probabilities add up to no more than 1 - top_p, always keeping the most likely
+			sorted_scores, sorted_indices = torch.sort(scores, descending=False)
+			cumulative_probs = torch.softmax(sorted_scores, dim=-1).cumsum(dim=-1)
+			sorted_to_remove = cumulative_probs <= (1 - top_p)
+			sorted_to_remove[..., -1:] = False
+			scores = scores.masked_fill(sorted_to_remove.scatter(1, sorted_indices, sorted_to_remove), -float('inf'))
+
+		next_tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+
+		if eos_token_id is not None:
+			stopped_rows.update(row for row, token in zip(rows, next_tokens.tolist()) if token == eos_token_id)
+
+		sequences = torch.cat([sequences, next_tokens[:, None]], dim=-1)
+
+		yield rows, next_tokens
+
+		active = [i for i, row in enumerate(rows) if row not in stopped_rows]
+		if not active:
+			return
+
+		if len(active) < len(rows):
+			# Drop the stopped sequences from the batch
+			index = torch.tensor(active, device=model.device)
+			rows = [rows[i] for i in active]
+			next_tokens = next_tokens[index]
+			sequences = sequences[index]
+			past_key_values = tuple((key[index], value[index]) for key, value in past_key_values)
+
+		with torch.no_grad():
+			outputs = model(**step_inputs(next_tokens[:, None], sequences.shape[1]), past_key_values=past_key_values, use_cache=True)
+
+		next_token_logits = outputs.logits[:, -1, :]
+		past_key_values = legacy_past_key_values(outputs.past_key_values)
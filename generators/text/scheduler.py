@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+
+from datetime import datetime, timezone
+
+# The priority classes of text generation jobs, most urgent first
+PRIORITY_MENTION = 0
+PRIORITY_OWN_THREAD = 1
+PRIORITY_NEW_SUBMISSION = 2
+PRIORITY_REPLY = 3
+
+# The names used for each priority class in ssi-bot.ini
+PRIORITY_NAMES = {
+	PRIORITY_MENTION: 'mention',
+	PRIORITY_OWN_THREAD: 'own_thread',
+	PRIORITY_NEW_SUBMISSION: 'new_submission',
+	PRIORITY_REPLY: 'reply',
+}
+
+def get_job_priority(job):
+	# Jobs recorded before priorities were stored get theirs from the source name
+	if job.priority is not None:
+		return job.priority
+	if job.source_name == 't3_new_submission':
+		return PRIORITY_NEW_SUBMISSION
+	if job.source_name.startswith('t4_'):
+		return PRIORITY_MENTION
+	return PRIORITY_REPLY
+
+
+def parse_deadlines(deadlines_string):
+	"""
+	Parse a config string of deadlines in minutes, eg. mention=720, reply=180.
+	Only the classes that are listed have a deadline.
+	"""
+	deadlines = {}
+	name_priorities = {name: priority for priority, name in PRIORITY_NAMES.items()}
+
+	for name, minutes in [x.split('=') for x in deadlines_string.split(',') if x.strip()]:
+		deadlines[name_priorities[name.strip().lower()]] = float(minutes)
+
+	return deadlines
+
+
+class GenerationScheduler():
+	"""
+	Orders the text generation queue so that the jobs users notice go first.
+	Jobs are taken strictly by priority class, and within a class each bot takes a turn,
+	oldest job first, so one busy bot can't starve the others.
+	If a class has a deadline, in minutes, its jobs past it are expired without spending model time on them.
+	No class has a deadline unless one is given.
+	"""
+
+	def __init__(self, deadlines=None):
+		self._deadlines = deadlines or {}
+
+	def schedule(self, jobs, now=None):
+		"""
+		Returns the jobs that are still worth generating, in the order they should be generated,
+		and the jobs that have passed their deadline.
+		"""
+		now = now or time.time()
+
+		ready_jobs = {}
+		expired_jobs = []
+
+		for job in jobs:
+			priority = get_job_priority(job)
+			deadline = self._deadlines.get(priority)
+
+			if deadline is not None and (now - self._created_timestamp(job)) / 60 > deadline:
+				expired_jobs.append(job)
+			else:
+				ready_jobs.setdefault(priority, []).append(job)
+
+		ordered_jobs = []
+		for priority in sorted(ready_jobs):
+			ordered_jobs += self._round_robin_by_bot(ready_jobs[priority])
+
+		return ordered_jobs, expired_jobs
+
+	def expire(self, job):
+		# Fail the job so it leaves the queue
+		logging.info(f"Job {job.id} for {job.bot_username} passed its {PRIORITY_NAMES[get_job_priority(job)]} deadline, it will not be generated.")
+		job.status = 9
+		job.save()
+
+	def _round_robin_by_bot(self, jobs):
+		bot_queues = {}
+		for job in sorted(jobs, key=self._created_timestamp):
+			bot_queues.setdefault(job.bot_username, []).append(job)
+
+		# The bot with the oldest job goes first in each round
+		queues = list(bot_queues.values())
+		ordered_jobs = []
+
+		while queues:
+			ordered_jobs += [queue.pop(0) for queue in queues]
+			queues = [queue for queue in queues if queue]
+
+		return ordered_jobs
+
+	def _created_timestamp(self, job):
+		created_utc = job.created_utc
+		# Records read from the database have a naive UTC datetime, new records may still have a timestamp
+		if isinstance(created_utc, datetime):
+			return created_utc.replace(tzinfo=timezone.utc).timestamp()
+		return created_utc
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+import logging
+
+from transformers import StoppingCriteria
+
+
+class CompletedTextStoppingCriteria(StoppingCriteria):
+	"""
+	Stops a generate call once every sequence in the batch contains its terminating tag.
+	Text after the tag is discarded when the reply or submission is extracted,
+	so there is no point generating it.
+
+	completion_checks is a list with one function per prompt. Each function
+	is passed the text generated so far (without the prompt) and returns True when it is complete.
+
+	abort_checks is an optional list with one function per prompt, passed the text generated so far
+	and the number of tokens. It returns a reason when the sequence will fail validation,
+	and the sequence is treated as finished.
+	"""
+
+	def __init__(self, tokenizer, prompt_length, completion_checks, num_return_sequences=1, abort_checks=None):
+		self._tokenizer = tokenizer
+		self._prompt_length = prompt_length
+		self._completion_checks = completion_checks
+		self._abort_checks = abort_checks
+		self._num_return_sequences = num_return_sequences
+		self._completed = set()
+
+	def __call__(self, input_ids, scores, **kwargs):
+
+		for row, sequence in enumerate(input_ids):
+			if row in self._completed:
+				continue
+
+			new_text = self._tokenizer.decode(sequence[self._prompt_length:], clean_up_tokenization_spaces=True)
+			if self._completion_checks[row // self._num_return_sequences](new_text):
+				self._completed.add(row)
+				continue
+
+			abort_check = self._abort_checks[row // self._num_return_sequences] if self._abort_checks else None
+			if abort_check:
+				num_tokens = len(sequence) - self._prompt_length
+				reason = abort_check(new_text, num_tokens)
+				if reason:
+					logging.info(f"Aborted a candidate after {num_tokens} tokens, {reason}.")
+					self._completed.add(row)
+
+		return len(self._completed) == len(input_ids)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+
+from functools import partial
+
+from transformers import StoppingCriteriaList
+
+from reddit_io.tagging_mixin import TaggingMixin
+
+from .model_cache import ModelCache, model_cache_key
+from .prefix_cache import PrefixCache
+from .sampling import prefill, sample_tokens
+from .stopping_criteria import CompletedTextStoppingCriteria
+
+
+class TextGenerator(TaggingMixin):
+	"""
+	Generates text from prompts with the models in its model cache.
+	This holds no reddit or database state, so it can run in the main process
+	or in a generation worker process.
+	"""
+
+	def __init__(self, memory_budget=0, use_gpu=False, prefix_cache_size=4):
+
+		# Loaded models stay resident between jobs, and are shared between bots with the same text_model_path.
+		self._model_cache = ModelCache(memory_budget=memory_budget, use_gpu=use_gpu)
+
+		# The past key values of this many recent prompts are kept, so that replies in the same thread
+		# only have to process the part of their prompt that differs.
+		self._prefix_cache = PrefixCache(max_entries=prefix_cache_size) if prefix_cache_size > 0 else None
+
+	@property
+	def model_cache(self):
+		return self._model_cache
+
+	def generate(self, model_path, prompts, text_generation_parameters, source_names, backend='pytorch', abort_checks=None):
+		"""
+		Generate text for a list of prompts with the model at model_path, run with the inference backend.
+		The source_names are the job types, used to stop generating once each text is complete.
+		abort_checks is an optional list of EarlyAbortChecks, one per prompt, to abandon candidates that will fail validation.
+		Returns a list of the num_return_sequences texts generated for each prompt, in the same order as the prompts.
+		"""
+		model = self._model_cache.get(model_path, backend)
+		abort_checks = abort_checks or [None] * len(prompts)
+
+		if self._prefix_cache and len(prompts) == 1:
+			# A single prompt can continue from the cached past of an earlier prompt in the same thread
+			model_key = model_cache_key(model_path, backend)
+			return [self._generate_sequences_from_prefix(model, model_key, prompts[0], text_generation_parameters, source_names[0], abort_checks[0])]
+
+		return self._generate_sequences(model, prompts, text_generation_parameters, source_names, abort_checks)
+
+	def warm_up(self, model_path, backend='pytorch'):
+		"""
+		Load a model and run a short generation through it, so the first job doesn't wait
+		for the weights to load or for the first forward pass to allocate its memory.
+		Returns the seconds taken to load the model and to run the first generation.
+		"""
+		start_time = time.time()
+		model = self._model_cache.get(model_path, backend)
+		load_time = time.time() - start_time
+
+		start_time = time.time()
+		self._generate_sequences(model, [self._reply_start_tag], {'max_length': 2}, [None], [None])
+		generation_time = time.time() - start_time
+
+		return load_time, generation_time
+
+	def _generate_sequences(self, model, prompts, text_generation_parameters, source_names, abort_checks):
+		"""
+		Runs the prompts through the underlying transformers model in a single batch.
+		The prompts are left padded so that every sequence continues from the end of its own prompt.
+		An aborted sequence stops counting towards the batch, but isn't replaced.
+		Returns a list, for each prompt, of the num_return_sequences texts generated.
+		"""
+		tokenizer = model.tokenizer
+
+		if tokenizer.pad_token is None:
+			tokenizer.pad_token = tokenizer.eos_token
+		tokenizer.padding_side = 'left'
+
+		encoded_prompts = tokenizer(prompts, add_special_tokens=False, return_tensors='pt', padding=True).to(model.device)
+		prompt_length = encoded_prompts['input_ids'].shape[1]
+
+		max_prompt_length = self._max_prompt_length(model, text_generation_parameters)
+		if prompt_length > max_prompt_length:
+			# The prompts are left padded, so keeping the last columns cuts each long prompt from the start
+			logging.info(f"Truncating prompts of {prompt_length} tokens to their last {max_prompt_length}, to leave room in the model's context.")
+			encoded_prompts = {key: value[:, -max_prompt_length:] for key, value in encoded_prompts.items()}
+			prompt_length = max_prompt_length
+
+		num_return_sequences = text_generation_parameters.get('num_return_sequences', 1)
+		stop_token = text_generation_parameters.get('stop_token')
+
+		# max_length is the number of new tokens, as it is with simpletransformers,
+		# but the total can't go past the model's context size.
+		max_length = min(prompt_length + text_generation_parameters.get('max_length', 1024), model.model.config.n_positions)
+
+		# Stop as soon as every sequence has reached the tag that ends its reply or submission
+		completion_checks = [partial(self.is_generation_complete, source_name, prompt) for source_name, prompt in zip(source_names, prompts)]
+		stopping_criteria = CompletedTextStoppingCriteria(tokenizer, prompt_length, completion_checks, num_return_sequences, abort_checks)
+
+		output_sequences = model.model.generate(
+			**encoded_prompts,
+			max_length=max_length,
+			temperature=text_generation_parameters.get('temperature', 1.0),
+			top_k=text_generation_parameters.get('top_k', 0),
+			# Nucleus sampling, with the same default as simpletransformers' LanguageGenerationArgs
+			top_p=text_generation_parameters.get('top_p', 0.95),
+			repetition_penalty=text_generation_parameters.get('repetition_penalty', 1.0),
+			do_sample=True,
+			num_return_sequences=num_return_sequences,
+			pad_token_id=tokenizer.pad_token_id,
+			stopping_criteria=StoppingCriteriaList([stopping_criteria]),
+		)
+
+		output_list = []
+
+		for i, prompt in enumerate(prompts):
+			generated_sequences = output_sequences[i * num_return_sequences:(i + 1) * num_return_sequences]
+			output_list.append([self._decode_generated_tokens(tokenizer, prompt, generated_sequence[prompt_length:], stop_token) for generated_sequence in generated_sequences])
+
+		return output_list
+
+	def _generate_sequences_from_prefix(self, model, model_key, prompt, text_generation_parameters, source_name, abort_check=None):
+		"""
+		Generates the sequences for one prompt, only running the part of the prompt
+		that isn't already in the prefix cache through the model.
+		Candidates that fail the abort_check part way through are replaced with fresh samples,
+		for as long as the token budget of num_return_sequences full length sequences allows.
+		Returns a list of the num_return_sequences texts generated.
+		"""
+		tokenizer = model.tokenizer
+		input_ids = tokenizer.encode(prompt, add_special_tokens=False)
+
+		max_prompt_length = self._max_prompt_length(model, text_generation_parameters)
+		if len(input_ids) > max_prompt_length:
+			logging.info(f"Truncating a prompt of {len(input_ids)} tokens to its last {max_prompt_length}, to leave room in the model's context.")
+			input_ids = input_ids[-max_prompt_length:]
+
+		num_return_sequences = text_generation_parameters.get('num_return_sequences', 1)
+		stop_token = text_generation_parameters.get('stop_token')
+		max_new_tokens = min(text_generation_parameters.get('max_length', 1024), model.model.config.n_positions - len(input_ids))
+
+		prefix_length, past_key_values = self._prefix_cache.longest_prefix(model_key, input_ids)
+		if prefix_length:
+			logging.info(f"Reusing {prefix_length} of {len(input_ids)} prompt tokens from the prefix cache.")
+
+		next_token_logits, past_key_values = prefill(model.model, input_ids, past_key_values, prefix_length)
+		self._prefix_cache.add(model_key, input_ids, past_key_values)
+
+		token_budget = num_return_sequences * max_new_tokens
+		tokens_spent = 0
+
+		completed_sequences = []
+		aborted_sequences = []
+		num_samples = num_return_sequences
+
+		while num_samples and tokens_spent < token_budget:
+
+			aborted_sequences = []
+			for tokens, abort_reason in self.stream_sequences(model, prompt, input_ids, next_token_logits, past_key_values,
+					max_new_tokens, num_samples, text_generation_parameters, source_name, abort_check):
+
+				tokens_spent += len(tokens)
+				if abort_reason:
+					aborted_sequences.append(tokens)
+				else:
+					completed_sequences.append(tokens)
+
+			num_samples = len(aborted_sequences)
+
+		# Out of budget, so any candidates that were aborted are returned for validation to reject
+		sequences = completed_sequences + aborted_sequences
+		return [self._decode_generated_tokens(tokenizer, prompt, tokens, stop_token) for tokens in sequences]
+
+	def _max_prompt_length(self, model, text_generation_parameters):
+		"""
+		The longest prompt, in tokens, that still leaves room in the model's context to generate text.
+		The room left is max_length tokens, up to a quarter of the context,
+		the same share that the default prompt_token_budget leaves for the reply.
+		Longer prompts are cut from the start, so they don't silently generate nothing.
+		"""
+		n_positions = model.model.config.n_positions
+		return n_positions - max(1, min(text_generation_parameters.get('max_length', 1024), n_positions // 4))
+
+	def stream_sequences(self, model, prompt, input_ids, next_token_logits, past_key_values, max_new_tokens,
+			num_sequences, text_generation_parameters, source_name, abort_check=None):
+		"""
+		Samples num_sequences continuations of a prefilled prompt, decoding each one as it grows.
+		A sequence stops when it is complete, or as soon as the abort_check finds it will fail validation.
+		Yields the token ids of each sequence and the reason it was aborted, or None, as soon as it stops.
+		"""
+		tokenizer = model.tokenizer
+		is_complete = partial(self.is_generation_complete, source_name, prompt)
+
+		new_tokens = [[] for _ in range(num_sequences)]
+		stopped_rows = set()
+		yielded_rows = set()
+
+		for rows, next_tokens in sample_tokens(model.model, input_ids, next_token_logits, past_key_values, max_new_tokens,
+				num_return_sequences=num_sequences,
+				temperature=text_generation_parameters.get('temperature', 1.0),
+				top_k=text_generation_parameters.get('top_k', 0),
+				top_p=text_generation_parameters.get('top_p', 0.95),
+				repetition_penalty=text_generation_parameters.get('repetition_penalty', 1.0),
+				eos_token_id=tokenizer.eos_token_id,
+				stopped_rows=stopped_rows):
+
+			for row, token in zip(rows, next_tokens.tolist()):
+				new_tokens[row].append(token)
+
+				if row in stopped_rows:
+					# The sampler stopped it at the end of text token
+					yielded_rows.add(row)
+					yield new_tokens[row], None
+					continue
+
+				new_text = tokenizer.decode(new_tokens[row], clean_up_tokenization_spaces=True)
+				if is_complete(new_text):
+					stopped_rows.add(row)
+					yielded_rows.add(row)
+					yield new_tokens[row], None
+					continue
+
+				abort_reason = abort_check(new_text, len(new_tokens[row])) if abort_check else None
+				if abort_reason:
+					logging.info(f"Aborted a candidate after {len(new_tokens[row])} tokens, {abort_reason}.")
+					stopped_rows.add(row)
+					yielded_rows.add(row)
+					yield new_tokens[row], abort_reason
+
+		# The sequences that ran out of tokens
+		for row, tokens in enumerate(new_tokens):
+			if row not in yielded_rows:
+				yield tokens, None
+
+	def _decode_generated_tokens(self, tokenizer, prompt, token_ids, stop_token):
+		text = tokenizer.decode(token_ids, clean_up_tokenization_spaces=True)
+
+		# Remove all text after the stop token
+		if stop_token and stop_token in text:
+			text = text[:text.find(stop_token)]
+
+		return prompt + text
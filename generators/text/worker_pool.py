@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import torch
+
+from .text_generator import TextGenerator
+
+# The text generator of a worker process, created when the worker starts
+_worker_text_generator = None
+# The time taken to warm up each model when the worker started
+_worker_warm_up_times = {}
+
+
+def _initialise_worker(core_sets, generator_args, warm_up_models):
+	global _worker_text_generator
+
+	# Worker processes are spawned, so logging needs to be configured again
+	logging.basicConfig(format='%(asctime)s (%(processName)s) %(levelname)s %(message)s', level=logging.INFO)
+
+	try:
+		cores = core_sets.get_nowait()
+	except Exception:
+		cores = None
+
+	if cores and hasattr(os, 'sched_setaffinity'):
+		# Pin the worker to its own cores, and size torch's thread pool to match
+		os.sched_setaffinity(0, cores)
+		torch.set_num_threads(len(cores))
+		logging.info(f"Generation worker pinned to cores {sorted(cores)}")
+
+	_worker_text_generator = TextGenerator(**generator_args)
+
+	for model_path, backend in warm_up_models:
+		try:
+			_worker_warm_up_times[(model_path, backend)] = _worker_text_generator.warm_up(model_path, backend)
+		except Exception:
+			logging.exception(f"Warming up {model_path} ({backend}) failed")
+
+
+def _get_warm_up_times():
+	return os.getpid(), _worker_warm_up_times
+
+
+def _generate(model_path, prompts, text_generation_parameters, source_names, backend, abort_checks):
+
+	start_time = time.time()
+
+	output_list = _worker_text_generator.generate(model_path, prompts, text_generation_parameters, source_names, backend, abort_checks)
+
+	end_time = time.time()
+	duration = round(end_time - start_time, 1)
+
+	logging.info(f'{sum(len(sequences) for sequences in output_list)} sample(s) of text generated in {duration} seconds.')
+
+	# The pid tells the pool which worker now has the model loaded
+	return os.getpid(), output_list
+
+
+class GenerationWorkerPool():
+	"""
+	Runs text generation in separate processes so that it isn't competing for the GIL
+	with the reddit IO threads and the other daemons, and so several batches can run at once.
+	Each worker keeps its own loaded models, and is pinned to an equal share of the available cores.
+	Workers load and warm up the warm_up_models, a list of (model path, backend), when they start.
+	"""
+
+	def __init__(self, num_workers, generator_args, warm_up_models=None):
+
+		self._num_workers = num_workers
+
+		# (model path, backend) -> the pids of the workers that have generated with it, and so have it loaded
+		self._loaded_models = {}
+		self._loaded_models_lock = threading.Lock()
+
+		# Spawn rather than fork, as torch's thread pools don't survive a fork
+		context = multiprocessing.get_context('spawn')
+
+		core_sets = context.Queue()
+		for cores in self._split_cores(num_workers):
+			core_sets.put(cores)
+
+		self._executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=context,
+			initializer=_initialise_worker, initargs=(core_sets, generator_args, [(str(path), backend) for path, backend in warm_up_models or []]))
+
+		logging.info(f"Started a pool of {num_workers} text generation workers")
+
+	def submit(self, model_path, prompts, text_generation_parameters, source_names, backend='pytorch', abort_checks=None):
+		"""
+		Queue a generation on the next free worker.
+		Returns a Future of the list of texts generated for each prompt.
+		"""
+		model = (str(model_path), backend)
+		future = Future()
+
+		def set_result(worker_future):
+			try:
+				pid, output_list = worker_future.result()
+			except BaseException as e:
+				future.set_exception(e)
+				return
+
+			self._add_loaded_model(pid, model)
+			future.set_result(output_list)
+
+		self._executor.submit(_generate, str(model_path), prompts, text_generation_parameters, source_names, backend, abort_checks).add_done_callback(set_result)
+		return future
+
+	def is_loaded_by_every_worker(self, model_path, backend='pytorch'):
+		"""
+		Whether every worker has reported generating with the model, so none of them will load another copy.
+		Workers are handed tasks by whichever is free, so until then any of them might.
+		"""
+		with self._loaded_models_lock:
+			return len(self._loaded_models.get((str(model_path), backend), ())) >= self._num_workers
+
+	def _add_loaded_model(self, pid, model):
+		with self._loaded_models_lock:
+			self._loaded_models.setdefault(model, set()).add(pid)
+
+	def warm_up(self):
+		"""
+		Start every worker, waiting until they have warmed up their models.
+		Returns the warm up times of each worker, as a dict of (model path, backend) -> (load seconds, generation seconds).
+		"""
+		# Workers are started as tasks arrive with none idle, so one task is queued for each of them.
+		# A worker that is ready first can take more than one, so tasks are queued until every worker has answered.
+		warm_up_times = {}
+
+		while len(warm_up_times) < self._num_workers:
+			futures = [self._executor.submit(_get_warm_up_times) for _ in range(self._num_workers - len(warm_up_times))]
+			answered = len(warm_up_times)
+
+			for future in futures:
+				pid, times = future.result()
+				warm_up_times[pid] = times
+
+			if len(warm_up_times) == answered:
+				# Only the workers that are ready answered, give the others time to finish warming up
+				time.sleep(1)
+
+		for pid, times in warm_up_times.items():
+			for model in times:
+				self._add_loaded_model(pid, model)
+
+		return list(warm_up_times.values())
+
+	def shutdown(self):
+		self._executor.shutdown(wait=False, cancel_futures=True)
+
+	def _split_cores(self, num_workers):
+		if hasattr(os, 'sched_getaffinity'):
+			available_cores = sorted(os.sched_getaffinity(0))
+		else:
+			available_cores = list(range(os.cpu_count() or 1))
+
+		if len(available_cores) < num_workers:
+			# Not enough cores to give each worker its own, so leave them unpinned
+			return [None] * num_workers
+
+		cores_per_worker = len(available_cores) // num_workers
+		return [set(available_cores[i * cores_per_worker:(i + 1) * cores_per_worker]) for i in range(num_workers)]
@@ -17,7 +17,8 @@ from pathlib import Path
 from reddit_io.tagging_mixin import TaggingMixin
 
 from bot_db.db import Thing as db_Thing
-from utils.memory import get_available_memory
+from bot_db.db import LeaseKeeper, claim_jobs, default_lease_seconds, get_worker_id, release_job
+from utils.memory import MemoryAdmission, PeakMemorySampler
 from utils import ROOT_DIR
 
 
@@ -27,8 +28,10 @@ class Text2Image(threading.Thread, TaggingMixin):
 	name = "Text2Image"
 
 	# The amount of RAM required to start, in KB
-	# The default value here is sufficient for a 380x380 image 
+	# The default value here is sufficient for a 380x380 image.
+	# On CPU it is replaced by the highest peak measured during a successful generation.
 	_memory_required = 8000000
+	_measured_peak_memory = 0
 
 	def __init__(self):
 		threading.Thread.__init__(self)
@@ -38,6 +41,12 @@ class Text2Image(threading.Thread, TaggingMixin):
 		self._config = ConfigParser()
 		self._config.read('ssi-bot.ini')
 
+		self._memory_admission = MemoryAdmission(self._use_gpu)
+
+		# Jobs are leased from the queue, one at a time as each image takes a long time to generate
+		self._worker_id = get_worker_id(self.name)
+		self._lease_seconds = self._config['DEFAULT'].getint('job_lease_seconds', default_lease_seconds)
+
 	def run(self):
 
 		while True:
@@ -51,7 +60,7 @@ class Text2Image(threading.Thread, TaggingMixin):
 				time.sleep(30)
 				continue
 
-			if get_available_memory(self._use_gpu) < self._memory_required:
+			if not self.admit_jobs(jobs):
 				# Not enough memory.. Sleep and start again
 				time.sleep(30)
 				continue
@@ -66,7 +75,9 @@ class Text2Image(threading.Thread, TaggingMixin):
 						# from the generated text and use it as the prompt
 						job.image_generation_parameters['prompt'] = self.extract_title_from_generated_text(job.generated_text)
 
-					image_path = self.generate_image(job.bot_username, job.image_generation_parameters.copy())
+					# An image can take longer to generate than a lease lasts, so it is renewed while it runs
+					with LeaseKeeper([job], self._worker_id, self._lease_seconds):
+						image_path = self.generate_image(job.bot_username, job.image_generation_parameters.copy())
 
 					if image_path:
 						job.generated_image_path = image_path
@@ -77,8 +88,21 @@ class Text2Image(threading.Thread, TaggingMixin):
 					time.sleep(30)
 				finally:
 					job.image_generation_attempts += 1
+					release_job(job)
 					job.save()
 
+	def admit_jobs(self, jobs):
+		# Returns True if there is enough memory to generate the jobs.
+		# If there isn't, the jobs are released so another generator can take them.
+		if self._memory_admission.admit('text2image', self._memory_required):
+			return True
+
+		for job in jobs:
+			release_job(job)
+			job.save()
+
+		return False
+
 	def generate_image(self, bot_username, image_generation_parameters):
 
 		vqgan_path = ROOT_DIR / self._config[bot_username]['vqgan-clip_path']
@@ -104,11 +128,18 @@ class Text2Image(threading.Thread, TaggingMixin):
 
 		p = subprocess.Popen(f"{cmd_change_directory} ; {cmd_generate}", shell=True, text=True,
 			stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-		for line in p.stdout:
-			# Stream the output from the subprocess into the logging
-			# Convert bytes to a string
-			logging.info(ftfy.fix_text(line.replace('\n', '')))
-		p.wait()
+
+		# The memory is sampled on a timer, because the output can be sparse
+		memory_sampler = PeakMemorySampler(p.pid, interval=0.5)
+		memory_sampler.start()
+		try:
+			for line in p.stdout:
+				# Stream the output from the subprocess into the logging
+				# Convert bytes to a string
+				logging.info(ftfy.fix_text(line.replace('\n', '')))
+			p.wait()
+		finally:
+			peak_memory = memory_sampler.stop()
 
 		end_time = time.time()
 		duration = round(end_time - start_time, 1)
@@ -120,14 +151,29 @@ class Text2Image(threading.Thread, TaggingMixin):
 		# assert os.path.getsize(filepath) > 100000
 		assert os.path.getsize(filepath) > 50000
 
+		if not self._use_gpu:
+			self._update_memory_required(peak_memory)
+
 		logging.info(f'{filename} image generated in {duration} seconds.')
 
 		# Return the filepath so it can be written into the database
 		return filepath
 
+	def _update_memory_required(self, peak_memory):
+		# The generation runs on the CPU, so its RAM usage is the measure of what the next one needs.
+		# Only successful runs are measured, and the highest peak is kept,
+		# so a run that was cut short can't lower the requirement.
+		if peak_memory <= self._measured_peak_memory:
+			return
+
+		logging.info(f"Image generation used a peak of {peak_memory:.0f} KB, previously estimated {self._memory_required:.0f} KB")
+		self._measured_peak_memory = peak_memory
+		self._memory_required = peak_memory
+
 	def top_pending_jobs(self):
 		"""
-		Get a list of jobs that need an image to be found via the scraper
+		Get a list of jobs that need an image to be generated.
+		The jobs are leased to this generator.
 
 		"""
 
@@ -135,4 +181,4 @@ class Text2Image(threading.Thread, TaggingMixin):
 					where(db_Thing.image_generation_parameters['type'] == 'text2image').\
 					where(db_Thing.status == 5).\
 					order_by(db_Thing.created_utc)
-		return list(query)
+		return claim_jobs(query, self._worker_id, self._lease_seconds, limit=1)
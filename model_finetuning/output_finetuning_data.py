@@ -60,9 +60,9 @@ if config['DEFAULT']['negative_users']:
 
 lowercase_author_list = [a.lower() for a in author_list]
 
-from utils.keyword_helper import KeywordHelper
+from utils.keyword_helper import get_keyword_helper
 # import the default negative keywords
-kw_helper = KeywordHelper()
+kw_helper = get_keyword_helper()
 default_negative_keywords = kw_helper._negative_keywords
 
 config_negative_keywords = []
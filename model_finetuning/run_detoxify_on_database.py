@@ -1,30 +1,169 @@
 #!/usr/bin/env python3
 
+# Scores the submissions and comments in the database with detoxify.
+# Rows are read in chunks in order of id, scored in batches, and written back with one UPDATE per chunk.
+# The last id written for each table is saved to a checkpoint file,
+# so a stopped run carries on from where it was when it is started again.
+# Usage, from the model_finetuning directory:
+# python run_detoxify_on_database.py --batch-size 64 --workers 4
+
+import argparse
+import json
+import os
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from multiprocessing import get_context
+
 import torch
 
 from detoxify import Detoxify
 from db import (Comment as db_Comment, Submission as db_Submission)
+from db import db_instance
 
+checkpoint_path = 'detoxify_checkpoint.json'
+
+# The detoxify model of this process, or of this worker process
+_detox = None
 
-def main():
+
+def _initialise(num_threads=None):
+	global _detox
+
+	if num_threads:
+		# Share the cores out between the worker processes
+		torch.set_num_threads(num_threads)
 
 	cuda_available = torch.cuda.is_available()
-	detox = Detoxify('unbiased-small', device='cuda' if cuda_available else 'cpu')
+	_detox = Detoxify('unbiased-small', device='cuda' if cuda_available else 'cpu')
+
+
+def predict_chunk(ids, texts, batch_size):
+	"""
+	Returns the ids and a prediction dict for each text.
+	"""
+	predictions = []
+
+	for i in range(0, len(texts), batch_size):
+		results = _detox.predict(texts[i:i + batch_size])
+		predictions += [{label: scores[j] for label, scores in results.items()} for j in range(len(results['toxicity']))]
+
+	return ids, predictions
+
+
+def read_chunks(model, text_fields, last_id, chunk_size):
+	"""
+	Yields the ids and texts of unscored rows after last_id, chunk_size rows at a time.
+	"""
+	while True:
+		rows = list(model.select(model.id, *text_fields).
+				where(model.detoxify_prediction.is_null(True)).
+				where(model.id > last_id).
+				order_by(model.id).
+				limit(chunk_size).
+				tuples())
+
+		if not rows:
+			return
+
+		last_id = rows[-1][0]
+		# The text is the same as the finetuning data uses, eg a submission's title and selftext combined
+		yield [row[0] for row in rows], [' '.join(row[1:]).strip() for row in rows]
+
+
+def write_predictions(model, ids, predictions):
+	rows = [model(id=id, detoxify_prediction=prediction) for id, prediction in zip(ids, predictions)]
+
+	with db_instance.atomic():
+		model.bulk_update(rows, fields=[model.detoxify_prediction])
+
 
-	all_submissions = db_Submission.select().where(db_Submission.detoxify_prediction.is_null(True))
+def load_checkpoint():
+	if os.path.exists(checkpoint_path):
+		with open(checkpoint_path) as f:
+			return json.load(f)
+	return {}
 
-	for s in all_submissions.iterator():
-		print('submission', s.id)
-		s.detoxify_prediction = detox.predict(f"{s.title} {s.selftext}".strip())
-		s.save()
 
-	all_comments = db_Comment.select().where(db_Comment.detoxify_prediction.is_null(True))
-	for c in all_comments.iterator():
-		print('comment', c.id)
-		c.detoxify_prediction = detox.predict(c.body)
-		c.save()
+def save_checkpoint(checkpoint):
+	# Replace the file in one step, so it is never left half written
+	with open(f'{checkpoint_path}.tmp', 'w') as f:
+		json.dump(checkpoint, f)
+	os.replace(f'{checkpoint_path}.tmp', checkpoint_path)
+
+
+def run_table(name, model, text_fields, checkpoint, executor, args):
+
+	last_id = checkpoint.get(name, '')
+	total = model.select().where(model.detoxify_prediction.is_null(True)).where(model.id > last_id).count()
+	print(f'{name}: {total} rows to score, starting after id {last_id!r}')
+
+	scored = 0
+	start_time = time.time()
+
+	# Chunks are written in the order they were read, so the checkpoint only ever passes written rows.
+	# A few chunks are kept in flight, to keep every worker busy without reading the whole table.
+	pending = deque()
+	chunks = read_chunks(model, text_fields, last_id, args.chunk_size)
+
+	while True:
+		while len(pending) < max(1, args.workers * 2):
+			chunk = next(chunks, None)
+			if chunk is None:
+				break
+			ids, texts = chunk
+			if executor:
+				pending.append(executor.submit(predict_chunk, ids, texts, args.batch_size))
+			else:
+				pending.append(predict_chunk(ids, texts, args.batch_size))
+
+		if not pending:
+			break
+
+		result = pending.popleft()
+		ids, predictions = result.result() if executor else result
+
+		write_predictions(model, ids, predictions)
+
+		checkpoint[name] = ids[-1]
+		save_checkpoint(checkpoint)
+
+		scored += len(ids)
+		rate = scored / (time.time() - start_time)
+		eta = timedelta(seconds=round((total - scored) / rate)) if rate else '?'
+		print(f'{name}: {scored}/{total} ({rate:.1f} rows/s, ETA {eta})')
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Score the submissions and comments in the database with detoxify")
+	parser.add_argument('--batch-size', type=int, default=32, help="the number of texts scored in one call to the model")
+	parser.add_argument('--chunk-size', type=int, default=1000, help="the number of rows read and written back at a time")
+	parser.add_argument('--workers', type=int, default=0, help="score in this many worker processes, 0 to score in this process")
+	parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and scan every table from the start")
+	args = parser.parse_args()
+
+	checkpoint = {} if args.restart else load_checkpoint()
+
+	executor = None
+	if args.workers:
+		num_threads = max(1, (os.cpu_count() or 1) // args.workers)
+		executor = ProcessPoolExecutor(args.workers, mp_context=get_context('spawn'),
+			initializer=_initialise, initargs=(num_threads,))
+	else:
+		_initialise()
+
+	try:
+		run_table('submission', db_Submission, [db_Submission.title, db_Submission.selftext], checkpoint, executor, args)
+		run_table('comment', db_Comment, [db_Comment.body], checkpoint, executor, args)
+	finally:
+		if executor:
+			executor.shutdown()
 
 	print('detoxify predictions complete')
 
+
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
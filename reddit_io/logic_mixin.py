@@ -3,11 +3,15 @@ import logging
 import random
 import re
 
+from collections import OrderedDict
 from datetime import datetime
 
 from praw.models import (Submission as praw_Submission, Comment as praw_Comment, Message as praw_Message)
 
+from generators.text.scheduler import PRIORITY_MENTION, PRIORITY_OWN_THREAD, PRIORITY_REPLY
+
 from .tagging_mixin import TaggingMixin
+from .thread_snapshots import SubmissionSnapshot
 
 
 class LogicMixin(TaggingMixin):
@@ -20,7 +24,15 @@ class LogicMixin(TaggingMixin):
 
 	_do_not_reply_bot_usernames = ['automoderator', 'reddit', 'profanitycounter']
 
-	def _collate_tagged_comment_history(self, loop_thing, to_level=6, use_reply_sense=False):
+	# The tokenizer of the bot's model and the number of tokens the collated prompt can use.
+	# Without a tokenizer the prompt is truncated by characters instead.
+	_prompt_tokenizer = None
+	_prompt_token_budget = 768
+
+	_tagged_segment_encodings = None
+	_tagged_segment_encodings_size = 1000
+
+	def _collate_tagged_comment_history(self, loop_thing, to_level=6, use_reply_sense=False, token_budget=None):
 		"""
 		Loop backwards (upwards in reddit terms) from the praw_thing through the comment up x times,
 		tagging the content text in the same way as the training data is
@@ -31,31 +43,38 @@ class LogicMixin(TaggingMixin):
 		Each <|tag|> behaves as metadata so the model knows the general writing style of
 		titles, replies and so forth.
 
+		When a prompt tokenizer is set, whole tagged segments are packed into token_budget tokens,
+		newest first. Otherwise the string is truncated by a character count.
+
 		"""
 		counter = 0
-		prefix = ''
+		# The tagged text of each thing, newest first
+		tagged_segments = []
 
 		while loop_thing and counter < to_level:
 
 			if isinstance(loop_thing, praw_Submission):
 
-				tagged_text = self.tag_submission(loop_thing, use_reply_sense)
-				prefix = tagged_text + prefix
+				tagged_segments.append(self.tag_submission(loop_thing, use_reply_sense))
 
 				# can't go any higher than a submission, so break the loop
 				break
 
 			elif isinstance(loop_thing, praw_Comment):
-				# It's a comment
-				tagged_text = self.tag_comment(loop_thing, use_reply_sense)
-				prefix = tagged_text + prefix
+				# It's a comment. Its whole thread is read at once, up to and including the submission
+				thread = self.get_comment_thread(loop_thing)
 
-				loop_thing = loop_thing.parent()
+				for i, snapshot in enumerate(thread[:to_level]):
+					if isinstance(snapshot, SubmissionSnapshot):
+						tagged_segments.append(self.tag_submission(snapshot, use_reply_sense))
+					else:
+						tagged_segments.append(self.tag_comment(snapshot, use_reply_sense, thread[i:]))
+
+				break
 
 			elif isinstance(loop_thing, praw_Message):
 
-				tagged_text = self.tag_message(loop_thing, use_reply_sense)
-				prefix = tagged_text + prefix
+				tagged_segments.append(self.tag_message(loop_thing, use_reply_sense))
 
 				if loop_thing.parent_id:
 					# Message's parent thing is read differently.
@@ -65,6 +84,11 @@ class LogicMixin(TaggingMixin):
 
 			counter += 1
 
+		if self._prompt_tokenizer:
+			return self._pack_tagged_segments(tagged_segments, token_budget or self._prompt_token_budget)
+
+		prefix = ''.join(reversed(tagged_segments))
+
 		if len(prefix) > 1500:
 			# The model can handle 1024 tokens, but a token is not just one character.
 			# Just truncate the long string to be safe and hope for the best :)
@@ -72,6 +96,59 @@ class LogicMixin(TaggingMixin):
 
 		return prefix
 
+	def _pack_tagged_segments(self, tagged_segments, token_budget):
+		"""
+		Join as many whole tagged segments as fit in the token budget, starting from the newest.
+		If even the newest segment doesn't fit, its opening tags are kept and only the end of its text,
+		so the tags aren't cut in half.
+		"""
+		packed_segments = []
+		total_tokens = 0
+
+		for segment in tagged_segments:
+			# Tokens can merge across the join between two segments,
+			# so the sum of the segment lengths is never less than the length of the joined prompt.
+			segment_tokens = self._encode_tagged_segment(segment)
+
+			if total_tokens + len(segment_tokens) > token_budget:
+				if not packed_segments:
+					packed_segments.append(self._truncate_tagged_segment(segment, token_budget))
+				break
+
+			packed_segments.append(segment)
+			total_tokens += len(segment_tokens)
+
+		return ''.join(reversed(packed_segments))
+
+	def _truncate_tagged_segment(self, segment, token_budget):
+		# The tags at the start of the segment, like <|soss r/sub|><|sot|>, are kept whole and the text after them is truncated
+		tags = re.match(r"(?:<\|[^|]*\|>)*", segment).group(0)
+		tag_tokens = self._prompt_tokenizer.encode(tags, add_special_tokens=False) if tags else []
+		text_budget = token_budget - len(tag_tokens)
+
+		if text_budget < 0:
+			return ''
+
+		text_tokens = self._prompt_tokenizer.encode(segment[len(tags):], add_special_tokens=False)
+		return tags + (self._prompt_tokenizer.decode(text_tokens[-text_budget:]) if text_budget else '')
+
+	def _encode_tagged_segment(self, segment):
+		# The same comments are tagged again for every reply in a thread, so the encodings are cached
+		if self._tagged_segment_encodings is None:
+			self._tagged_segment_encodings = OrderedDict()
+
+		if segment in self._tagged_segment_encodings:
+			self._tagged_segment_encodings.move_to_end(segment)
+			return self._tagged_segment_encodings[segment]
+
+		segment_tokens = self._prompt_tokenizer.encode(segment, add_special_tokens=False)
+		self._tagged_segment_encodings[segment] = segment_tokens
+
+		if len(self._tagged_segment_encodings) > self._tagged_segment_encodings_size:
+			self._tagged_segment_encodings.popitem(last=False)
+
+		return segment_tokens
+
 	def remove_username_mentions_from_string(self, string, username):
 		# Compile a regex that will match the bot username,
 		# then remove all instances from the text.
@@ -83,6 +160,10 @@ class LogicMixin(TaggingMixin):
 	def calculate_reply_probability(self, praw_thing):
 		# Ths function contains all of the logic used for deciding whether to reply
 
+		# The config can be reloaded while this runs, so the keywords and weights are read once
+		keyword_helper = self._keyword_helper
+		reply_weights = self._reply_weights
+
 		if not praw_thing.author:
 			# If the praw_thing has been deleted the author will be None,
 			# don't proceed to attempt a reply. Usually we will have downloaded
@@ -110,10 +191,15 @@ class LogicMixin(TaggingMixin):
 		elif isinstance(praw_thing, praw_Comment):
 			# otherwise it's a comment
 			thing_text_content = praw_thing.body
+			# The parent and submission are read from the comment's thread,
+			# so they aren't fetched again for each check below
+			thread = self.get_comment_thread(praw_thing)
+			parent_author = thread[1].author
+			submission_author = thread[-1].author
 			# navigate to the parent submission to get the link_flair_text
-			submission_link_flair_text = praw_thing.submission.link_flair_text or ''
-			submission_created_utc = datetime.utcfromtimestamp(praw_thing.submission.created_utc)
-			is_own_comment_reply = praw_thing.parent().author == self._praw.user.me().name
+			submission_link_flair_text = thread[-1].link_flair_text or ''
+			submission_created_utc = datetime.utcfromtimestamp(thread[-1].created_utc)
+			is_own_comment_reply = parent_author == self._praw.user.me().name
 
 		elif isinstance(praw_thing, praw_Message):
 			thing_text_content = praw_thing.body
@@ -121,7 +207,7 @@ class LogicMixin(TaggingMixin):
 
 		# second most important thing is to check for a negative keyword
 		# calculate whether negative keywords are in the text and return 0
-		if len(self._keyword_helper.negative_keyword_matches(thing_text_content)) > 0:
+		if len(keyword_helper.negative_keyword_matches(thing_text_content)) > 0:
 			# The title or selftext/body contains negative keyword matches
 			# and we will avoid engaging with negative content
 			return 0
@@ -140,12 +226,12 @@ class LogicMixin(TaggingMixin):
 		if getattr(praw_thing, 'type', '') == 'username_mention' or\
 			self._praw.user.me().name.lower() in thing_text_content.lower() or\
 			isinstance(praw_thing, praw_Message):
-			return self._message_mention_reply_probability
+			return reply_weights['message_mention_reply_probability']
 
 		# From here we will start to calculate the probability cumulatively
 		# Adjusting the weights here will change how frequently the bot will post
 		# Try not to spam the sub too much and let other bots and humans have space to post
-		base_probability = self._base_reply_probability
+		base_probability = reply_weights['base_reply_probability']
 
 		if isinstance(praw_thing, praw_Comment):
 			# Find the depth of the comment
@@ -156,7 +242,7 @@ class LogicMixin(TaggingMixin):
 			else:
 				# Reduce the reply probability x% for each level of comment depth
 				# to keep the replies higher up
-				base_probability -= ((comment_depth - 1) * self._comment_depth_reply_penalty)
+				base_probability -= ((comment_depth - 1) * reply_weights['comment_depth_reply_penalty'])
 
 		# Check the flair and username to see if the author might be a bot
 		# 'Verified GPT-2 Bot' is only valid on r/subsimgpt2interactive
@@ -164,34 +250,34 @@ class LogicMixin(TaggingMixin):
 		if 'verified gpt-2' in (getattr(praw_thing, 'author_flair_text', '') or '').lower()\
 			or any(praw_thing.author.name.lower().endswith(i) for i in ['ssi', 'bot', 'gpt2']):
 			# Adjust for when the author is a bot
-			base_probability += self._bot_author_reply_boost
+			base_probability += reply_weights['bot_author_reply_boost']
 		else:
 			# assume humanoid if author metadata doesn't meet the criteria for a bot
-			base_probability += self._human_author_reply_boost
+			base_probability += reply_weights['human_author_reply_boost']
 
-		if len(self._keyword_helper.positive_keyword_matches(thing_text_content)) > 0:
+		if len(keyword_helper.positive_keyword_matches(thing_text_content)) > 0:
 			# A positive keyword was found, increase probability of replying
-			base_probability += self._positive_keyword_reply_boost
+			base_probability += reply_weights['positive_keyword_reply_boost']
 
 		if isinstance(praw_thing, praw_Submission):
 			# it's a brand new submission.
 			# This is mostly obsoleted by the depth penalty
-			base_probability += self._new_submission_reply_boost
+			base_probability += reply_weights['new_submission_reply_boost']
 
 		if isinstance(praw_thing, praw_Submission) or is_own_comment_reply:
 			if any(kw.lower() in thing_text_content.lower() for kw in ['?', ' you', 'what', 'how', 'when', 'why']):
 				# any interrogative terms in the submission or comment text;
 				# results in an increased reply probability
-				base_probability += self._interrogative_reply_boost
+				base_probability += reply_weights['interrogative_reply_boost']
 
 		if isinstance(praw_thing, praw_Comment):
-			if praw_thing.parent().author == self._praw.user.me().name:
+			if parent_author == self._praw.user.me().name:
 				# the post prior to this is by the bot
-				base_probability += self._own_comment_reply_boost
+				base_probability += reply_weights['own_comment_reply_boost']
 
-			if praw_thing.submission.author == self._praw.user.me().name:
+			if submission_author == self._praw.user.me().name:
 				# the submission is by the bot, and favor that with a boost
-				base_probability += self._own_submission_reply_boost
+				base_probability += reply_weights['own_submission_reply_boost']
 
 		reply_probability = min(base_probability, 1)
 
@@ -201,3 +287,26 @@ class LogicMixin(TaggingMixin):
 		rate_of_decay = max(0, 1 - (age_of_submission / 24))
 		# multiply the rate of decay by the reply probability
 		return round(reply_probability * rate_of_decay, 2)
+
+	def get_job_priority(self, praw_thing):
+		# The priority class of a reply job, used to order the text generation queue.
+		# Mentions and messages are the replies users are waiting on.
+		bot_name = self._praw.user.me().name.lower()
+
+		if isinstance(praw_thing, praw_Message) or getattr(praw_thing, 'type', '') == 'username_mention':
+			return PRIORITY_MENTION
+
+		thing_text_content = praw_thing.body if isinstance(praw_thing, praw_Comment) else f'{praw_thing.title} {praw_thing.selftext}'
+		if bot_name in thing_text_content.lower():
+			return PRIORITY_MENTION
+
+		if getattr(praw_thing, 'type', '') in ['comment_reply', 'post_reply']:
+			# Inbox replies are always to the bot's own comment or submission
+			return PRIORITY_OWN_THREAD
+
+		if isinstance(praw_thing, praw_Comment):
+			thread = self.get_comment_thread(praw_thing)
+			if (thread[1].author or '').lower() == bot_name or (thread[-1].author or '').lower() == bot_name:
+				return PRIORITY_OWN_THREAD
+
+		return PRIORITY_REPLY
@@ -11,16 +11,23 @@ from datetime import datetime, timedelta
 
 import praw
 from praw.models import (Submission as praw_Submission, Comment as praw_Comment, Message as praw_Message)
-from peewee import fn
+from praw.models.util import BoundedSet
+from peewee import chunked, fn
 import pyimgur
 
+from praw.endpoints import API_PATH
+
 from .logic_mixin import LogicMixin
+from .thread_snapshots import CommentSnapshot, SubmissionSnapshot, ThreadSnapshotCache, find_comment_in_context
 
 from generators.text import default_text_generation_parameters
+from generators.text.model_cache import get_tokenizer
+from generators.text.scheduler import PRIORITY_NEW_SUBMISSION
 
-from bot_db.db import Thing as db_Thing
-from utils.keyword_helper import KeywordHelper
+from bot_db.db import Thing as db_Thing, on_presave_handler
+from utils.keyword_helper import get_keyword_helper
 from utils.toxicity_helper import ToxicityHelper
+from utils import ROOT_DIR
 
 
 class RedditIO(threading.Thread, LogicMixin):
@@ -40,11 +47,36 @@ class RedditIO(threading.Thread, LogicMixin):
 
 	_default_text_generation_parameters = default_text_generation_parameters
 
-	def __init__(self, bot_username):
+	# The number of recently seen thing names kept in memory
+	_seen_things_size = 5000
+
+	# Variables for the probability of replying to comments, and their defaults
+	# Please be nice and don't spam the subreddits by increasing these values too high.
+	# The overall concept of these default values are to increase two types of replies:
+	# 1) Keyword based, where the bot replies to comments with positive keywords that are related to its training material
+	# 2) Replying where human users replied directly to the bot and to continue that comment chain.
+	_default_reply_weights = {
+		'base_reply_probability': -0.1,
+		'comment_depth_reply_penalty': 0.05,
+		'positive_keyword_reply_boost': 0.5,
+		'human_author_reply_boost': 0.3,
+		'bot_author_reply_boost': -0.1,
+		'new_submission_reply_boost': 0.1,
+		'own_comment_reply_boost': 0.3,
+		'interrogative_reply_boost': 0.4,
+		'own_submission_reply_boost': 0.5,
+		'message_mention_reply_probability': 1,
+	}
+
+	def __init__(self, bot_username, generation_ready=None):
 		super().__init__(name=bot_username, daemon=True)
 
 		self._bot_username = bot_username
 
+		# An optional threading.Event, set once text generation is ready to take jobs.
+		# Until it is, new replies and submissions are not queued.
+		self._generation_ready = generation_ready
+
 		# seed the random generator
 		random.seed()
 
@@ -53,7 +85,7 @@ class RedditIO(threading.Thread, LogicMixin):
 
 		self._imgur_client_id = self._config[self._bot_username].get('imgur_client_id', None)
 
-		self._keyword_helper = KeywordHelper(self._bot_username)
+		self._keyword_helper = get_keyword_helper(self._bot_username)
 		self._toxicity_helper = ToxicityHelper(self._bot_username)
 
 		subreddits_config_string = self._config[self._bot_username].get('subreddits', 'test')
@@ -93,46 +125,75 @@ class RedditIO(threading.Thread, LogicMixin):
 		# It is not backwards compatible between old models. The model has to be trained with this 'sense'
 		self._use_reply_sense = self._config[self._bot_username].getboolean('use_reply_sense', True)
 
-		# Variables for the probability of replying to comments
-		# Please be nice and don't spam the subreddits by increasing these values too high.
-		# The overall concept of these default values are to increase two types of replies:
-		# 1) Keyword based, where the bot replies to comments with positive keywords that are related to its training material
-		# 2) Replying where human users replied directly to the bot and to continue that comment chain.
-		self._base_reply_probability = self._config[self._bot_username].getfloat('base_reply_probability', -0.1)
-		self._comment_depth_reply_penalty = self._config[self._bot_username].getfloat('comment_depth_reply_penalty', 0.05)
-		self._positive_keyword_reply_boost = self._config[self._bot_username].getfloat('positive_keyword_reply_boost', 0.5)
-		self._human_author_reply_boost = self._config[self._bot_username].getfloat('human_author_reply_boost', 0.3)
-		self._bot_author_reply_boost = self._config[self._bot_username].getfloat('bot_author_reply_boost', -0.1)
-		self._new_submission_reply_boost = self._config[self._bot_username].getfloat('new_submission_reply_boost', 0.1)
-		self._own_comment_reply_boost = self._config[self._bot_username].getfloat('own_comment_reply_boost', 0.3)
-		self._interrogative_reply_boost = self._config[self._bot_username].getfloat('interrogative_reply_boost', 0.4)
-		self._own_submission_reply_boost = self._config[self._bot_username].getfloat('own_submission_reply_boost', 0.5)
-		self._message_mention_reply_probability = self._config[self._bot_username].getfloat('message_mention_reply_probability', 1)
+		# The prompt is packed into a budget of tokens, measured with the bot model's own tokenizer.
+		# The rest of the model's 1024 token context is left for the generated reply.
+		self._prompt_token_budget = self._config[self._bot_username].getint('prompt_token_budget', 768)
+		try:
+			self._prompt_tokenizer = get_tokenizer((ROOT_DIR / self._config[self._bot_username]['text_model_path']).resolve())
+		except (OSError, KeyError, ValueError) as e:
+			logging.warning(f"{self._bot_username} could not load the model's tokenizer ({e!r}). Prompts will be truncated by length instead.")
+
+		# The weights used to calculate the probability of replying to comments
+		self._reply_weights = self._load_reply_weights(self._config)
+
+		# The subreddit streams are kept open between loops, so each loop only fetches new items.
+		# The names of things already in the database are kept in a bounded set, warmed from the database when the bot starts,
+		# so items seen again, for example after a stream is restarted, don't need a database lookup.
+		self._incoming_streams = None
+		self._seen_things = BoundedSet(self._seen_things_size)
+
+		# Snapshots of the comments and submissions in the threads the bot has read recently,
+		# so deciding on and posting a reply reads each thread's ancestry from reddit at most once.
+		self._thread_snapshots = ThreadSnapshotCache(
+			self._config[self._bot_username].getint('thread_snapshot_cache_size', 2000),
+			self._config[self._bot_username].getint('thread_snapshot_ttl', 1800))
 
 		# start a reddit instance
 		# this will automatically pick up the configuration from praw.ini
 		self._praw = praw.Reddit(self._bot_username, timeout=64)
 
+	def _load_reply_weights(self, config):
+		return {name: config[self._bot_username].getfloat(name, default) for name, default in self._default_reply_weights.items()}
+
+	def reload_config(self, config):
+		"""
+		Called by the config watcher when ssi-bot.ini changes.
+		The keywords and reply weights are replaced whole, so a reply decision in progress
+		uses either the old or the new values, never a mix.
+		"""
+		self._keyword_helper = get_keyword_helper(self._bot_username)
+		self._reply_weights = self._load_reply_weights(config)
+		self._config = config
+
 	def run(self):
 
+		self._warm_seen_things()
+
 		# synchronize bot's own posts to the database
 		self.synchronize_bots_comments_submissions()
 
 		# pick up incoming submissions, comments etc from reddit and submit jobs for them
 		while True:
 
+			generation_ready = self._generation_ready is None or self._generation_ready.is_set()
+			if not generation_ready:
+				logging.info(f"Waiting for text generation to be ready before taking new jobs")
+
 			try:
-				logging.info(f"Beginning to process inbox stream")
-				self.poll_inbox_stream()
+				if generation_ready:
+					logging.info(f"Beginning to process inbox stream")
+					self.poll_inbox_stream()
 			except:
 				logging.exception("Exception occurred while processing the inbox streams")
 
 			try:
 				logging.info(f"Beginning to process incoming reddit streams")
-				if self._subreddits:
+				if self._subreddits and generation_ready:
 					self.poll_incoming_streams()
 			except:
 				logging.exception("Exception occurred while processing the incoming streams")
+				# A stream that raised can't be resumed, so they are opened again on the next loop
+				self._incoming_streams = None
 
 			try:
 				logging.info(f"Beginning to process outgoing post jobs")
@@ -150,16 +211,22 @@ class RedditIO(threading.Thread, LogicMixin):
 
 			try:
 				for subreddit, frequency in self._new_submission_schedule:
-					if frequency > 0:
+					if frequency > 0 and generation_ready:
 						logging.info(f"Beginning to attempt to schedule a new submission on {subreddit}")
 						self.attempt_schedule_new_submission(subreddit, frequency)
 			except:
 				logging.exception("Exception occurred while scheduling a new submission")
 
-			time.sleep(120)
+			if generation_ready:
+				time.sleep(120)
+			else:
+				# Check again soon, rather than leaving new jobs for a whole loop
+				self._generation_ready.wait(120)
 
 	def poll_inbox_stream(self):
 
+		# Take the page of unread inbox items
+		praw_things = []
 		for praw_thing in self._praw.inbox.stream(pause_after=0):
 
 			if praw_thing is None:
@@ -169,56 +236,60 @@ class RedditIO(threading.Thread, LogicMixin):
 				# Skip if it's an inbox message and replies are disabled
 				continue
 
-			record = self.is_praw_thing_in_database(praw_thing)
-
-			if not record:
-				logging.info(f"New message received in inbox, {praw_thing.id}")
+			praw_things.append(praw_thing)
 
-				if self._is_praw_thing_removed_or_deleted(praw_thing):
-					# It's been deleted, removed or locked. Skip this thing entirely.
-					# mark the inbox item read
-					praw_thing.mark_read()
-					continue
+		if not praw_things:
+			return
 
-				reply_probability = self.calculate_reply_probability(praw_thing)
+		handled_praw_things = []
+		try:
+			self._process_new_praw_things(praw_things, 'message', handled_praw_things)
+		finally:
+			# Only mark the inbox items read that have been handled.
+			# The stream only yields unread items, so any after one that raised are handled on the next loop.
+			if handled_praw_things:
+				self._praw.inbox.mark_read(handled_praw_things)
 
-				text_generation_parameters = None
-				random_value = random.random()
+	def poll_incoming_streams(self):
 
-				if random_value < reply_probability:
-					logging.info(f"{praw_thing} Random value {random_value:.3f} is < reply probabililty {(reply_probability):.3f}. Starting a reply..")
+		submissions, comments = self._get_incoming_streams()
 
-					# It will generate a reply, so grab the parameters before we put it into the database
-					text_generation_parameters = self.get_text_generation_parameters(praw_thing)
-				else:
-					logging.info(f"{praw_thing} Random value {random_value:.3f} is not < reply probabililty {(reply_probability):.3f}. No reply.. :(")
+		# Merge the streams to DRY the code, taking the page of items that are new since the last loop
+		praw_things = list(chain_listing_generators(submissions, comments))
 
-				# insert it into the database
-				self.insert_praw_thing_into_database(praw_thing, text_generation_parameters=text_generation_parameters)
+		self._process_new_praw_things(praw_things)
 
-			# mark the inbox item read
-			praw_thing.mark_read()
+	def _process_new_praw_things(self, praw_things, thing_label=None, handled_praw_things=None):
+		"""
+		Decide whether to reply to each of the things that isn't in the database yet, and insert them.
+		The things already in the database are found with a single query,
+		and the things that won't be replied to are inserted together at the end.
+		Returns the things that were handled: inserted, or skipped as already seen or removed.
+		They are also added to handled_praw_things as they are handled, so the caller has them if a later thing raises.
+		"""
+		if handled_praw_things is None:
+			handled_praw_things = []
 
-	def poll_incoming_streams(self):
+		unseen_names = self.find_unseen_names(praw_things)
+		new_praw_things = []
 
-		# Setup all the streams for new comments and submissions
-		sr = self._praw.subreddit('+'.join(self._subreddits))
-		submissions = sr.stream.submissions(pause_after=0)
-		comments = sr.stream.comments(pause_after=0)
+		try:
+			for praw_thing in praw_things:
 
-		# Merge the streams in a single loop to DRY the code
-		for praw_thing in chain_listing_generators(submissions, comments):
+				name = self._get_name_for_thing(praw_thing)
 
-			# Check in the database to see if it already exists
-			record = self.is_praw_thing_in_database(praw_thing)
+				# If the thing is already in the database then we've already calculated a reply for it.
+				if name not in unseen_names:
+					handled_praw_things.append(praw_thing)
+					continue
+				unseen_names.discard(name)
 
-			# If the thing is already in the database then we've already calculated a reply for it.
-			if not record:
-				thing_label = 'comment' if isinstance(praw_thing, praw_Comment) else 'submission'
-				logging.info(f"New {thing_label} thing received {praw_thing.name} from {praw_thing.subreddit}")
+				label = thing_label or ('comment' if isinstance(praw_thing, praw_Comment) else 'submission')
+				logging.info(f"New {label} thing received {praw_thing.name} from {praw_thing.subreddit}")
 
 				if self._is_praw_thing_removed_or_deleted(praw_thing):
 					# It's been deleted, removed or locked. Skip this thing entirely.
+					handled_praw_things.append(praw_thing)
 					continue
 
 				reply_probability = self.calculate_reply_probability(praw_thing)
@@ -234,16 +305,53 @@ class RedditIO(threading.Thread, LogicMixin):
 				else:
 					logging.info(f"{praw_thing} Random value {random_value:.3f} is not < reply probabililty {(reply_probability):.3f}. No reply.. :(")
 
-				# insert it into the database
-				self.insert_praw_thing_into_database(praw_thing, text_generation_parameters=text_generation_parameters)
+				if text_generation_parameters:
+					# insert the reply job into the database
+					self.insert_praw_thing_into_database(praw_thing, text_generation_parameters=text_generation_parameters)
+					handled_praw_things.append(praw_thing)
+				else:
+					new_praw_things.append(praw_thing)
+
+		finally:
+			# Record the things that have been decided on, even if a later one failed
+			self.insert_praw_things_into_database(new_praw_things)
+			handled_praw_things.extend(new_praw_things)
+
+		return handled_praw_things
+
+	def _get_incoming_streams(self):
+		# Setup all the streams for new comments and submissions, the first time they are polled.
+		# PRAW's streams remember the newest item they have yielded, so when polled again
+		# they only request items newer than it.
+		if self._incoming_streams is None:
+			sr = self._praw.subreddit('+'.join(self._subreddits))
+			self._incoming_streams = (sr.stream.submissions(pause_after=0), sr.stream.comments(pause_after=0))
+
+		return self._incoming_streams
+
+	def _warm_seen_things(self):
+		# Fill the seen set with the bot's most recent things in the database, oldest first
+		query = db_Thing.select(db_Thing.source_name).\
+				where(db_Thing.bot_username == self._bot_username).\
+				order_by(db_Thing.id.desc()).\
+				limit(self._seen_things_size)
+
+		for (source_name,) in reversed(list(query.tuples())):
+			self._seen_things.add(source_name)
 
 	def get_text_generation_parameters(self, praw_thing):
 
+		reply_start_tag = self.get_reply_tag(praw_thing, self._bot_username, use_reply_sense=self._use_reply_sense)
+
+		# The reply start tag is appended to the history, so keep room for it in the prompt's token budget
+		token_budget = self._prompt_token_budget
+		if self._prompt_tokenizer:
+			token_budget -= len(self._encode_tagged_segment(reply_start_tag))
+
 		# Collate history of comments prior to prompt the GPT-2 model with.
-		comment_history = self._collate_tagged_comment_history(praw_thing, use_reply_sense=self._use_reply_sense)
+		comment_history = self._collate_tagged_comment_history(praw_thing, use_reply_sense=self._use_reply_sense, token_budget=token_budget)
 		# Remove any bot mentions from the text because of the bot's fragile sense of self
 		cleaned_history = self.remove_username_mentions_from_string(comment_history, self._bot_username)
-		reply_start_tag = self.get_reply_tag(praw_thing, self._bot_username, use_reply_sense=self._use_reply_sense)
 
 		prompt = cleaned_history + reply_start_tag
 
@@ -407,29 +515,56 @@ class RedditIO(threading.Thread, LogicMixin):
 		submissions = self._praw.redditor(self._praw.user.me().name).submissions.new(limit=20)
 		comments = self._praw.redditor(self._praw.user.me().name).comments.new(limit=100)
 
-		for praw_thing in chain_listing_generators(submissions, comments):
+		praw_things = list(chain_listing_generators(submissions, comments))
+
+		# Insert the parents of the comments, too, to prevent another job being made.
+		praw_things += [praw_thing.parent() for praw_thing in praw_things if isinstance(praw_thing, praw_Comment)]
 
-			# if it's already in the database, do nothing
-			record = self.is_praw_thing_in_database(praw_thing)
+		# if it's already in the database, do nothing
+		unseen_names = self.find_unseen_names(praw_things)
+		new_praw_things = []
 
-			if not record:
-				logging.info(f"New thing in sync stream {praw_thing.name}")
-				# Add the record into the database, with no chance of reply
-				record = self.insert_praw_thing_into_database(praw_thing)
+		for praw_thing in praw_things:
+			name = self._get_name_for_thing(praw_thing)
+			if name in unseen_names:
+				logging.info(f"New thing in sync stream {name}")
+				unseen_names.discard(name)
+				new_praw_things.append(praw_thing)
 
-			if isinstance(praw_thing, praw_Comment):
-				parent_record = self.is_praw_thing_in_database(praw_thing.parent())
-				if not parent_record:
-					# Insert the parent, too, to prevent another job being made.
-					parent_record = self.insert_praw_thing_into_database(praw_thing.parent())
+		# Add the records into the database, with no chance of reply
+		self.insert_praw_things_into_database(new_praw_things)
 
 		logging.info("Completed syncing the bot's own submissions/comments")
 
+	def find_unseen_names(self, praw_things):
+		"""
+		Returns the set of names of the things that aren't in the database for this bot.
+		The names are checked with one query, rather than a query for each thing.
+		"""
+		names = {self._get_name_for_thing(praw_thing) for praw_thing in praw_things}
+		unseen_names = {name for name in names if name not in self._seen_things}
+
+		# SQLite limits the number of parameters in a query
+		for names_chunk in chunked(list(unseen_names), 500):
+			for source_name in self._names_in_database(names_chunk):
+				self._seen_things.add(source_name)
+				unseen_names.discard(source_name)
+
+		return unseen_names
+
+	def _names_in_database(self, names):
+		query = db_Thing.select(db_Thing.source_name).\
+				where(db_Thing.source_name.in_(names)).\
+				where(db_Thing.bot_username == self._bot_username)
+		return [source_name for (source_name,) in query.tuples()]
+
 	def is_praw_thing_in_database(self, praw_thing):
 		# Note that this is using the prefixed reddit id, ie t3_, t1_
 		# do not mix it with the unprefixed version which is called id!
 		# Filter by the bot username
 		record = db_Thing.get_or_none(db_Thing.source_name == self._get_name_for_thing(praw_thing), db_Thing.bot_username == self._bot_username)
+		if record:
+			self._seen_things.add(record.source_name)
 		return record
 
 	def _get_name_for_thing(self, praw_thing):
@@ -441,20 +576,46 @@ class RedditIO(threading.Thread, LogicMixin):
 		if isinstance(praw_thing, praw_Message):
 			return f"t4_{praw_thing.id}"
 
-	def insert_praw_thing_into_database(self, praw_thing, text_generation_parameters=None):
-
+	def _get_record_dict(self, praw_thing):
 		record_dict = {}
 		record_dict['source_name'] = praw_thing.name
 		record_dict['created_utc'] = praw_thing.created_utc
 		record_dict['bot_username'] = self._bot_username
 		record_dict['author'] = getattr(praw_thing.author, 'name', '')
 		record_dict['subreddit'] = praw_thing.subreddit
+		return record_dict
+
+	def insert_praw_things_into_database(self, praw_things):
+		# Insert things that won't be replied to with a single query
+		if not praw_things:
+			return
+
+		record_dicts = []
+		for praw_thing in praw_things:
+			record_dict = self._get_record_dict(praw_thing)
+
+			# insert_many doesn't send the pre_save signal, so the status of the new record is set by its handler here
+			record = db_Thing(**record_dict)
+			on_presave_handler(db_Thing, record, True)
+			record_dicts.append(dict(record_dict, status=record.status))
+
+		db_Thing.insert_many(record_dicts).execute()
+
+		for praw_thing in praw_things:
+			self._seen_things.add(praw_thing.name)
+
+	def insert_praw_thing_into_database(self, praw_thing, text_generation_parameters=None):
+
+		record_dict = self._get_record_dict(praw_thing)
 
 		if text_generation_parameters:
 			# If we want to generate a text reply, then include these parameters in the record
 			record_dict['text_generation_parameters'] = text_generation_parameters
+			record_dict['priority'] = self.get_job_priority(praw_thing)
 
-		return db_Thing.create(**record_dict)
+		record = db_Thing.create(**record_dict)
+		self._seen_things.add(record.source_name)
+		return record
 
 	def attempt_schedule_new_submission(self, subreddit, hourly_frequency):
 		# Attempt to schedule a new submission
@@ -489,6 +650,7 @@ class RedditIO(threading.Thread, LogicMixin):
 		new_submission_thing['bot_username'] = self._bot_username
 		new_submission_thing['author'] = self._bot_username
 		new_submission_thing['subreddit'] = subreddit
+		new_submission_thing['priority'] = PRIORITY_NEW_SUBMISSION
 
 		text_generation_parameters = self._default_text_generation_parameters.copy()
 		new_submission_tag = self._get_random_new_submission_tag(subreddit, use_reply_sense=self._use_reply_sense)
@@ -554,10 +716,55 @@ class RedditIO(threading.Thread, LogicMixin):
 		# Assume not deleted
 		return False
 
+	def _fetch_comment_thread(self, praw_comment):
+		"""
+		Fetch the comment with its context, which returns the submission
+		and up to 8 of the comment's ancestors in a single request.
+		A deeper thread needs another request for each 9 further ancestors, unless they are in the snapshot cache.
+		"""
+		submission_id = praw_comment.link_id[3:]
+		comment_id = praw_comment.id
+		# The praw comments in the thread, newest first
+		praw_comments = []
+
+		while True:
+			submission_listing, comment_listing = self._praw.get(
+				f"{API_PATH['submission'].format(id=submission_id)}_/{comment_id}", params={'context': 8})
+
+			context_comments = find_comment_in_context(comment_listing.children, comment_id)
+			if not context_comments:
+				raise praw.exceptions.ClientException(f'Comment t1_{comment_id} could not be found in its thread.')
+			praw_comments += reversed(context_comments)
+
+			parent_id = praw_comments[-1].parent_id
+			if parent_id == f't3_{submission_id}':
+				thread = [SubmissionSnapshot.from_praw(submission_listing.children[0])]
+				break
+
+			thread = self._thread_snapshots.thread(parent_id)
+			if thread:
+				break
+
+			comment_id = parent_id[3:]
+
+		for praw_thing in reversed(praw_comments):
+			thread.insert(0, CommentSnapshot.from_praw(praw_thing, thread[0].depth + 1))
+
+		return thread
+
 	def _check_reply_matches_history(self, source_praw_thing, reply_body, to_level=6):
 		# Checks through the history of the source_praw_thing
 		# and if the reply_body has a high match, return False.
 
+		if isinstance(source_praw_thing, praw_Comment):
+			# The comment's thread is usually still cached from when the reply was decided.
+			# On the submission we'll only check the title
+			texts_to_compare = [snapshot.title if isinstance(snapshot, SubmissionSnapshot) else snapshot.body
+				for snapshot in self.get_comment_thread(source_praw_thing)[:to_level]]
+
+			return any(difflib.SequenceMatcher(None, text_to_compare.lower(), reply_body.lower()).ratio() >= 0.95
+				for text_to_compare in texts_to_compare)
+
 		counter = 0
 		text_to_compare = ''
 		loop_thing = source_praw_thing
@@ -569,10 +776,6 @@ class RedditIO(threading.Thread, LogicMixin):
 				text_to_compare = loop_thing.title
 				break_after_compare = True
 
-			elif isinstance(loop_thing, praw_Comment):
-				text_to_compare = loop_thing.body
-				loop_thing = loop_thing.parent()
-
 			elif isinstance(loop_thing, praw_Message):
 				text_to_compare = loop_thing.body
 
@@ -596,30 +799,10 @@ class RedditIO(threading.Thread, LogicMixin):
 
 	def _find_depth_of_comment(self, praw_comment):
 		"""
-		Adapted from:
-		https://praw.readthedocs.io/en/latest/code_overview/models/comment.html#praw.models.Comment.parent
-		Loop back up the tree until reaching the root ancestor
-		Returns integer representing the depth
+		The depth of the comment in its thread, where a top level comment is 1.
+		It is read from the comment's thread snapshot, so it doesn't walk up the tree with parent() again.
 		"""
-
-		refresh_counter = 0
-		# it's a 1-based index so init the counter with 1
-		depth_counter = 1
-		ancestor = praw_comment
-		while not ancestor.is_root:
-			depth_counter += 1
-			ancestor = ancestor.parent()
-			if refresh_counter % 9 == 0:
-				try:
-					ancestor.refresh()
-				except praw.exceptions.ClientException:
-					# An error can occur if a message is missing for some reason.
-					# To keep the bot alive, return early.
-					logging.exception("Exception when counting the comment depth. returning early.")
-					return depth_counter
-
-				refresh_counter += 1
-		return depth_counter
+		return self.get_comment_thread(praw_comment)[0].depth
 
 
 def chain_listing_generators(*iterables):
@@ -8,6 +8,8 @@ import codecs
 
 from praw.models import Comment as praw_Comment
 
+from .thread_snapshots import CommentSnapshot, read_comment_thread
+
 
 class TaggingMixin():
 	"""
@@ -27,6 +29,38 @@ class TaggingMixin():
 
 	_end_tag = '<|'
 
+	# The bot's ThreadSnapshotCache, set by RedditIO.
+	# Without one, a comment's thread is read from the praw objects each time it is needed.
+	_thread_snapshots = None
+
+	def get_comment_thread(self, praw_comment):
+		"""
+		Snapshots of the comment and each of its ancestors, newest first, ending with the submission.
+		They are read from the snapshot cache when the whole thread is there,
+		and a new reply in a cached thread only needs a snapshot of itself.
+		Otherwise the thread is fetched and cached.
+		"""
+		if self._thread_snapshots is None:
+			return read_comment_thread(praw_comment)
+
+		thread = self._thread_snapshots.thread(praw_comment.name)
+		if thread:
+			return thread
+
+		parent_thread = self._thread_snapshots.thread(praw_comment.parent_id)
+		if parent_thread:
+			thread = [CommentSnapshot.from_praw(praw_comment, parent_thread[0].depth + 1)] + parent_thread
+		else:
+			thread = self._fetch_comment_thread(praw_comment)
+
+		for snapshot in thread:
+			self._thread_snapshots.add(snapshot)
+
+		return thread
+
+	def _fetch_comment_thread(self, praw_comment):
+		return read_comment_thread(praw_comment)
+
 	def get_reply_tag(self, praw_thing, bot_username, use_reply_sense):
 		"""
 		Get the reply tag to use.
@@ -37,14 +71,14 @@ class TaggingMixin():
 		if use_reply_sense:
 			if isinstance(praw_thing, praw_Comment):
 				# Need this praw_Comment check for message replies
-				if praw_thing.submission:
-					# The submission was by the bot so use special tag
-					if praw_thing.submission.author.name.lower() == bot_username.lower():
-						return '<|soopr|>'
-				if praw_thing.parent():
-					# if the parent's parent was by the author bot, use the own content tag
-					if praw_thing.parent().author.name.lower() == bot_username.lower():
-						return '<|soocr|>'
+				thread = self.get_comment_thread(praw_thing)
+
+				# The submission was by the bot so use special tag
+				if (thread[-1].author or '').lower() == bot_username.lower():
+					return '<|soopr|>'
+				# if the parent was by the author bot, use the own content tag
+				if (thread[1].author or '').lower() == bot_username.lower():
+					return '<|soocr|>'
 
 		# It's just a straight reply
 		return self._reply_start_tag
@@ -88,7 +122,7 @@ class TaggingMixin():
 
 			selftext = praw_thing.selftext
 
-			if hasattr(praw_thing, 'poll_data'):
+			if getattr(praw_thing, 'poll_data', None):
 				# The submission has a poll - extract that data
 				for option in praw_thing.poll_data.options:
 					# Replicate unordered list markdown,
@@ -104,22 +138,24 @@ class TaggingMixin():
 
 		return tagged_text
 
-	def tag_comment(self, praw_thing, use_reply_sense=False):
+	def tag_comment(self, praw_thing, use_reply_sense=False, thread=None):
+		"""
+		praw_thing can be a praw comment or a CommentSnapshot.
+		thread is the comment's thread from get_comment_thread, when the caller already has it.
+		"""
 		if use_reply_sense:
 
-			if praw_thing.submission.author.name == praw_thing.author:
-				return f'<|soopr u/{praw_thing.author}|>{praw_thing.body}<|eoopr|>'
+			thread = thread or self.get_comment_thread(praw_thing)
+			comment = thread[0]
 
-			parent_parent = None
-			try:
-				parent_parent = praw_thing.parent().parent()
-				if parent_parent.author.name == praw_thing.author:
-					return f'<|soocr u/{praw_thing.author}|>{praw_thing.body}<|eoocr|>'
-			except:
-				# Exception will be raised if there are not two parents
-				pass
+			if comment.author and thread[-1].author == comment.author:
+				return f'<|soopr u/{comment.author}|>{comment.body}<|eoopr|>'
 
-			return f'<|sor u/{praw_thing.author}|>{praw_thing.body}<|eor|>'
+			# The parent's parent. If the parent is the submission, it was checked above
+			if comment.author and len(thread) > 2 and thread[2].author == comment.author:
+				return f'<|soocr u/{comment.author}|>{comment.body}<|eoocr|>'
+
+			return f'<|sor u/{comment.author}|>{comment.body}<|eor|>'
 
 		else:
 			return f'<|sor|>{praw_thing.body}<|eor|>'
@@ -220,6 +256,40 @@ class TaggingMixin():
 
 		return return_dict
 
+	def is_generation_complete(self, source_name, prompt, new_text):
+		"""
+		Whether the text generated after the prompt already contains everything
+		that will be extracted from it, so generation can be stopped early.
+		"""
+		if source_name != 't3_new_submission':
+			# A reply is complete at the first end tag, the same point extract_reply_from_generated_text truncates at
+			return self._end_tag in new_text
+
+		# New submission prompts end with the title start tag, so the new text begins with the title
+		idx_title_end = new_text.find(self._end_tag)
+		if idx_title_end == -1:
+			return False
+
+		if prompt.startswith(self._link_submission_start_tag[:-2]):
+			# A link submission only needs a title
+			return True
+
+		remainder = new_text[idx_title_end:]
+		if remainder.startswith('<|eot|>'):
+			remainder = remainder[len('<|eot|>'):]
+		elif '<|eot|>'.startswith(remainder):
+			return False
+
+		if self._selftext_start_tag.startswith(remainder):
+			# Not enough text yet to know if a selftext follows the title
+			return False
+
+		if not remainder.startswith(self._selftext_start_tag):
+			# The model moved on to something other than a selftext
+			return True
+
+		return self._end_tag in remainder[len(self._selftext_start_tag):]
+
 	def remove_tags_from_string(self, input_string):
 		# Removes any <|sor u/user|>, <|sost|> etc from a string
 		return re.sub(r'(\<\|[\w\/ ]*\|\>)', ' ', input_string).strip()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import time
+
+from collections import OrderedDict
+
+from praw.models import Comment as praw_Comment
+
+
+def _author_name(praw_thing):
+	# The author is None when it has been deleted
+	author = praw_thing.author
+	return author.name if author else None
+
+
+class CommentSnapshot():
+	"""
+	The parts of a comment that the reply logic reads, copied from the praw object once.
+	Reading them again doesn't make any requests to reddit.
+	depth is 1 for a top level comment.
+	"""
+
+	__slots__ = ('name', 'author', 'body', 'parent_id', 'submission_name', 'depth')
+
+	def __init__(self, name, author, body, parent_id, submission_name, depth):
+		self.name = name
+		self.author = author
+		self.body = body
+		self.parent_id = parent_id
+		self.submission_name = submission_name
+		self.depth = depth
+
+	@classmethod
+	def from_praw(cls, praw_comment, depth):
+		return cls(praw_comment.name, _author_name(praw_comment), praw_comment.body,
+			praw_comment.parent_id, praw_comment.link_id, depth)
+
+
+class SubmissionSnapshot():
+	"""
+	The parts of a submission that the reply logic reads, copied from the praw object once.
+	The attributes have the same names as praw's, so it can be tagged like a submission.
+	"""
+
+	__slots__ = ('name', 'author', 'title', 'selftext', 'is_self', 'subreddit', 'link_flair_text', 'created_utc', 'poll_data')
+
+	# The submission is the root of the thread
+	parent_id = None
+	depth = 0
+
+	def __init__(self, name, author, title, selftext, is_self, subreddit, link_flair_text, created_utc, poll_data=None):
+		self.name = name
+		self.author = author
+		self.title = title
+		self.selftext = selftext
+		self.is_self = is_self
+		self.subreddit = subreddit
+		self.link_flair_text = link_flair_text
+		self.created_utc = created_utc
+		self.poll_data = poll_data
+
+	@classmethod
+	def from_praw(cls, praw_submission):
+		# poll_data is only present on polls. Reading it from __dict__ means praw won't fetch the submission to look for it.
+		return cls(praw_submission.name, _author_name(praw_submission), praw_submission.title,
+			praw_submission.selftext, praw_submission.is_self, str(praw_submission.subreddit),
+			praw_submission.link_flair_text, praw_submission.created_utc, vars(praw_submission).get('poll_data'))
+
+
+def read_comment_thread(praw_comment):
+	"""
+	Snapshots of the comment and each of its ancestors, newest first, ending with the submission.
+	The ancestors are read with praw's parent(), which can make a request for each of them.
+	"""
+	praw_things = [praw_comment]
+	while isinstance(praw_things[-1], praw_Comment):
+		praw_things.append(praw_things[-1].parent())
+
+	thread = [SubmissionSnapshot.from_praw(praw_things.pop())]
+	for praw_thing in reversed(praw_things):
+		thread.insert(0, CommentSnapshot.from_praw(praw_thing, len(thread)))
+
+	return thread
+
+
+def find_comment_in_context(praw_comments, comment_id):
+	"""
+	The chain of comments down to comment_id, oldest first, in a comment listing fetched with its context.
+	None if it isn't there.
+	"""
+	for praw_comment in praw_comments:
+		# Skip any MoreComments
+		if not isinstance(praw_comment, praw_Comment):
+			continue
+
+		if praw_comment.id == comment_id:
+			return [praw_comment]
+
+		chain = find_comment_in_context(praw_comment.replies, comment_id)
+		if chain:
+			return [praw_comment] + chain
+
+	return None
+
+
+class ThreadSnapshotCache():
+	"""
+	An LRU cache of comment and submission snapshots, keyed by fullname.
+	A comment's whole thread can be read from it by following the parent ids,
+	so the replies in a thread the bot has already seen don't fetch their ancestors again.
+	Entries expire after ttl seconds.
+	"""
+
+	def __init__(self, max_entries=2000, ttl=1800):
+		self._max_entries = max_entries
+		self._ttl = ttl
+
+		# fullname -> (expiry time, snapshot)
+		self._entries = OrderedDict()
+
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, name):
+		entry = self._entries.get(name)
+
+		if entry is not None and entry[0] > time.time():
+			self._entries.move_to_end(name)
+			return entry[1]
+
+		if entry is not None:
+			del self._entries[name]
+
+		return None
+
+	def add(self, snapshot):
+		if self._max_entries < 1:
+			return
+
+		self._entries[snapshot.name] = (time.time() + self._ttl, snapshot)
+		self._entries.move_to_end(snapshot.name)
+
+		while len(self._entries) > self._max_entries:
+			self._entries.popitem(last=False)
+
+	def thread(self, name):
+		"""
+		The snapshots from name up to the submission, newest first.
+		None if any of them isn't in the cache.
+		"""
+		thread = []
+
+		while name:
+			snapshot = self.get(name)
+			if snapshot is None:
+				self.misses += 1
+				return None
+
+			thread.append(snapshot)
+			name = snapshot.parent_id
+
+		self.hits += 1
+		return thread
+
+	def stats(self):
+		return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
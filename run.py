@@ -9,6 +9,8 @@ from generators.text2image import Text2Image
 from reddit_io import RedditIO
 
 from bot_db.db import create_db_tables
+from utils import ROOT_DIR
+from utils.config_watcher import ConfigWatcher
 
 
 def main():
@@ -26,23 +28,37 @@ def main():
 	start_scraper_daemon = False
 	start_t2i_daemon = False
 
+	# Start the text generation daemon
+	# If warm_up_models is set, it loads the models before taking jobs,
+	# and the bots wait for it to be ready before queueing any.
+	mtg = ModelTextGenerator()
+	mtg.start()
+
+	# Keyword lists and reply weights are reloaded when ssi-bot.ini changes, without a restart
+	config_reload_interval = bot_config['DEFAULT'].getint('config_reload_interval', 30)
+	config_watcher = ConfigWatcher(ROOT_DIR / 'ssi-bot.ini', config_reload_interval) if config_reload_interval > 0 else None
+	if config_watcher:
+		config_watcher.add_listener(mtg)
+
 	for bot in bot_config.sections():
 
 		# initialise reddit_io
-		bot_io = RedditIO(bot_username=bot)
+		bot_io = RedditIO(bot_username=bot, generation_ready=mtg.ready)
 
 		# Start the reddit IO daemon which will pick up incoming
 		# submissions/comments and send outgoing ones
 		bot_io.start()
 
+		if config_watcher:
+			config_watcher.add_listener(bot_io)
+
 		if bot_io._submission_image_generator == 'scraper' and not start_scraper_daemon:
 			start_scraper_daemon = True
 		if bot_io._submission_image_generator == 'text2image' and not start_t2i_daemon:
 			start_t2i_daemon = True
 
-	# Start the text generation daemon
-	mtg = ModelTextGenerator()
-	mtg.start()
+	if config_watcher:
+		config_watcher.start()
 
 	if start_scraper_daemon:
 		print('starting scraper daemon')
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from benchmark_generation import build_prompt_corpus, build_tiny_model, percentile, run_benchmark
+
+
+class TestBenchmarkGeneration():
+
+	def test_corpus_is_repeatable(self):
+		assert build_prompt_corpus(10, seed=1) == build_prompt_corpus(10, seed=1)
+
+	def test_corpus_prompts_are_tagged(self):
+		for source_name, prompt in build_prompt_corpus(20):
+			if source_name == 't3_new_submission':
+				assert prompt.endswith('<|sot|>')
+			else:
+				assert '<|sor u/' in prompt
+				assert prompt.endswith('<|sor|>')
+
+	@pytest.mark.parametrize("percent, expected", [(50, 5), (95, 10), (99, 10)])
+	def test_percentile(self, percent, expected):
+		assert percentile(list(range(1, 11)), percent) == expected
+
+	@pytest.mark.parametrize("backend", ['pytorch', 'quantized', 'onnx'])
+	def test_run_benchmark(self, tmp_path, backend):
+		corpus = build_prompt_corpus(3)
+		tokenizer = build_tiny_model(str(tmp_path), corpus, n_embd=32, vocab_size=500)
+
+		report = run_benchmark(str(tmp_path), corpus, tokenizer, backend=backend, max_length=4)
+
+		assert set(report) == {'settings', 'model_load_seconds', 'total_seconds', 'generated_tokens',
+			'tokens_per_second', 'latency_seconds', 'peak_rss_kb'}
+		assert report['settings']['backend'] == backend
+		assert report['settings']['jobs'] == 3
+		assert report['generated_tokens'] > 0
+		assert set(report['latency_seconds']) == {'p50', 'p95', 'p99'}
+		# The report is written out as JSON
+		assert json.loads(json.dumps(report)) == report
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import utils.keyword_helper
+from utils.config_watcher import ConfigWatcher
+from utils.keyword_helper import get_keyword_helper
+
+
+class FakeListener():
+
+	def __init__(self):
+		self.configs = []
+
+	def reload_config(self, config):
+		self.configs.append(config)
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+	monkeypatch.setattr(utils.keyword_helper, 'ROOT_DIR', tmp_path)
+	monkeypatch.setattr(utils.keyword_helper, '_keyword_helpers', {})
+	config_path = tmp_path / 'ssi-bot.ini'
+	config_path.write_text('[DEFAULT]\nnegative_keywords = spoilers\n[bot_a]\nhuman_author_reply_boost = 0.3\n')
+	return config_path
+
+
+def rewrite(config_path, text):
+	config_path.write_text(text)
+	# Make sure the modification time changes, whatever the file system's resolution
+	mtime = os.path.getmtime(config_path) + 10
+	os.utime(config_path, (mtime, mtime))
+
+
+class TestConfigWatcher():
+
+	def test_unchanged_config(self, config_path):
+		watcher = ConfigWatcher(config_path)
+		listener = FakeListener()
+		watcher.add_listener(listener)
+
+		assert watcher.check() == []
+		# Saved again with the same content
+		rewrite(config_path, config_path.read_text())
+		assert watcher.check() == []
+		assert listener.configs == []
+
+	def test_changes_are_reloaded(self, config_path):
+		watcher = ConfigWatcher(config_path)
+		listener = FakeListener()
+		watcher.add_listener(listener)
+		keyword_helper = get_keyword_helper('bot_a')
+
+		rewrite(config_path, '[DEFAULT]\nnegative_keywords = cilantro\n[bot_a]\nhuman_author_reply_boost = 0.6\n[bot_b]\n')
+
+		assert watcher.check() == [
+			"[DEFAULT] negative_keywords: 'spoilers' -> 'cilantro'",
+			"[bot_a] human_author_reply_boost: '0.3' -> '0.6'",
+			"[bot_b] added"]
+		assert listener.configs[0]['bot_a'].getfloat('human_author_reply_boost') == 0.6
+
+		# The keyword helpers were rebuilt with the new keywords
+		assert get_keyword_helper('bot_a') is not keyword_helper
+		assert get_keyword_helper('bot_a').negative_keyword_matches('cilantro spoilers') == ['cilantro']
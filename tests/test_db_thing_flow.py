@@ -1,7 +1,14 @@
+import time
+
+from types import SimpleNamespace
+
 import pytest
+from peewee import SqliteDatabase
 from playhouse.sqliteq import SqliteQueueDatabase
 
-from bot_db.db import Thing
+from bot_db.db import LeaseKeeper, Thing, claim_jobs, release_job
+from generators.scraper import ImageScraper
+from generators.text2image import Text2Image
 MODELS = [Thing]
 
 test_db = SqliteQueueDatabase(':memory:')
@@ -85,3 +92,90 @@ class TestThingFlow(DBTestCase):
 		thing.save()
 
 		assert thing.status == 8
+
+
+class TestJobLeasing():
+
+	@pytest.fixture(autouse=True)
+	def lease_db(self):
+		lease_db = SqliteDatabase(':memory:')
+		with lease_db.bind_ctx(MODELS):
+			lease_db.create_tables(MODELS)
+			yield
+
+	def _create_jobs(self, bot_username, count):
+		return [Thing.create(bot_username=bot_username, source_name=f't1_{i}', author='testuser',
+				text_generation_parameters={'prompt': 'test'}) for i in range(count)]
+
+	def _query(self, bot_username):
+		return Thing.select(Thing).where(Thing.bot_username == bot_username).where(Thing.status == 3).order_by(Thing.id)
+
+	def test_workers_claim_different_jobs(self):
+		self._create_jobs('leasebot1', 4)
+
+		first = claim_jobs(self._query('leasebot1'), 'worker_1', 60, limit=2)
+		second = claim_jobs(self._query('leasebot1'), 'worker_2', 60, limit=3)
+
+		assert len(first) == 2
+		assert len(second) == 2
+		assert not {job.id for job in first} & {job.id for job in second}
+
+	def test_expired_lease_reclaimed(self):
+		self._create_jobs('leasebot2', 1)
+
+		claim_jobs(self._query('leasebot2'), 'worker_1', -1)
+		reclaimed = claim_jobs(self._query('leasebot2'), 'worker_2', 60)
+
+		assert [job.lease_owner for job in reclaimed] == ['worker_2']
+
+	def test_released_job_claimable(self):
+		self._create_jobs('leasebot3', 1)
+
+		job = claim_jobs(self._query('leasebot3'), 'worker_1', 60)[0]
+		release_job(job)
+		job.save()
+
+		assert len(claim_jobs(self._query('leasebot3'), 'worker_2', 60)) == 1
+
+	def test_lease_kept_during_long_work(self, tmp_path):
+		# The lease is renewed from another thread, so the database has to be shared between connections
+		file_db = SqliteDatabase(str(tmp_path / 'lease.sqlite3'))
+		with file_db.bind_ctx(MODELS):
+			file_db.create_tables(MODELS)
+			self._create_jobs('leasebot4', 1)
+
+			job = claim_jobs(self._query('leasebot4'), 'worker_1', 0.3)[0]
+			with LeaseKeeper([job], 'worker_1', 0.3):
+				time.sleep(0.6)
+				# The lease would have expired without renewal
+				assert claim_jobs(self._query('leasebot4'), 'worker_2', 60) == []
+
+	def test_scraper_claims_one_job(self):
+		for i in range(3):
+			Thing.create(bot_username='leasebot5', source_name=f't3_{i}', author='testuser',
+				text_generation_parameters={'prompt': 'test'}, generated_text='text',
+				image_generation_parameters={'type': 'scraper', 'prompt': 'a cat'})
+
+		scraper = ImageScraper.__new__(ImageScraper)
+		scraper._worker_id = 'scraper_1'
+		scraper._lease_seconds = 60
+
+		assert len(scraper.top_pending_jobs()) == 1
+		assert Thing.select().where(Thing.lease_owner.is_null()).count() == 2
+
+	def test_text2image_releases_refused_jobs(self):
+		Thing.create(bot_username='leasebot6', source_name='t3_0', author='testuser',
+			text_generation_parameters={'prompt': 'test'}, generated_text='text',
+			image_generation_parameters={'type': 'text2image', 'prompt': 'a cat'})
+
+		text2image = Text2Image.__new__(Text2Image)
+		text2image._worker_id = 't2i_1'
+		text2image._lease_seconds = 60
+		text2image._memory_admission = SimpleNamespace(admit=lambda name, required: False)
+
+		jobs = text2image.top_pending_jobs()
+		assert len(jobs) == 1
+		assert not text2image.admit_jobs(jobs)
+
+		# Another generator can take the job straight away
+		assert Thing.get_by_id(jobs[0].id).lease_owner is None
@@ -0,0 +1,34 @@
+import pytest
+
+from generators.text.early_abort import EarlyAbortCheck
+from utils.keyword_helper import KeywordHelper
+
+
+class FakeToxicityHelper():
+
+	def __init__(self):
+		self.texts = []
+
+	def text_above_toxicity_threshold(self, input_text, threshold_profile=None):
+		self.texts.append(input_text)
+		return 'toxic' in input_text
+
+
+class TestEarlyAbortCheck():
+
+	def test_negative_keyword(self):
+		check = EarlyAbortCheck(KeywordHelper())
+		assert check('<|sor|>a murderous', 2) == 'negative keywords murder'
+
+	def test_clean_text_continues(self):
+		check = EarlyAbortCheck(KeywordHelper())
+		assert check('<|sor|>what a lovely day', 5) is None
+
+	def test_toxicity_interval(self):
+		toxicity_helper = FakeToxicityHelper()
+		check = EarlyAbortCheck(KeywordHelper(), toxicity_helper, toxicity_interval=4)
+
+		assert check('<|sor|>so toxic', 3) is None
+		assert check('<|sor|>so toxic', 4) == 'failed toxicity test'
+		# The tags are removed before scoring
+		assert toxicity_helper.texts == ['so toxic']
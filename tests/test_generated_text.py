@@ -53,6 +53,23 @@ class TestGeneratedTextParsing():
 		assert returned_dict == expected
 
 
+class TestGenerationComplete():
+
+	@pytest.mark.parametrize("source_name, prompt, new_text, expected",
+		[('t1_aaaaaa', '<|sor|>', 'A reply in progress', False),
+		('t1_aaaaaa', '<|sor|>', 'A finished reply<|e', True),
+		('t3_new_submission', '<|sols|><|sot|>', 'A link title', False),
+		('t3_new_submission', '<|sols|><|sot|>', 'A link title<|', True),
+		('t3_new_submission', '<|soss|><|sot|>', 'A title<|eot|><|so', False),
+		('t3_new_submission', '<|soss|><|sot|>', 'A title<|eot|><|sost|>Selftext in progress', False),
+		('t3_new_submission', '<|soss|><|sot|>', 'A title<|eot|><|sost|>Finished selftext<|', True),
+		('t3_new_submission', '<|soss|><|sot|>', 'A title<|eot|><|sor|>', True)])
+	def test_generation_complete(self, source_name, prompt, new_text, expected):
+
+		logic = TaggingMixin()
+		assert logic.is_generation_complete(source_name, prompt, new_text) == expected
+
+
 class TestGeneratedTextValidation():
 
 	@pytest.mark.parametrize("source_name, prompt, text, expected",
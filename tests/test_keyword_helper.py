@@ -1,7 +1,12 @@
 
+import os
+import re
+import time
+
 import pytest
 
-from utils.keyword_helper import KeywordHelper
+import utils.keyword_helper
+from utils.keyword_helper import KeywordHelper, KeywordMatcher, get_keyword_helper
 
 
 class TestKeywordHelper():
@@ -14,3 +19,91 @@ class TestKeywordHelper():
         kh = KeywordHelper()
         matches = kh.negative_keyword_matches(test_input)
         assert matches == expected
+
+
+class TestKeywordMatcher():
+
+	@pytest.mark.parametrize("test_input",
+		['Israel and ISIS', 'the rapist was a pedophile', 'nothing to see here', 'antisemitic semitism', ''])
+	def test_matches_are_the_same_as_separate_searches(self, test_input):
+		kh = KeywordHelper()
+		assert kh.negative_keyword_matches(test_input) == search_each_keyword(kh._negative_keywords, test_input)
+
+	def test_overlapping_keywords(self):
+		matcher = KeywordMatcher(['is', 'israel', 'isis', 'rael'])
+		assert matcher.matches('Israel, isis') == ['is', 'israel', 'isis']
+
+	def test_matches_on_a_longer_corpus(self):
+		kh = KeywordHelper()
+		texts = [f"comment {i} about the weather, the game last night and a murder mystery novel" * 3 for i in range(50)]
+
+		assert [kh.negative_keyword_matches(text) for text in texts] == [search_each_keyword(kh._negative_keywords, text) for text in texts]
+
+	@pytest.mark.parametrize("test_input",
+		['cat', 'the dog', 'hotdog', 'bobo', 'bo bo', 'Israel, isis', 'A [cat]'])
+	def test_keywords_that_cant_be_combined(self, test_input):
+		# A top level | and backreferences match differently inside the combined regex, so they're searched for separately
+		keywords = ['cat|dog', r'(bo)\1', r'(?P<word>\w+) (?P=word)', 'is', '(?:israel|isis)', r'[|]cat', r'[]|]']
+		matcher = KeywordMatcher(keywords)
+
+		assert len(matcher._keyword_regexes) == 3
+		assert matcher.matches(test_input) == search_each_keyword(keywords, test_input)
+
+
+class TestKeywordHelperRegistry():
+
+	@pytest.fixture
+	def config_path(self, tmp_path, monkeypatch):
+		monkeypatch.setattr(utils.keyword_helper, 'ROOT_DIR', tmp_path)
+		monkeypatch.setattr(utils.keyword_helper, '_keyword_helpers', {})
+		config_path = tmp_path / 'ssi-bot.ini'
+		config_path.write_text('[DEFAULT]\nnegative_keywords = spoilers\n[bot_a]\n[bot_b]\n')
+		return config_path
+
+	def rewrite(self, config_path, text):
+		config_path.write_text(text)
+		# Make sure the modification time changes, whatever the file system's resolution
+		mtime = os.path.getmtime(config_path) + 10
+		os.utime(config_path, (mtime, mtime))
+
+	def test_helpers_are_shared(self, config_path):
+		assert get_keyword_helper('bot_a') is get_keyword_helper('bot_a')
+		assert get_keyword_helper('bot_a') is not get_keyword_helper('bot_b')
+		assert get_keyword_helper('bot_a').negative_keyword_matches('no spoilers please') == ['spoilers']
+
+	def test_only_changed_sections_are_rebuilt(self, config_path):
+		bot_a_helper = get_keyword_helper('bot_a')
+		bot_b_helper = get_keyword_helper('bot_b')
+
+		self.rewrite(config_path, '[DEFAULT]\nnegative_keywords = spoilers\n[bot_a]\nnegative_keywords = cilantro\n[bot_b]\nother_option = 1\n')
+
+		assert get_keyword_helper('bot_a') is not bot_a_helper
+		assert get_keyword_helper('bot_a').negative_keyword_matches('cilantro spoilers') == ['cilantro']
+		assert get_keyword_helper('bot_b') is bot_b_helper
+
+
+def search_each_keyword(keywords, text):
+	# How the keywords were matched before they were compiled into one regex
+	return [keyword for keyword in keywords if re.search(r"\b{}".format(keyword), text, re.IGNORECASE)]
+
+
+@pytest.mark.skipif(not os.environ.get('RUN_BENCHMARKS'), reason="Benchmarks only run with RUN_BENCHMARKS set")
+class TestKeywordMatchingBenchmark():
+	# Run with RUN_BENCHMARKS=1 python -m pytest -s tests/test_keyword_helper.py to see the timings
+
+	def test_compiled_matcher_against_separate_searches(self):
+		kh = KeywordHelper()
+		texts = [f"comment {i} about the weather, the game last night and a murder mystery novel" * 3 for i in range(500)]
+
+		start_time = time.perf_counter()
+		expected = [search_each_keyword(kh._negative_keywords, text) for text in texts]
+		separate_time = time.perf_counter() - start_time
+
+		start_time = time.perf_counter()
+		matches = [kh.negative_keyword_matches(text) for text in texts]
+		compiled_time = time.perf_counter() - start_time
+
+		print(f"{len(texts)} texts: separate searches {separate_time * 1000:.1f}ms, compiled matcher {compiled_time * 1000:.1f}ms, "
+			f"{separate_time / compiled_time:.1f}x faster")
+
+		assert matches == expected
@@ -71,3 +71,50 @@ Which of these bots do you prefer?
 Which of these bots do you prefer?
 
 [View Poll](https://www.reddit.com/poll/shfl4g) - Critical-Jossi - Conspiracy - Civbot - Yskbot<|eost|><|sor u/Den_Hviide|> is my fav of the four for sure!<|eor|><|sor u/Conspiracy_GPT2|>I feel that all four are OK<|eor|><|soocr u/Den_Hviide|>Sure, but you're the best.<|eoocr|>"""
+
+
+class WordTokenizer():
+	# Stands in for the model's tokenizer, with one token per word
+
+	def encode(self, text, add_special_tokens=False):
+		return text.split(' ')
+
+	def decode(self, tokens):
+		return ' '.join(tokens)
+
+
+class TestPackTaggedSegments():
+
+	# Newest first, as collated
+	segments = ['<|sor|>one two three<|eor|>', '<|sor|>four five<|eor|>', '<|soss|><|sot|>six seven eight nine<|eot|>']
+
+	def test_all_segments_fit(self):
+		logic = LogicMixin()
+		logic._prompt_tokenizer = WordTokenizer()
+		output = logic._pack_tagged_segments(self.segments, token_budget=9)
+		assert output == ''.join(reversed(self.segments))
+
+	def test_whole_segments_only(self):
+		logic = LogicMixin()
+		logic._prompt_tokenizer = WordTokenizer()
+		output = logic._pack_tagged_segments(self.segments, token_budget=8)
+		assert output == '<|sor|>four five<|eor|><|sor|>one two three<|eor|>'
+
+	def test_newest_segment_truncated(self):
+		logic = LogicMixin()
+		logic._prompt_tokenizer = WordTokenizer()
+		output = logic._pack_tagged_segments(self.segments, token_budget=2)
+		# The opening tag is kept whole, and the end of the text fills the rest of the budget
+		assert output == '<|sor|>three<|eor|>'
+
+	def test_truncated_segment_keeps_all_its_tags(self):
+		logic = LogicMixin()
+		logic._prompt_tokenizer = WordTokenizer()
+		output = logic._pack_tagged_segments(self.segments[2:], token_budget=3)
+		assert output == '<|soss|><|sot|>eight nine<|eot|>'
+
+	def test_encodings_cached(self):
+		logic = LogicMixin()
+		logic._prompt_tokenizer = WordTokenizer()
+		logic._pack_tagged_segments(self.segments, token_budget=9)
+		assert list(logic._tagged_segment_encodings.keys()) == self.segments
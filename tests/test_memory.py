@@ -0,0 +1,83 @@
+import subprocess
+import sys
+
+from configparser import ConfigParser
+
+import pytest
+
+import utils.memory
+
+from generators.text2image import Text2Image
+from utils.memory import MemoryAdmission, PeakMemorySampler
+
+
+class TestMemoryAdmission():
+
+	@pytest.fixture(autouse=True)
+	def available_memory(self, monkeypatch):
+		monkeypatch.setattr(utils.memory, 'get_available_memory', lambda gpu=False: 1000)
+
+	def test_admitted(self):
+		assert MemoryAdmission().admit('job', 800)
+
+	def test_waits(self):
+		assert not MemoryAdmission().admit('job', 1200)
+
+	def test_reserved_memory_counted(self):
+		assert not MemoryAdmission().admit('job', 800, reserved=400)
+
+	def test_evicts_until_enough(self):
+		released = [300, 300, 300]
+		evict = lambda: released.pop(0) if released else 0
+
+		assert MemoryAdmission().admit('job', 1500, evict=evict)
+		# Two evictions were enough, the third model stays loaded
+		assert released == [300]
+
+	def test_waits_when_eviction_insufficient(self):
+		released = [300]
+		evict = lambda: released.pop(0) if released else 0
+
+		assert not MemoryAdmission().admit('job', 1500, evict=evict)
+
+
+class TestPeakMemorySampler():
+
+	def test_samples_quiet_child(self):
+		# The child allocates memory and prints nothing
+		child = subprocess.Popen([sys.executable, '-c', 'import time; data = bytearray(100 * 1024 * 1024); time.sleep(1)'])
+		memory_sampler = PeakMemorySampler(child.pid, interval=0.05)
+		memory_sampler.start()
+		child.wait()
+
+		assert memory_sampler.stop() > 100 * 1024
+
+
+class TestText2ImageMemoryRequired():
+
+	def test_highest_peak_kept(self):
+		text2image = Text2Image.__new__(Text2Image)
+
+		text2image._update_memory_required(3000000)
+		assert text2image._memory_required == 3000000
+
+		# A shorter run doesn't lower the requirement
+		text2image._update_memory_required(1000)
+		assert text2image._memory_required == 3000000
+
+		text2image._update_memory_required(4000000)
+		assert text2image._memory_required == 4000000
+
+	def test_failed_run_not_measured(self, tmp_path):
+		# A generate script that exits without writing the image
+		(tmp_path / 'generate.py').write_text('print("out of memory")\n')
+
+		text2image = Text2Image.__new__(Text2Image)
+		text2image._use_gpu = False
+		text2image._config = ConfigParser()
+		text2image._config['bot'] = {'vqgan-clip_path': str(tmp_path)}
+
+		with pytest.raises(AssertionError):
+			text2image.generate_image('bot', {'prompt': 'a cat'})
+
+		assert text2image._memory_required == Text2Image._memory_required
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+import torch
+
+from concurrent.futures import ThreadPoolExecutor
+
+from generators.text.model_cache import ModelCache
+
+
+class TestModelCache():
+
+	def _loader(self, model_path, backend):
+		# 255 float32 weights + 1 float32 bias = 1 KB
+		return torch.nn.Linear(255, 1)
+
+	def test_shared_instance(self):
+		cache = ModelCache(loader=self._loader)
+		first = cache.get('models/a')
+		second = cache.get('models/a')
+
+		assert first is second
+		assert cache.loads == 1
+		assert cache.hits == 1
+
+	def test_footprint(self):
+		cache = ModelCache(loader=self._loader)
+		cache.get('models/a')
+		assert cache.resident_memory() == 1
+
+	def test_lru_eviction(self):
+		cache = ModelCache(memory_budget=2, loader=self._loader)
+		cache.get('models/a')
+		cache.get('models/b')
+		# Touch a so that b becomes the least recently used
+		cache.get('models/a')
+		cache.get('models/c')
+
+		assert cache.resident_paths() == ['models/a', 'models/c']
+		assert cache.evictions == 1
+		assert cache.stats()['loads'] == 3
+
+	def test_backends_cached_separately(self):
+		cache = ModelCache(loader=self._loader)
+		first = cache.get('models/a')
+		second = cache.get('models/a', backend='quantized')
+
+		assert first is not second
+		assert cache.resident_paths() == ['models/a', 'models/a:quantized']
+
+	def test_evict_lru_keeps_model_in_use(self):
+		cache = ModelCache(loader=self._loader)
+		cache.get('models/a')
+		cache.get('models/b')
+
+		assert cache.evict_lru(keep='models/a') == 1
+		assert cache.evict_lru(keep='models/a') == 0
+		assert cache.resident_paths() == ['models/a']
+
+	def test_measured_footprint_remembered(self):
+		cache = ModelCache(loader=self._loader)
+		cache.get('models/a')
+		cache.evict('models/a')
+
+		assert not cache.is_resident('models/a')
+		assert cache.estimate_footprint('models/a') == 1
+
+	def test_models_load_in_parallel(self):
+		def slow_loader(model_path, backend):
+			time.sleep(0.5)
+			return self._loader(model_path, backend)
+
+		cache = ModelCache(loader=slow_loader)
+		start_time = time.time()
+		with ThreadPoolExecutor(max_workers=3) as executor:
+			models = list(executor.map(cache.get, ['models/a', 'models/b', 'models/a']))
+
+		# a and b loaded at the same time, and the second request for a waited for the first
+		assert time.time() - start_time < 1
+		assert models[0] is models[2]
+		assert cache.loads == 2
@@ -0,0 +1,233 @@
+import threading
+import time
+
+from configparser import ConfigParser
+
+import pytest
+from peewee import SqliteDatabase
+
+import generators.text.model_text_generator
+
+from bot_db.db import Thing
+from generators.text.model_text_generator import ModelTextGenerator
+from generators.text.scheduler import PRIORITY_MENTION, GenerationScheduler, parse_deadlines
+from generators.text.worker_pool import GenerationWorkerPool
+
+MODELS = [Thing]
+
+CONFIG = """
+[DEFAULT]
+text_generation_batch_size = 2
+text_generation_early_abort = false
+
+[bot_a]
+text_model_path = models/a
+
+[bot_b]
+text_model_path = models/b
+"""
+
+
+class FakeModelCache():
+
+	def is_resident(self, key):
+		return True
+
+	def estimate_footprint(self, model_path, backend):
+		return 0
+
+	def evict_lru(self, keep=None):
+		return 0
+
+
+class FakeTextGenerator():
+	# Stands in for the TextGenerator, replying to each prompt with the next of its replies
+
+	def __init__(self, replies=('a reply<|eor|>',)):
+		self.replies = replies
+		self.calls = []
+		self.model_cache = FakeModelCache()
+
+	def generate(self, model_path, prompts, text_generation_parameters, source_names, backend='pytorch', abort_checks=None):
+		self.calls.append((model_path.name, prompts))
+		num_return_sequences = text_generation_parameters.get('num_return_sequences', 1)
+		return [[prompt + self.replies[i % len(self.replies)] for i in range(num_return_sequences)] for prompt in prompts]
+
+
+class FakeMemoryAdmission():
+
+	def __init__(self, admitted=True):
+		self.admitted = admitted
+		self.requests = []
+
+	def admit(self, name, required, reserved=0, evict=None):
+		self.requests.append(required)
+		return self.admitted
+
+
+@pytest.fixture
+def generator_db():
+	generator_db = SqliteDatabase(':memory:')
+	with generator_db.bind_ctx(MODELS):
+		generator_db.create_tables(MODELS)
+		yield generator_db
+
+
+@pytest.fixture
+def generator(generator_db):
+	config = ConfigParser()
+	config.read_string(CONFIG)
+
+	generator = ModelTextGenerator(config)
+	generator._text_generator = FakeTextGenerator()
+	generator._memory_admission = FakeMemoryAdmission()
+	# Validation without the bots' keyword lists or the toxicity model
+	generator.test_text_against_keywords = lambda bot_username, generated_text: ['badword'] if 'badword' in generated_text else []
+	generator.validate_toxicity = lambda bot_username, prompt, generated_text: False
+	return generator
+
+
+def create_job(bot_username='bot_a', prompt='<|sor|>hello<|eor|><|sor|>', priority=None, created_utc=None, **kwargs):
+	fields = {'created_utc': created_utc} if created_utc else {}
+	return Thing.create(bot_username=bot_username, source_name='t1_abc', author='someone', priority=priority,
+		text_generation_parameters=dict({'prompt': prompt, 'max_length': 8}, **kwargs), **fields)
+
+
+class TestBatching():
+
+	def test_batch_jobs(self, generator):
+		jobs = [create_job('bot_a', prompt='one'), create_job('bot_b'), create_job('bot_a', prompt='two'),
+				create_job('bot_a', temperature=0.5), create_job('bot_a', prompt='three')]
+
+		batches = list(generator.batch_jobs(jobs))
+
+		# Grouped by model and parameters apart from the prompt, then split into batches of text_generation_batch_size
+		assert [[job.id for job in batch] for batch in batches] == [[1, 3], [5], [2], [4]]
+
+	def test_top_pending_jobs(self, generator):
+		now = time.time()
+		old_reply = create_job(created_utc=now - 600)
+		mention = create_job('bot_b', priority=PRIORITY_MENTION, created_utc=now - 60)
+		taken_reply = create_job(created_utc=now - 900)
+		Thing.update(lease_owner='other_generator', lease_expires=now + 60).where(Thing.id == taken_reply.id).execute()
+		create_job(created_utc=now - 30)
+
+		jobs = generator.top_pending_jobs()
+
+		# Mentions go first, the other generator's job is left alone, and only one batch of jobs is claimed
+		assert [job.id for job in jobs] == [mention.id, old_reply.id]
+		assert [job.id for job in Thing.select().where(Thing.lease_owner == generator._worker_id).order_by(Thing.id)] == [old_reply.id, mention.id]
+
+	def test_expired_jobs_are_failed(self, generator):
+		generator._scheduler = GenerationScheduler(parse_deadlines('reply=60'))
+		expired_job = create_job(created_utc=time.time() - 7200)
+		job = create_job()
+
+		assert [j.id for j in generator.top_pending_jobs()] == [job.id]
+		assert Thing.get_by_id(expired_job.id).status == 9
+
+	def test_batch_generated_together(self, generator):
+		create_job(prompt='<|sor|>one<|eor|><|sor|>')
+		create_job(prompt='<|sor|>two<|eor|><|sor|>')
+
+		jobs = generator.top_pending_jobs()
+		for batch, future in generator.dispatch_batches(jobs):
+			generator.process_batch(batch, future)
+
+		assert generator._text_generator.calls == [('a', ['<|sor|>one<|eor|><|sor|>', '<|sor|>two<|eor|><|sor|>'])]
+
+		for job in Thing.select().order_by(Thing.id):
+			assert job.generated_text == job.text_generation_parameters['prompt'] + 'a reply<|eor|>'
+			assert job.text_generation_attempts == 1
+			assert job.lease_owner is None
+			assert job.status == 7
+
+
+class TestDispatchBatches():
+
+	def test_refused_batch_is_released(self, generator):
+		create_job()
+		generator._memory_admission = FakeMemoryAdmission(admitted=False)
+
+		jobs = generator.top_pending_jobs()
+		assert [job.lease_owner for job in jobs] == [generator._worker_id]
+
+		assert generator.dispatch_batches(jobs) == []
+
+		# Another generator can take the job straight away
+		assert Thing.get_by_id(jobs[0].id).lease_owner is None
+		assert generator._text_generator.calls == []
+
+
+
+def fake_worker_pool(num_workers):
+	# The pool's record of loaded models, without starting any worker processes
+	pool = GenerationWorkerPool.__new__(GenerationWorkerPool)
+	pool._num_workers = num_workers
+	pool._loaded_models = {}
+	pool._loaded_models_lock = threading.Lock()
+	return pool
+
+
+class TestWorkerMemoryAdmission():
+
+	def test_model_charged_until_every_worker_has_loaded_it(self, generator, monkeypatch):
+		monkeypatch.setattr(generators.text.model_text_generator, 'estimate_model_footprint', lambda model_path, backend: 500000)
+		generator._text_generator = None
+		generator._worker_pool = fake_worker_pool(2)
+		generator._sequence_memory = 1000
+		model = (str(generator._get_model_path('bot_a')), 'pytorch')
+		jobs = [create_job()]
+
+		assert generator.admit_batch(jobs) == 501000
+
+		# One worker has loaded it, but the other may take the next batch and load its own copy
+		generator._worker_pool._add_loaded_model(101, model)
+		assert generator.admit_batch(jobs) == 501000
+
+		generator._worker_pool._add_loaded_model(101, model)
+		generator._worker_pool._add_loaded_model(102, model)
+		assert generator.admit_batch(jobs) == 1000
+
+
+class TestCandidates():
+
+	def test_first_passing_candidate_is_used(self, generator):
+		generator._num_candidates = 3
+		generator._text_generator = FakeTextGenerator(['no end tag', 'a badword<|eor|>', 'a reply<|eor|>'])
+		create_job()
+
+		jobs = generator.top_pending_jobs()
+		for batch, future in generator.dispatch_batches(jobs):
+			generator.process_batch(batch, future)
+
+		job = Thing.get_by_id(jobs[0].id)
+		assert job.generated_text == '<|sor|>hello<|eor|><|sor|>a reply<|eor|>'
+		# Every candidate's outcome is recorded
+		assert job.text_generation_candidates == [
+			{'attempt': 0, 'candidate': 0, 'passed': False, 'reason': 'failed validation'},
+			{'attempt': 0, 'candidate': 1, 'passed': False, 'reason': 'negative keywords badword'},
+			{'attempt': 0, 'candidate': 2, 'passed': True, 'reason': None}]
+
+	def test_later_candidates_are_not_checked(self, generator):
+		job = create_job()
+
+		generator.process_candidates(job, ['<|sor|>hello<|eor|><|sor|>a reply<|eor|>', '<|sor|>hello<|eor|><|sor|>a badword<|eor|>'])
+
+		assert job.text_generation_candidates == [{'attempt': 0, 'candidate': 0, 'passed': True, 'reason': None}]
+
+	def test_attempts_are_recorded_together(self, generator):
+		generator._num_candidates = 2
+		generator._text_generator = FakeTextGenerator(['no end tag', 'still no end tag'])
+		create_job()
+
+		for _ in range(2):
+			jobs = generator.top_pending_jobs()
+			for batch, future in generator.dispatch_batches(jobs):
+				generator.process_batch(batch, future)
+
+		job = Thing.get_by_id(jobs[0].id)
+		assert job.generated_text is None
+		assert job.text_generation_attempts == 2
+		assert [(c['attempt'], c['candidate'], c['reason']) for c in job.text_generation_candidates] == [
+			(0, 0, 'failed validation'), (0, 1, 'failed validation'), (1, 0, 'failed validation'), (1, 1, 'failed validation')]
@@ -0,0 +1,42 @@
+import pytest
+import torch
+
+from generators.text.prefix_cache import PrefixCache
+
+
+class TestPrefixCache():
+
+	def _past(self, length):
+		# One layer, with a (key, value) pair shaped [batch, heads, sequence, head size]
+		return ((torch.arange(length).view(1, 1, length, 1), torch.arange(length).view(1, 1, length, 1)),)
+
+	def test_longest_prefix(self):
+		cache = PrefixCache(block_size=4)
+		cache.add('model', list(range(10)), self._past(10))
+
+		length, past = cache.longest_prefix('model', list(range(9)) + [99, 100])
+		assert length == 8
+		assert past[0][0].shape[2] == 8
+
+	def test_leaves_a_token_to_process(self):
+		cache = PrefixCache(block_size=4)
+		cache.add('model', list(range(8)), self._past(8))
+
+		length, _ = cache.longest_prefix('model', list(range(8)))
+		assert length == 4
+
+	def test_miss(self):
+		cache = PrefixCache(block_size=4)
+		cache.add('model', list(range(8)), self._past(8))
+
+		assert cache.longest_prefix('other_model', list(range(8)) + [1]) == (0, None)
+		assert cache.longest_prefix('model', [5] * 9) == (0, None)
+		assert cache.stats()['misses'] == 2
+
+	def test_lru_eviction(self):
+		cache = PrefixCache(max_entries=1, block_size=4)
+		cache.add('model', list(range(8)), self._past(8))
+		cache.add('model', [5] * 8, self._past(8))
+
+		assert cache.longest_prefix('model', list(range(9)))[0] == 0
+		assert cache.longest_prefix('model', [5] * 9)[0] == 8
@@ -2,6 +2,10 @@ import itertools
 import pickle
 import pytest
 
+from types import SimpleNamespace
+
+from peewee import SqliteDatabase
+
 from reddit_io.reddit_io import *
 
 
@@ -48,7 +52,7 @@ class TestReplyMatchesHisory():
 		comment = self._get_comment_by_id(submission.comments, 'hvl56vi')
 		reply_body = "You are not allowed to post here."
 
-		result = RedditIO._check_reply_matches_history(RedditIO, comment, reply_body)
+		result = RedditIO.__new__(RedditIO)._check_reply_matches_history(comment, reply_body)
 		assert result == True
 
 	def test_reply_matches_history_negative(self, submission):
@@ -56,5 +60,93 @@ class TestReplyMatchesHisory():
 		comment = self._get_comment_by_id(submission.comments, 'hvl56vi')
 		reply_body = "Thank you lord Gutenman."
 
-		result = RedditIO._check_reply_matches_history(RedditIO, comment, reply_body)
+		result = RedditIO.__new__(RedditIO)._check_reply_matches_history(comment, reply_body)
 		assert result == False
+
+
+class FakeComment(praw_Comment):
+
+	def __init__(self, comment_id):
+		# Set the attributes directly, so nothing is fetched from reddit
+		self.__dict__.update(id=comment_id, name=f't1_{comment_id}', subreddit='test', created_utc=0, author=None)
+
+
+def fake_stream(pages):
+	# A PRAW stream with pause_after=0 yields None each time it has caught up
+	for page in pages:
+		yield from page
+		yield None
+
+
+class TestIncomingStreams():
+
+	@pytest.fixture
+	def bot_io(self):
+		stream_db = SqliteDatabase(':memory:')
+		with stream_db.bind_ctx([db_Thing]):
+			stream_db.create_tables([db_Thing])
+
+			bot_io = RedditIO.__new__(RedditIO)
+			bot_io._bot_username = 'bot_a'
+			bot_io._seen_things = BoundedSet(10)
+			bot_io._is_praw_thing_removed_or_deleted = lambda praw_thing: False
+			bot_io.calculate_reply_probability = lambda praw_thing: 0
+			yield bot_io
+
+	def test_streams_are_kept_between_polls(self, bot_io, monkeypatch):
+		db_Thing.create(source_name='t1_old', bot_username='bot_a', author='someone')
+		bot_io._warm_seen_things()
+
+		lookups = []
+		names_in_database = bot_io._names_in_database
+		monkeypatch.setattr(bot_io, '_names_in_database', lambda names: lookups.append(sorted(names)) or names_in_database(names))
+
+		bot_io._incoming_streams = (fake_stream([[], []]),
+			fake_stream([[FakeComment('old'), FakeComment('a')], [FakeComment('b')]]))
+
+		bot_io.poll_incoming_streams()
+		bot_io.poll_incoming_streams()
+
+		# The seen set saves looking up the old comment, and each page is looked up in one query
+		assert lookups == [['t1_a'], ['t1_b']]
+		assert [t.source_name for t in db_Thing.select().order_by(db_Thing.id)] == ['t1_old', 't1_a', 't1_b']
+
+	def test_page_is_looked_up_in_one_query(self, bot_io):
+		db_Thing.create(source_name='t1_b', bot_username='bot_a', author='someone')
+		db_Thing.create(source_name='t1_c', bot_username='bot_b', author='someone')
+
+		praw_things = [FakeComment('a'), FakeComment('b'), FakeComment('c'), FakeComment('a')]
+		assert bot_io.find_unseen_names(praw_things) == {'t1_a', 't1_c'}
+
+		bot_io._incoming_streams = (fake_stream([[]]), fake_stream([praw_things]))
+		bot_io.poll_incoming_streams()
+
+		# Each new thing is inserted once
+		assert [t.source_name for t in db_Thing.select().where(db_Thing.bot_username == 'bot_a').order_by(db_Thing.id)] == ['t1_b', 't1_a', 't1_c']
+
+	def test_inserted_things_are_complete(self, bot_io):
+		bot_io.insert_praw_things_into_database([FakeComment('a'), FakeComment('b')])
+		bot_io.insert_praw_thing_into_database(FakeComment('c'))
+
+		# Things inserted together get the same status as one inserted with create, from the pre_save handler
+		assert [t.status for t in db_Thing.select().order_by(db_Thing.id)] == [8, 8, 8]
+
+	def test_inbox_items_after_a_failure_stay_unread(self, bot_io):
+		marked_read = []
+		praw_things = [FakeComment('a'), FakeComment('b'), FakeComment('c')]
+		bot_io._inbox_replies_enabled = True
+		bot_io._praw = SimpleNamespace(inbox=SimpleNamespace(stream=lambda pause_after: fake_stream([praw_things]), mark_read=marked_read.extend))
+
+		def calculate_reply_probability(praw_thing):
+			if praw_thing.id == 'b':
+				raise RuntimeError('reddit is down')
+			return 0
+
+		bot_io.calculate_reply_probability = calculate_reply_probability
+
+		with pytest.raises(RuntimeError):
+			bot_io.poll_inbox_stream()
+
+		# Only the item that was decided on is marked read, the stream yields the others again on the next loop
+		assert [t.name for t in marked_read] == ['t1_a']
+		assert [t.source_name for t in db_Thing.select()] == ['t1_a']
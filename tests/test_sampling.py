@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from types import SimpleNamespace
+
+from generators.text.sampling import sample_tokens
+
+
+def first_tokens(logits, num_return_sequences=200, **kwargs):
+	# The first tokens are sampled from the prefilled logits, before the model is run again
+	past_key_values = ((torch.zeros(1, 1, 1, 1), torch.zeros(1, 1, 1, 1)),)
+	sampler = sample_tokens(SimpleNamespace(device='cpu'), [0], logits, past_key_values, 1, num_return_sequences=num_return_sequences, **kwargs)
+	rows, next_tokens = next(sampler)
+	return set(next_tokens.tolist())
+
+
+class TestSampleTokens():
+
+	logits = torch.log(torch.tensor([[0.6, 0.3, 0.1]]))
+
+	@pytest.mark.parametrize("top_p, expected", [(0.5, {0}), (0.8, {0, 1}), (1.0, {0, 1, 2})])
+	def test_top_p(self, top_p, expected):
+		torch.manual_seed(0)
+		assert first_tokens(self.logits, top_p=top_p) == expected
+
+	def test_top_p_keeps_the_most_likely_token(self):
+		assert first_tokens(self.logits, top_p=0.01) == {0}
@@ -0,0 +1,66 @@
+import pytest
+
+from types import SimpleNamespace
+
+from generators.text.scheduler import (GenerationScheduler, PRIORITY_MENTION, PRIORITY_NEW_SUBMISSION,
+	PRIORITY_OWN_THREAD, PRIORITY_REPLY, get_job_priority, parse_deadlines)
+
+NOW = 1700000000
+
+
+def _job(job_id, bot_username='bot_a', priority=PRIORITY_REPLY, age_minutes=1, source_name='t1_abc'):
+	return SimpleNamespace(id=job_id, bot_username=bot_username, priority=priority,
+		created_utc=NOW - age_minutes * 60, source_name=source_name)
+
+
+class TestGenerationScheduler():
+
+	def test_priority_order(self):
+		jobs = [_job(1, priority=PRIORITY_REPLY, age_minutes=30),
+				_job(2, priority=PRIORITY_NEW_SUBMISSION, age_minutes=20),
+				_job(3, priority=PRIORITY_OWN_THREAD, age_minutes=10),
+				_job(4, priority=PRIORITY_MENTION, age_minutes=5)]
+
+		ready, expired = GenerationScheduler().schedule(jobs, now=NOW)
+
+		assert [job.id for job in ready] == [4, 3, 2, 1]
+		assert expired == []
+
+	def test_bots_take_turns(self):
+		jobs = [_job(1, 'bot_a', age_minutes=50), _job(2, 'bot_a', age_minutes=40), _job(3, 'bot_a', age_minutes=30),
+				_job(4, 'bot_b', age_minutes=20), _job(5, 'bot_c', age_minutes=10)]
+
+		ready, _ = GenerationScheduler().schedule(jobs, now=NOW)
+
+		assert [job.id for job in ready] == [1, 4, 5, 2, 3]
+
+	def test_expired_jobs(self):
+		jobs = [_job(1, priority=PRIORITY_REPLY, age_minutes=200), _job(2, priority=PRIORITY_MENTION, age_minutes=200)]
+
+		ready, expired = GenerationScheduler(parse_deadlines('reply=180')).schedule(jobs, now=NOW)
+
+		assert [job.id for job in ready] == [2]
+		assert [job.id for job in expired] == [1]
+
+	def test_no_deadlines_by_default(self):
+		jobs = [_job(1, priority=PRIORITY_REPLY, age_minutes=100000), _job(2, priority=PRIORITY_MENTION, age_minutes=100000)]
+
+		ready, expired = GenerationScheduler(parse_deadlines('')).schedule(jobs, now=NOW)
+
+		assert [job.id for job in ready] == [2, 1]
+		assert expired == []
+
+	def test_parse_deadlines(self):
+		deadlines = parse_deadlines('mention=60, Reply=30')
+
+		assert deadlines[PRIORITY_MENTION] == 60
+		assert deadlines[PRIORITY_REPLY] == 30
+		assert PRIORITY_NEW_SUBMISSION not in deadlines
+
+	@pytest.mark.parametrize("source_name, expected", [
+		('t3_new_submission', PRIORITY_NEW_SUBMISSION),
+		('t4_abc', PRIORITY_MENTION),
+		('t1_abc', PRIORITY_REPLY),
+	])
+	def test_priority_of_older_jobs(self, source_name, expected):
+		assert get_job_priority(_job(1, priority=None, source_name=source_name)) == expected
@@ -0,0 +1,76 @@
+import pytest
+import torch
+
+from benchmark_generation import build_prompt_corpus, build_tiny_model
+from generators.text.backends import export_onnx, load_model
+from generators.text.sampling import prefill
+from generators.text.text_generator import TextGenerator
+
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+	model_path = tmp_path_factory.mktemp('tiny_gpt2')
+	build_tiny_model(str(model_path), build_prompt_corpus(20), n_embd=32, vocab_size=500)
+	export_onnx(model_path)
+	return model_path
+
+
+@pytest.fixture(scope='module')
+def prompts():
+	return [prompt for source_name, prompt in build_prompt_corpus(4, seed=1) if source_name != 't3_new_submission'][:2]
+
+
+class TestTextBackends():
+
+	@pytest.mark.parametrize('backend', ['pytorch', 'quantized', 'onnx'])
+	def test_generate_from_prefix(self, model_path, prompts, backend):
+		# One prompt goes through the prefix cache and the incremental sampler
+		text_generator = TextGenerator(prefix_cache_size=4)
+		parameters = {'max_length': 8, 'num_return_sequences': 2}
+
+		for _ in range(2):
+			# The second generation continues from the cached past of the first
+			output_list = text_generator.generate(model_path, prompts[:1], parameters, ['t1_test'], backend=backend)
+
+			assert len(output_list) == 1
+			assert len(output_list[0]) == 2
+			for generated_text in output_list[0]:
+				assert generated_text.startswith(prompts[0])
+				assert len(generated_text) > len(prompts[0])
+
+	@pytest.mark.parametrize('backend', ['pytorch', 'quantized', 'onnx'])
+	def test_generate_batch(self, model_path, prompts, backend):
+		text_generator = TextGenerator(prefix_cache_size=0)
+		parameters = {'max_length': 8, 'num_return_sequences': 1}
+
+		output_list = text_generator.generate(model_path, prompts, parameters, ['t1_a', 't1_b'], backend=backend)
+
+		assert len(output_list) == 2
+		for prompt, generated_texts in zip(prompts, output_list):
+			assert generated_texts[0].startswith(prompt)
+			assert len(generated_texts[0]) > len(prompt)
+
+	@pytest.mark.parametrize('prefix_cache_size', [0, 4])
+	def test_prompt_longer_than_context(self, model_path, prompts, prefix_cache_size):
+		# The prompt is cut from the start to leave room for the reply, instead of generating nothing
+		text_generator = TextGenerator(prefix_cache_size=prefix_cache_size)
+		parameters = {'max_length': 8, 'num_return_sequences': 1}
+		prompt = prompts[0] * 200
+		assert len(text_generator.model_cache.get(model_path, 'pytorch').tokenizer.encode(prompt)) > 1024
+
+		output_list = text_generator.generate(model_path, [prompt], parameters, ['t1_test'])
+
+		assert output_list[0][0].startswith(prompt)
+		assert len(output_list[0][0]) > len(prompt)
+
+	def test_onnx_matches_pytorch(self, model_path, prompts):
+		pytorch_model = load_model(str(model_path), 'pytorch')
+		onnx_model = load_model(str(model_path), 'onnx')
+		input_ids = pytorch_model.tokenizer.encode(prompts[0], add_special_tokens=False)
+
+		pytorch_logits, _ = prefill(pytorch_model.model, input_ids)
+		onnx_logits, onnx_past = prefill(onnx_model.model, input_ids[:-1])
+		# Continuing from a past gives the same logits as the whole prompt
+		onnx_logits, _ = prefill(onnx_model.model, input_ids, onnx_past, prefix_length=len(input_ids) - 1)
+
+		assert torch.allclose(pytorch_logits, onnx_logits, atol=1e-4)
@@ -0,0 +1,162 @@
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+from praw.models import Comment as praw_Comment, Submission as praw_Submission
+
+from reddit_io.reddit_io import RedditIO
+from reddit_io.thread_snapshots import CommentSnapshot, SubmissionSnapshot, ThreadSnapshotCache
+
+
+class FakeSubmission(praw_Submission):
+
+	def __init__(self, submission_id, author):
+		# Set the attributes directly, so nothing is fetched from reddit
+		self.__dict__.update(id=submission_id, name=f't3_{submission_id}', author=SimpleNamespace(name=author),
+			title='What is the best bot?', selftext='', is_self=True, subreddit='test', link_flair_text=None,
+			created_utc=time.time(), _fetched=True)
+
+
+class FakeComment(praw_Comment):
+
+	def __init__(self, comment_id, author, parent, submission):
+		self.__dict__.update(id=comment_id, name=f't1_{comment_id}', author=SimpleNamespace(name=author),
+			body=f'Comment {comment_id}', parent_id=parent.name, link_id=submission.name,
+			_replies=[], _submission=submission, _fetched=True)
+
+
+class FakeReddit():
+	"""
+	Answers requests for a comment with its context the same way reddit does,
+	with the submission and the chain of up to 8 ancestors down to the comment.
+	"""
+
+	def __init__(self, submission, comments):
+		self.submission = submission
+		self.comments = comments
+		self.requests = []
+		self.user = SimpleNamespace(me=lambda: SimpleNamespace(name='bot'))
+
+	def get(self, path, params=None):
+		self.requests.append(path)
+
+		comment_id = path.rstrip('/').split('/')[-1]
+		depth = [c.id for c in self.comments].index(comment_id)
+		top_comment = self.comments[max(0, depth - params['context'])]
+
+		return SimpleNamespace(children=[self.submission]), SimpleNamespace(children=[top_comment])
+
+
+def fake_thread(depth, authors=('human_1', 'bot', 'human_2')):
+	# A chain of comments, each replying to the one before it
+	submission = FakeSubmission('sub', 'op')
+	comments = []
+
+	for i in range(depth):
+		parent = comments[-1] if comments else submission
+		comment = FakeComment(f'c{i}', authors[i % len(authors)], parent, submission)
+		if comments:
+			parent._replies.append(comment)
+		comments.append(comment)
+
+	return submission, comments
+
+
+@pytest.fixture
+def bot_io():
+	bot_io = RedditIO.__new__(RedditIO)
+	bot_io._bot_username = 'bot'
+	bot_io._thread_snapshots = ThreadSnapshotCache()
+	bot_io._keyword_helper = SimpleNamespace(negative_keyword_matches=lambda text: [], positive_keyword_matches=lambda text: [])
+	bot_io._toxicity_helper = SimpleNamespace(text_above_toxicity_threshold=lambda text: False)
+	bot_io._reply_weights = RedditIO._default_reply_weights
+	return bot_io
+
+
+class TestThreadSnapshotCache():
+
+	def _thread(self):
+		submission = SubmissionSnapshot('t3_sub', 'op', 'Title', '', True, 'test', None, 0)
+		comment = CommentSnapshot('t1_a', 'human', 'Top level', 't3_sub', 't3_sub', 1)
+		reply = CommentSnapshot('t1_b', 'bot', 'Reply', 't1_a', 't3_sub', 2)
+		return [reply, comment, submission]
+
+	def test_thread(self):
+		cache = ThreadSnapshotCache()
+		thread = self._thread()
+		for snapshot in thread:
+			cache.add(snapshot)
+
+		assert cache.thread('t1_b') == thread
+		assert cache.thread('t1_a') == thread[1:]
+		assert cache.stats() == {'entries': 3, 'hits': 2, 'misses': 0}
+
+	def test_incomplete_thread(self):
+		cache = ThreadSnapshotCache()
+		reply, comment, submission = self._thread()
+		cache.add(reply)
+		cache.add(submission)
+
+		assert cache.thread('t1_b') is None
+		assert cache.misses == 1
+
+	def test_expiry(self):
+		cache = ThreadSnapshotCache(ttl=0)
+		for snapshot in self._thread():
+			cache.add(snapshot)
+
+		assert cache.thread('t1_b') is None
+		assert cache.get('t3_sub') is None
+
+	def test_max_entries(self):
+		cache = ThreadSnapshotCache(max_entries=2)
+		for snapshot in self._thread():
+			cache.add(snapshot)
+
+		# The oldest snapshot was dropped
+		assert cache.get('t1_b') is None
+		assert cache.get('t3_sub') is not None
+
+
+class TestCommentThread():
+
+	def test_reply_decision_fetches_thread_once(self, bot_io):
+		submission, comments = fake_thread(3)
+		bot_io._praw = FakeReddit(submission, comments)
+		comment = comments[-1]
+
+		assert bot_io._find_depth_of_comment(comment) == 3
+		assert bot_io.calculate_reply_probability(comment) > 0
+		assert bot_io.get_reply_tag(comment, 'bot', use_reply_sense=True) == '<|soocr|>'
+
+		prompt = bot_io._collate_tagged_comment_history(comment, use_reply_sense=True)
+		assert prompt == '<|soss r/test|><|sot|>What is the best bot?<|eot|><|sost|><|eost|>'\
+			'<|sor u/human_1|>Comment c0<|eor|><|sor u/bot|>Comment c1<|eor|><|sor u/human_2|>Comment c2<|eor|>'
+
+		assert bot_io._check_reply_matches_history(comment, 'Comment c1')
+		assert not bot_io._check_reply_matches_history(comment, 'Something new')
+
+		assert len(bot_io._praw.requests) == 1
+
+	def test_reply_in_cached_thread(self, bot_io):
+		submission, comments = fake_thread(4)
+		bot_io._praw = FakeReddit(submission, comments)
+
+		assert bot_io._find_depth_of_comment(comments[2]) == 3
+		# A new reply to a comment in the cached thread doesn't need a request
+		assert bot_io._find_depth_of_comment(comments[3]) == 4
+		assert len(bot_io._praw.requests) == 1
+
+	def test_deep_thread(self, bot_io):
+		submission, comments = fake_thread(12)
+		bot_io._praw = FakeReddit(submission, comments)
+
+		# Each request returns the comment and 8 ancestors
+		assert bot_io._find_depth_of_comment(comments[-1]) == 12
+		assert len(bot_io._praw.requests) == 2
+
+		thread = bot_io.get_comment_thread(comments[-1])
+		assert [snapshot.depth for snapshot in thread] == list(range(12, -1, -1))
+		assert len(bot_io._praw.requests) == 2
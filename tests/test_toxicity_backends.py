@@ -0,0 +1,77 @@
+import os
+
+import pytest
+import torch
+
+from detoxify import Detoxify
+from transformers import AlbertConfig, AlbertForSequenceClassification, BertTokenizer
+
+from utils.toxicity_backends import OnnxDetoxify, export_detoxify_onnx, quantize_detoxify, score_deviation
+from utils.toxicity_helper import default_thresholds
+
+corpus_path = os.path.join(os.path.dirname(__file__), 'fixtures', 'toxicity_corpus.txt')
+
+
+def build_tiny_detoxify(vocab_path):
+	"""
+	A randomly initialised classifier with detoxify's labels, so the backends can be compared without downloading it.
+	"""
+	words = sorted({word.lower().strip('.,!?\'') for text in read_corpus() for word in text.split()})
+	with open(vocab_path, 'w') as f:
+		f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words))
+
+	torch.manual_seed(0)
+	config = AlbertConfig(vocab_size=len(words) + 5, embedding_size=16, hidden_size=32, num_hidden_layers=1,
+		num_attention_heads=2, intermediate_size=64, num_labels=len(default_thresholds))
+
+	detoxify = Detoxify.__new__(Detoxify)
+	detoxify.model = AlbertForSequenceClassification(config).eval()
+	detoxify.tokenizer = BertTokenizer(vocab_path)
+	detoxify.class_names = list(default_thresholds)
+	detoxify.device = 'cpu'
+	return detoxify
+
+
+def read_corpus():
+	with open(corpus_path) as f:
+		return [line.strip() for line in f if line.strip()]
+
+
+@pytest.fixture
+def reference(tmp_path):
+	return build_tiny_detoxify(tmp_path / 'vocab.txt')
+
+
+class TestToxicityBackends():
+
+	def test_quantized_parity(self, tmp_path):
+		reference = build_tiny_detoxify(tmp_path / 'vocab.txt')
+		quantized = quantize_detoxify(build_tiny_detoxify(tmp_path / 'vocab.txt'))
+
+		report = score_deviation(reference, quantized, read_corpus())
+
+		assert set(report['labels']) == set(default_thresholds)
+		assert report['max_deviation'] < 0.05
+
+	def test_onnx_parity(self, reference, tmp_path):
+		pytest.importorskip('optimum.onnxruntime')
+
+		try:
+			export_detoxify_onnx(reference, tmp_path / 'onnx')
+		except (FileNotFoundError, RuntimeError) as e:
+			# optimum's exporter only works with the torch versions it supports
+			pytest.skip(f"ONNX export is not supported here: {e}")
+
+		onnx_detoxify = OnnxDetoxify(tmp_path / 'onnx')
+
+		report = score_deviation(reference, onnx_detoxify, read_corpus())
+
+		assert report['max_deviation'] < 1e-4
+		assert set(onnx_detoxify.predict('Hello').keys()) == set(default_thresholds)
+
+	def test_mismatched_labels(self, reference, tmp_path):
+		candidate = build_tiny_detoxify(tmp_path / 'vocab.txt')
+		candidate.class_names = candidate.class_names[:-1]
+
+		with pytest.raises(ValueError):
+			score_deviation(reference, candidate, read_corpus())
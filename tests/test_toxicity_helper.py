@@ -1,7 +1,11 @@
 
 import pytest
 
-from utils.toxicity_helper import ToxicityHelper
+import time
+
+from configparser import ConfigParser
+
+from utils.toxicity_helper import ThresholdProfile, ToxicityHelper, ToxicityScoreCache, default_thresholds
 
 
 class TestToxicityHelper():
@@ -17,3 +21,63 @@ class TestToxicityHelper():
 	def test_non_toxic_text(self):
 		th = ToxicityHelper()
 		th.text_above_toxicity_threshold("Hello, I love you.")
+
+
+class TestThresholdProfile():
+
+	def test_from_config_section(self):
+		config = ConfigParser()
+		config.read_dict({'DEFAULT': {'insult_threshold': '0.9'}, 'bot': {'threat_threshold': '0.5'}})
+
+		thresholds = ThresholdProfile.from_config_section(config['bot']).thresholds
+		assert thresholds['insult'] == pytest.approx(0.9)
+		assert thresholds['threat'] == pytest.approx(0.5)
+		assert thresholds['toxicity'] == pytest.approx(default_thresholds['toxicity'])
+
+	def test_profile_is_immutable(self):
+		profile = ThresholdProfile(default_thresholds)
+
+		with pytest.raises(TypeError):
+			profile.thresholds['toxicity'] = 1
+		with pytest.raises(ValueError):
+			profile._thresholds[0] = 1
+
+	def test_texts_exceeded(self):
+		profile = ThresholdProfile(default_thresholds)
+		clean = {label: 0.0 for label in default_thresholds}
+
+		assert profile.texts_exceeded([clean, dict(clean, threat=0.31), dict(clean, toxicity=0.8)]) == [False, True, False]
+
+	def test_mismatched_labels(self):
+		profile = ThresholdProfile(default_thresholds)
+		assert profile.exceeded({'toxicity': 0.0})
+
+
+class TestToxicityScoreCache():
+
+	def test_hit_and_miss(self):
+		cache = ToxicityScoreCache()
+		assert cache.get('hello there') is None
+
+		cache.add('hello there', {'toxicity': 0.1})
+		# Whitespace is normalised before hashing
+		assert cache.get(' hello\nthere ') == {'toxicity': 0.1}
+		assert cache.stats() == {'entries': 1, 'hits': 1, 'misses': 1}
+
+	def test_least_recently_used_is_evicted(self):
+		cache = ToxicityScoreCache(max_entries=2)
+		cache.add('a', {})
+		cache.add('b', {})
+		cache.get('a')
+		cache.add('c', {})
+
+		assert cache.get('b') is None
+		assert cache.get('a') == {}
+
+	def test_entries_expire(self):
+		cache = ToxicityScoreCache(ttl=0.01)
+		cache.add('a', {})
+		time.sleep(0.02)
+
+		assert cache.get('a') is None
+		assert cache.stats()['entries'] == 0
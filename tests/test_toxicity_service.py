@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+import utils.toxicity_service
+from utils.toxicity_service import ToxicityService
+
+
+class FakeDetoxify():
+
+	def __init__(self, model_type, backend=None, onnx_path=None):
+		self.batches = []
+
+	def predict(self, texts):
+		self.batches.append(list(texts))
+		return {'toxicity': [0.9 if 'toxic' in text else 0.1 for text in texts],
+			'threat': [0.0 for text in texts]}
+
+
+@pytest.fixture
+def service(monkeypatch):
+	monkeypatch.setattr(utils.toxicity_service, 'load_detoxify', FakeDetoxify)
+	service = ToxicityService(max_batch_size=4, max_batch_wait=0.2)
+	service.start()
+	return service
+
+
+class TestToxicityService():
+
+	def test_score(self, service):
+		assert service.score('so toxic') == {'toxicity': 0.9, 'threat': 0.0}
+
+	def test_queued_texts_are_batched(self, service):
+		texts = ['hello', 'toxic', 'there', 'friend', 'again']
+
+		results = service.score_many(texts)
+
+		assert [result['toxicity'] for result in results] == [0.1, 0.9, 0.1, 0.1, 0.1]
+		assert [len(batch) for batch in service._detoxify.batches] == [4, 1]
+
+	def test_threads_share_a_batch(self, service):
+		results = {}
+
+		def score(text):
+			results[text] = service.score(text)['toxicity']
+
+		threads = [threading.Thread(target=score, args=(text,)) for text in ['a', 'b', 'toxic']]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		assert results == {'a': 0.1, 'b': 0.1, 'toxic': 0.9}
+		assert service.batches == 1
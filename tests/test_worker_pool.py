@@ -0,0 +1,76 @@
+from configparser import ConfigParser
+
+import pytest
+from peewee import SqliteDatabase
+
+from benchmark_generation import build_prompt_corpus, build_tiny_model
+from bot_db.db import Thing
+from generators.text.model_text_generator import ModelTextGenerator
+from generators.text.worker_pool import GenerationWorkerPool
+
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+	model_path = tmp_path_factory.mktemp('tiny_gpt2')
+	build_tiny_model(str(model_path), build_prompt_corpus(20), n_embd=32, vocab_size=500)
+	return model_path
+
+
+@pytest.fixture(scope='module')
+def worker_pool(model_path):
+	worker_pool = GenerationWorkerPool(2, {'prefix_cache_size': 0}, [(model_path, 'pytorch')])
+	yield worker_pool
+	worker_pool.shutdown()
+
+
+class TestGenerationWorkerPool():
+
+	def test_warm_up_waits_for_every_worker(self, worker_pool, model_path):
+		warm_up_times = worker_pool.warm_up()
+
+		# One report from each worker, not one worker reporting twice
+		assert len(warm_up_times) == 2
+		for times in warm_up_times:
+			assert list(times) == [(str(model_path), 'pytorch')]
+
+		assert worker_pool.is_loaded_by_every_worker(model_path)
+
+	def test_batches_run_in_the_workers(self, worker_pool, model_path):
+		config = ConfigParser()
+		config.read_string(f"[DEFAULT]\ntext_generation_early_abort = false\n[bot_a]\ntext_model_path = {model_path}\n")
+
+		generator = ModelTextGenerator(config)
+		generator._text_generator = None
+		generator._worker_pool = worker_pool
+		# One batch of a job for each worker
+		generator._claim_limit = 2
+		# Validation without the bots' keyword lists or the toxicity model
+		generator.test_text_against_keywords = lambda bot_username, generated_text: []
+		generator.validate_toxicity = lambda bot_username, prompt, generated_text: False
+
+		prompts = [prompt for source_name, prompt in build_prompt_corpus(4, seed=1) if source_name != 't3_new_submission'][:2]
+
+		pool_db = SqliteDatabase(':memory:')
+		with pool_db.bind_ctx([Thing]):
+			pool_db.create_tables([Thing])
+			for prompt in prompts:
+				Thing.create(bot_username='bot_a', source_name='t1_abc', author='someone',
+					text_generation_parameters={'prompt': prompt, 'max_length': 4})
+
+			jobs = generator.top_pending_jobs()
+			dispatched_batches = generator.dispatch_batches(jobs)
+
+			# Both batches are queued on the workers before either is waited on
+			assert len(dispatched_batches) == 2
+
+			for batch, future in dispatched_batches:
+				[[generated_text]] = future.result()
+				assert generated_text.startswith(batch[0].text_generation_parameters['prompt'])
+
+				generator.process_batch(batch, future)
+
+			for job in Thing.select():
+				# The tiny model's text has no end tag, but each job was generated and checked once
+				assert job.text_generation_attempts == 1
+				assert [candidate['reason'] for candidate in job.text_generation_candidates] == ['failed validation']
+				assert job.lease_owner is None
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Compares the scores of a faster toxicity backend with the reference pytorch model,
+# so the backend can be trusted before setting toxicity_backend in ssi-bot.ini.
+# Usage, from the project root:
+# python -m utils.check_toxicity_backend quantized
+# python -m utils.check_toxicity_backend onnx --export
+
+import argparse
+import json
+import logging
+
+from configparser import ConfigParser
+
+from detoxify import Detoxify
+
+from utils import ROOT_DIR
+from utils.toxicity_backends import export_detoxify_onnx, load_detoxify, score_deviation
+from utils.toxicity_service import default_toxicity_onnx_path
+
+default_corpus_path = ROOT_DIR / 'tests' / 'fixtures' / 'toxicity_corpus.txt'
+
+
+def main():
+
+	logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+	config = ConfigParser()
+	config.read(ROOT_DIR / 'ssi-bot.ini')
+
+	parser = argparse.ArgumentParser(description="Report the largest score deviation of a toxicity backend from the pytorch model")
+	parser.add_argument('backend', choices=['quantized', 'onnx'])
+	parser.add_argument('--export', action='store_true', help="export the ONNX graph before checking it")
+	parser.add_argument('--onnx-path', default=ROOT_DIR / config['DEFAULT'].get('toxicity_onnx_path', default_toxicity_onnx_path))
+	parser.add_argument('--corpus', default=default_corpus_path, help="a text file with one text to score per line")
+	args = parser.parse_args()
+
+	with open(args.corpus) as f:
+		texts = [line.strip() for line in f if line.strip()]
+
+	reference = Detoxify('unbiased-small', device='cpu')
+
+	if args.export:
+		export_detoxify_onnx(reference, args.onnx_path)
+
+	candidate = load_detoxify('unbiased-small', args.backend, args.onnx_path)
+
+	report = score_deviation(reference, candidate, texts)
+	report['backend'] = args.backend
+
+	print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from configparser import ConfigParser
+
+from utils.keyword_helper import reload_keyword_helpers
+
+
+class ConfigWatcher(threading.Thread):
+	"""
+	Watches ssi-bot.ini for changes while the bots are running.
+	When the file's content changes, it is parsed once, the differences are logged,
+	and the new config is passed to the reload_config method of each listener,
+	such as the RedditIO bots and the text generator.
+	"""
+
+	daemon = True
+	name = "ConfigWatcher"
+
+	def __init__(self, config_path, interval=30):
+		super().__init__()
+
+		self._config_path = config_path
+		self._interval = interval
+		self._listeners = []
+
+		self._mtime = None
+		self._content_hash = None
+		self._config = None
+		self._read()
+
+	def add_listener(self, listener):
+		self._listeners.append(listener)
+
+	def run(self):
+
+		while True:
+			time.sleep(self._interval)
+
+			try:
+				self.check()
+			except:
+				logging.exception("Reloading the config failed")
+
+	def check(self):
+		"""
+		Reload the config if it has changed. Returns the list of changes, if any.
+		"""
+		if os.path.getmtime(self._config_path) == self._mtime:
+			return []
+
+		previous_config = self._config
+		if not self._read():
+			# The file was saved, but nothing in it changed
+			return []
+
+		changes = config_diff(previous_config, self._config)
+		if not changes:
+			return []
+
+		logging.info(f"{self._config_path} has changed, reloading it:\n" + '\n'.join(changes))
+
+		# The keyword helpers are rebuilt before any bot asks for them, so the file isn't parsed again
+		reload_keyword_helpers(self._config, self._mtime)
+
+		for listener in self._listeners:
+			try:
+				listener.reload_config(self._config)
+			except:
+				logging.exception(f"{listener} could not reload the config")
+
+		return changes
+
+	def _read(self):
+		# Returns True if the content differs from the last read
+		self._mtime = os.path.getmtime(self._config_path)
+
+		with open(self._config_path, 'rb') as f:
+			content = f.read()
+
+		content_hash = hashlib.sha1(content).digest()
+		if content_hash == self._content_hash:
+			return False
+
+		config = ConfigParser()
+		config.read_string(content.decode('utf-8'))
+
+		self._config = config
+		self._content_hash = content_hash
+		return True
+
+
+def config_diff(previous_config, config):
+	"""
+	A line for each option that was added, removed or changed, in every section.
+	"""
+	changes = []
+
+	for section in ['DEFAULT'] + sorted(set(previous_config.sections()) | set(config.sections())):
+		previous_options = _section_options(previous_config, section)
+		options = _section_options(config, section)
+
+		if previous_options is None:
+			changes.append(f"[{section}] added")
+			continue
+		if options is None:
+			changes.append(f"[{section}] removed")
+			continue
+
+		for option in sorted(set(previous_options) | set(options)):
+			if previous_options.get(option) != options.get(option):
+				changes.append(f"[{section}] {option}: {previous_options.get(option)!r} -> {options.get(option)!r}")
+
+	return changes
+
+
+def _section_options(config, section):
+	if section == 'DEFAULT':
+		return dict(config.defaults())
+	if not config.has_section(section):
+		return None
+	# Only the section's own options, so a change to DEFAULT is listed once
+	return {option: value for option, value in config.items(section, raw=True)
+		if option not in config.defaults() or config.defaults()[option] != value}
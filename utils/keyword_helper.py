@@ -1,10 +1,65 @@
 import logging
+import os
 import re
+import threading
 
 from configparser import ConfigParser
 
 from utils import ROOT_DIR
 
+# config section -> (the section's keyword options, KeywordHelper)
+_keyword_helpers = {}
+_keyword_helpers_lock = threading.Lock()
+# The parsed ssi-bot.ini, and the modification time it was parsed at
+_keyword_config = (None, None)
+
+
+def get_keyword_helper(config_section='DEFAULT'):
+	"""
+	Return the shared KeywordHelper for a config section.
+	ssi-bot.ini is only parsed again when it has been modified, and a section's helper is only
+	rebuilt when its keyword options have changed.
+	"""
+	with _keyword_helpers_lock:
+		config = _read_keyword_config()
+		keyword_options = tuple(config[config_section].get(option, '') for option in KeywordHelper.config_options)
+
+		options, keyword_helper = _keyword_helpers.get(config_section, (None, None))
+		if keyword_helper is None or options != keyword_options:
+			keyword_helper = KeywordHelper(config_section, config)
+			_keyword_helpers[config_section] = (keyword_options, keyword_helper)
+
+		return keyword_helper
+
+
+def reload_keyword_helpers(config, mtime):
+	"""
+	Use a config that has already been parsed, and rebuild the helpers of any section whose keywords changed.
+	"""
+	global _keyword_config
+
+	with _keyword_helpers_lock:
+		_keyword_config = (config, mtime)
+
+	for config_section in list(_keyword_helpers):
+		if config_section == 'DEFAULT' or config.has_section(config_section):
+			get_keyword_helper(config_section)
+
+
+def _read_keyword_config():
+	global _keyword_config
+
+	config_path = ROOT_DIR / 'ssi-bot.ini'
+	mtime = os.path.getmtime(config_path) if config_path.exists() else None
+
+	config, config_mtime = _keyword_config
+	if config is None or mtime != config_mtime:
+		config = ConfigParser()
+		config.read(config_path)
+		_keyword_config = (config, mtime)
+
+	return config
+
 
 class KeywordHelper():
 
@@ -33,10 +88,15 @@ class KeywordHelper():
 		('white p', 'ower'),
 	]
 
-	def __init__(self, config_key='DEFAULT'):
+	# The options in a bot's config section that the keyword lists are built from
+	config_options = ('positive_keywords', 'negative_keywords')
 
-		self._config = ConfigParser()
-		self._config.read(ROOT_DIR / 'ssi-bot.ini')
+	def __init__(self, config_key='DEFAULT', config=None):
+
+		if config is None:
+			config = ConfigParser()
+			config.read(ROOT_DIR / 'ssi-bot.ini')
+		self._config = config
 
 		self._positive_keywords = []
 		self._negative_keywords = ["".join(s) for s in self._default_negative_keywords if s]
@@ -58,6 +118,9 @@ class KeywordHelper():
 					logging.error(f"Error in keyword {kw}. It will be removed. You may need to add regex escaping to the keyword.")
 					l.remove(kw)
 
+		self._positive_matcher = KeywordMatcher(self._positive_keywords)
+		self._negative_matcher = KeywordMatcher(self._negative_keywords)
+
 	def _test_keyword_is_compilable(self, kw):
 			try:
 				re.compile("\b{}".format(kw), re.IGNORECASE)
@@ -66,13 +129,94 @@ class KeywordHelper():
 				return False
 
 	def positive_keyword_matches(self, text):
-		if self._positive_keywords:
-			return [keyword for keyword in self._positive_keywords if re.search(r"\b{}".format(keyword), text, re.IGNORECASE)]
-		return []
+		return self._positive_matcher.matches(text)
 
 	def negative_keyword_matches(self, text):
 		# Negative keyword is matched with a starting boundary so basic word forms
 		# like plurals are matched, for example humans and humanoid would both match for just the keyword human.
-		if self._negative_keywords:
-			return [keyword for keyword in self._negative_keywords if re.search(r"\b{}".format(keyword), text, re.IGNORECASE)]
-		return []
+		return self._negative_matcher.matches(text)
+
+
+def _can_be_combined(keyword):
+	"""
+	Whether a keyword matches the same inside the combined regex as it does on its own.
+	On its own, a top level | ends the keyword's \\b, and a backreference refers to the keyword's own group numbers.
+	"""
+	depth = 0
+	in_class = False
+	characters = iter(enumerate(keyword))
+
+	for i, character in characters:
+		if character == '\\':
+			i, escaped = next(characters, (i, ''))
+			if escaped.isdigit() and escaped != '0' and not in_class:
+				return False
+		elif in_class:
+			if character == ']':
+				in_class = False
+		elif character == '[':
+			in_class = True
+			# A ] straight after the [ or [^ is part of the class
+			if keyword[i + 1:i + 2] == '^':
+				i, character = next(characters)
+			if keyword[i + 1:i + 2] == ']':
+				next(characters)
+		elif character == '(':
+			if keyword.startswith('?P=', i + 1) or keyword.startswith('?(', i + 1):
+				return False
+			depth += 1
+		elif character == ')':
+			depth -= 1
+		elif character == '|' and depth == 0:
+			return False
+
+	return True
+
+
+class KeywordMatcher():
+	"""
+	A list of keywords compiled into one regex, which finds every keyword in a text in a single pass.
+	Each keyword is matched from a word boundary, case insensitively,
+	and the matches are returned in the order of the keyword list.
+
+	The regex only stops at word boundaries where at least one keyword matches.
+	There, each keyword is tried in an optional lookahead that sets an empty named group when it matches,
+	so keywords that overlap each other, like isis and israel, are all found.
+
+	Keywords that would match differently inside the combined regex,
+	with a top level | or a backreference, are searched for separately.
+	"""
+
+	def __init__(self, keywords):
+		self._keywords = list(keywords)
+		self._regex = None
+		# keyword index -> regex, for the keywords that are searched for separately
+		self._keyword_regexes = {i: re.compile(r"\b{}".format(keyword), re.IGNORECASE)
+			for i, keyword in enumerate(self._keywords) if not _can_be_combined(keyword)}
+
+		combined = [(i, keyword) for i, keyword in enumerate(self._keywords) if i not in self._keyword_regexes]
+
+		if not combined:
+			return
+
+		any_keyword = '|'.join(f"(?:{keyword})" for i, keyword in combined)
+		each_keyword = ''.join(f"(?:(?=(?:{keyword})(?P<k{i}>)))?" for i, keyword in combined)
+
+		try:
+			self._regex = re.compile(r"\b(?={}){}".format(any_keyword, each_keyword), re.IGNORECASE)
+		except re.error:
+			# If the keywords can't be combined, for example two define the same named group, each is searched for separately
+			logging.warning("The keywords could not be combined into one regex, they will be matched one at a time.")
+			self._keyword_regexes.update((i, re.compile(r"\b{}".format(keyword), re.IGNORECASE)) for i, keyword in combined)
+
+	def matches(self, text):
+		if not self._keywords:
+			return []
+
+		matched = {i for i, regex in self._keyword_regexes.items() if regex.search(text)}
+
+		if self._regex is not None:
+			for match in self._regex.finditer(text):
+				matched.update(int(name[1:]) for name, value in match.groupdict().items() if value is not None)
+
+		return [keyword for i, keyword in enumerate(self._keywords) if i in matched]
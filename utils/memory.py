@@ -1,18 +1,106 @@
+import logging
+import os
+import threading
+
 import psutil
 import torch
 
 
 def get_available_memory(gpu=False):
+	# The memory free for new allocations, in KB
 
 	if gpu:
 		# Only supporting NVidia and the first (0-index) GPU at this stage
-		reserved_memory = torch.cuda.memory_reserved(0)
-		allocated_memory = torch.cuda.memory_allocated(0)
-		available_memory = (reserved_memory - allocated_memory) / 1024
-		print(f'gpu available_memory {available_memory}')
+		free_memory, _ = torch.cuda.mem_get_info(0)
+		available_memory = free_memory / 1024
+		logging.debug(f'gpu available_memory {available_memory:.0f} KB')
 		return available_memory
 
 	else:
 		available_memory = psutil.virtual_memory().available / 1024
-		print(f'cpu available_memory {available_memory}')
+		logging.debug(f'cpu available_memory {available_memory:.0f} KB')
 		return available_memory
+
+
+def get_process_tree_memory(pid):
+	# The resident memory of a process and all of its children, in KB
+	try:
+		process = psutil.Process(pid)
+		processes = [process] + process.children(recursive=True)
+	except psutil.NoSuchProcess:
+		return 0
+
+	total = 0
+	for p in processes:
+		try:
+			total += p.memory_info().rss
+		except psutil.NoSuchProcess:
+			# The child exited while it was being measured
+			pass
+
+	return total / 1024
+
+
+class PeakMemorySampler(threading.Thread):
+	"""
+	Samples the resident memory of a process and its children on a timer, keeping the peak in KB.
+	By default the process is this one.
+	"""
+
+	daemon = True
+
+	def __init__(self, pid=None, interval=0.05):
+		super().__init__()
+		self._pid = pid or os.getpid()
+		self._interval = interval
+		self._stop_event = threading.Event()
+		self.peak_memory = 0
+
+	def run(self):
+		while not self._stop_event.is_set():
+			self.peak_memory = max(self.peak_memory, get_process_tree_memory(self._pid))
+			self._stop_event.wait(self._interval)
+
+	def stop(self):
+		self._stop_event.set()
+		self.join()
+		return self.peak_memory
+
+
+class MemoryAdmission():
+	"""
+	Decides whether a job can start, by comparing the memory it needs with the memory actually available.
+	If there isn't enough, the caller can supply an evict function to release memory
+	held by something else, such as a cached model that isn't needed for this job.
+	Otherwise the job has to wait.
+	"""
+
+	def __init__(self, use_gpu=False):
+		self._use_gpu = use_gpu
+
+	def admit(self, name, required, reserved=0, evict=None):
+		"""
+		Returns True if there is enough memory to start the job.
+		required is the memory in KB the job will allocate.
+		reserved is memory in KB already promised to jobs that have started but not yet allocated it.
+		evict is called repeatedly while there isn't enough memory.
+		It returns the KB it released, or 0 when there's nothing left to release.
+		"""
+		available = get_available_memory(self._use_gpu) - reserved
+
+		while available < required and evict:
+			released = evict()
+			if not released:
+				break
+
+			# Released memory isn't always handed straight back to the OS,
+			# so count what was released rather than measuring again
+			available += released
+			logging.info(f"Released {released:.0f} KB for {name}, {available:.0f} KB now available")
+
+		if available < required:
+			logging.info(f"Waiting for memory: {name} needs {required:.0f} KB, {available:.0f} KB available")
+			return False
+
+		logging.debug(f"Admitted {name}, needs {required:.0f} KB, {available:.0f} KB available")
+		return True
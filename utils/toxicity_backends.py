@@ -0,0 +1,118 @@
+import json
+import logging
+import tempfile
+
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from detoxify import Detoxify
+
+TOXICITY_BACKENDS = ['pytorch', 'quantized', 'onnx']
+
+# The detoxify labels are saved alongside the exported graph
+CLASS_NAMES_FILE = 'class_names.json'
+
+
+def load_detoxify(model_type='unbiased-small', backend='pytorch', onnx_path=None):
+	"""
+	Load the detoxify classifier with an inference backend:
+	pytorch - the fp32 model, on the GPU if there is one
+	quantized - linear layers dynamically quantized to int8, CPU only
+	onnx - the ONNX Runtime graph exported by export_detoxify_onnx, CPU only
+
+	Every backend returns an object with the predict method and class_names of Detoxify.
+	"""
+	if backend == 'pytorch':
+		return Detoxify(model_type, device='cuda' if torch.cuda.is_available() else 'cpu')
+
+	elif backend == 'quantized':
+		return quantize_detoxify(Detoxify(model_type, device='cpu'))
+
+	elif backend == 'onnx':
+		return OnnxDetoxify(onnx_path)
+
+	raise ValueError(f"Unknown toxicity backend {backend}, use one of {', '.join(TOXICITY_BACKENDS)}")
+
+
+def quantize_detoxify(detoxify):
+	"""
+	Dynamically quantize the weights of the classifier's linear layers to int8.
+	"""
+	detoxify.model.eval()
+	detoxify.model = torch.quantization.quantize_dynamic(detoxify.model, {torch.nn.Linear}, dtype=torch.qint8)
+	return detoxify
+
+
+class OnnxDetoxify():
+	"""
+	An exported ONNX Runtime graph of the detoxify classifier, scored the same way as Detoxify.predict.
+	"""
+
+	def __init__(self, onnx_path):
+		# onnxruntime and optimum are only needed for this backend
+		from optimum.onnxruntime import ORTModelForSequenceClassification
+		from transformers import AutoTokenizer
+
+		onnx_path = Path(onnx_path)
+		if not (onnx_path / CLASS_NAMES_FILE).is_file():
+			raise FileNotFoundError(f"No detoxify ONNX export found at {onnx_path}. Export it first with: python -m utils.check_toxicity_backend --export onnx")
+
+		self.tokenizer = AutoTokenizer.from_pretrained(onnx_path)
+		self.model = ORTModelForSequenceClassification.from_pretrained(onnx_path)
+		self.class_names = json.loads((onnx_path / CLASS_NAMES_FILE).read_text())
+
+	def predict(self, text):
+		inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding=True)
+		scores = torch.sigmoid(self.model(**inputs).logits).numpy()
+
+		if isinstance(text, str):
+			return {cla: scores[0][i] for i, cla in enumerate(self.class_names)}
+
+		return {cla: scores[:, i].tolist() for i, cla in enumerate(self.class_names)}
+
+
+def export_detoxify_onnx(detoxify, onnx_path):
+	"""
+	Export a loaded detoxify classifier to an ONNX graph in onnx_path, with its tokenizer and labels.
+	"""
+	from optimum.onnxruntime import ORTModelForSequenceClassification
+
+	onnx_path = Path(onnx_path)
+
+	logging.info(f"Exporting detoxify to ONNX..")
+	with tempfile.TemporaryDirectory() as model_path:
+		# Detoxify builds its model from a checkpoint, so it is saved as a transformers model to export it
+		detoxify.model.save_pretrained(model_path)
+		detoxify.tokenizer.save_pretrained(model_path)
+
+		model = ORTModelForSequenceClassification.from_pretrained(model_path, export=True)
+		model.save_pretrained(onnx_path)
+
+	detoxify.tokenizer.save_pretrained(onnx_path)
+	(onnx_path / CLASS_NAMES_FILE).write_text(json.dumps(list(detoxify.class_names)))
+
+	logging.info(f"Saved the detoxify ONNX graph to {onnx_path}")
+	return onnx_path
+
+
+def score_deviation(reference, candidate, texts, batch_size=16):
+	"""
+	Score the texts with both classifiers and report the largest difference in each label's score.
+	"""
+	if list(reference.class_names) != list(candidate.class_names):
+		raise ValueError(f"The labels {candidate.class_names} do not match the reference labels {reference.class_names}")
+
+	deviations = {label: 0.0 for label in reference.class_names}
+
+	for i in range(0, len(texts), batch_size):
+		batch = texts[i:i + batch_size]
+		reference_results = reference.predict(batch)
+		candidate_results = candidate.predict(batch)
+
+		for label in deviations:
+			deviation = np.abs(np.array(reference_results[label]) - np.array(candidate_results[label])).max()
+			deviations[label] = max(deviations[label], float(deviation))
+
+	return {'max_deviation': max(deviations.values()), 'labels': deviations, 'texts': len(texts)}
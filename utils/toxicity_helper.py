@@ -1,54 +1,195 @@
+import hashlib
 import logging
+import threading
+import time
 
-import torch
-
+from collections import OrderedDict
 from configparser import ConfigParser
-from detoxify import Detoxify
+from types import MappingProxyType
+
+import numpy as np
 
 from utils import ROOT_DIR
+from utils.toxicity_service import get_toxicity_service
 
+default_thresholds = {'toxicity': 0.80, 'severe_toxicity': 0.05, 'obscene': 0.8, 'identity_attack': 0.4, 'insult': 0.4, 'threat': 0.3, 'sexual_explicit': 0.8}
 
-class ToxicityHelper():
+_toxicity_score_cache = None
+_toxicity_score_cache_lock = threading.Lock()
+
+
+def get_toxicity_score_cache():
+	"""
+	Return the process-wide cache of toxicity scores, shared by every bot's helper.
+	"""
+	global _toxicity_score_cache
+
+	with _toxicity_score_cache_lock:
+		if _toxicity_score_cache is None:
+			config = ConfigParser()
+			config.read(ROOT_DIR / 'ssi-bot.ini')
+
+			_toxicity_score_cache = ToxicityScoreCache(
+				max_entries=config['DEFAULT'].getint('toxicity_cache_size', 10000),
+				ttl=config['DEFAULT'].getfloat('toxicity_cache_ttl', 3600))
+
+		return _toxicity_score_cache
+
+
+class ToxicityScoreCache():
+	"""
+	An LRU cache of the detoxify scores of texts, keyed by a hash of the normalised text.
+	The same comment is often scored by several bots, and repeated candidates are scored on every retry.
+	The raw scores are stored, so each bot can still apply its own thresholds.
+	Entries expire after ttl seconds.
+	"""
+
+	def __init__(self, max_entries=10000, ttl=3600):
+		self._max_entries = max_entries
+		self._ttl = ttl
+
+		# text key -> (expiry time, scores)
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, text):
+		key = self._text_key(text)
+
+		with self._lock:
+			entry = self._entries.get(key)
+
+			if entry is not None and entry[0] > time.time():
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry[1]
+
+			if entry is not None:
+				del self._entries[key]
+
+			self.misses += 1
+			return None
+
+	def add(self, text, scores):
+		if self._max_entries < 1:
+			return
+
+		key = self._text_key(text)
+
+		with self._lock:
+			self._entries[key] = (time.time() + self._ttl, scores)
+			self._entries.move_to_end(key)
+
+			while len(self._entries) > self._max_entries:
+				self._entries.popitem(last=False)
+
+	def stats(self):
+		return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
 
-	_detoxify = None
-	_threshold_map = {'toxicity': 0.80, 'severe_toxicity': 0.05, 'obscene': 0.8, 'identity_attack': 0.4, 'insult': 0.4, 'threat': 0.3, 'sexual_explicit': 0.8}
+	@staticmethod
+	def _text_key(text):
+		# Texts that only differ by whitespace score the same
+		normalised_text = ' '.join(text.split())
+		return hashlib.sha1(normalised_text.encode('utf-8')).digest()
+
+
+class ThresholdProfile():
+	"""
+	A bot's threshold for each detoxify label.
+	A profile is never changed after it is created, so one can be used by several threads at once.
+	"""
+
+	__slots__ = ('_labels', '_thresholds')
+
+	def __init__(self, thresholds):
+		self._labels = tuple(thresholds)
+		self._thresholds = np.array([thresholds[label] for label in self._labels])
+		self._thresholds.flags.writeable = False
+
+	@classmethod
+	def from_config_section(cls, config_section):
+		# Each detoxify label can be overridden with a {label}_threshold option in the bot's config section
+		return cls({label: config_section.getfloat(f"{label}_threshold", default) for label, default in default_thresholds.items()})
+
+	@property
+	def thresholds(self):
+		return MappingProxyType(dict(zip(self._labels, self._thresholds.tolist())))
+
+	def texts_exceeded(self, results):
+		"""
+		Takes the detoxify scores of several texts, and returns whether each text is above any of the thresholds.
+		"""
+		if not results:
+			return []
+
+		if any(result.keys() != set(self._labels) for result in results):
+			logging.warning(f"Detoxify results keys and threshold map keys do not match. The toxicity level of the input text cannot be calculated.")
+			return [True] * len(results)
+
+		scores = np.array([[result[label] for label in self._labels] for result in results])
+		return (scores > self._thresholds).any(axis=1).tolist()
+
+	def exceeded(self, result):
+		return self.texts_exceeded([result])[0]
+
+
+class ToxicityHelper():
 
 	def __init__(self, config_section='DEFAULT'):
 
 		self._config = ConfigParser()
 		self._config.read(ROOT_DIR / 'ssi-bot.ini')
 
-		self.load_config_section(config_section)
+		self._threshold_profiles = {}
+		self._threshold_profiles_lock = threading.Lock()
 
-		cuda_available = torch.cuda.is_available()
-		self._detoxify = Detoxify('unbiased-small', device='cuda' if cuda_available else 'cpu')
+		# Used when no other profile is given with the text
+		self._threshold_profile = self.get_threshold_profile(config_section)
 
-	def load_config_section(self, config_section):
-		# This can be used to re-configure on the fly.
-		logging.info(f"Configuring toxicity helper with section {config_section}...")
+		# Every helper scores its texts with the same Detoxify model, and shares its scores
+		self._toxicity_service = get_toxicity_service()
+		self._score_cache = get_toxicity_score_cache()
 
-		for key in self._threshold_map:
-			# Loop through all of the detoxify keys,
-			# and see if one exists in the config section for this bot.
-			# If so, then update the map.
-			config_key = f"{key}_threshold"
-			if config_key in self._config[config_section]:
-				self._threshold_map[key] = self._config[config_section].getfloat(config_key)
+	@property
+	def _threshold_map(self):
+		return self._threshold_profile.thresholds
 
-	def text_above_toxicity_threshold(self, input_text):
-		# logging.info(f"ToxicityHelper, testing {input_text}")
+	def cache_stats(self):
+		return self._score_cache.stats()
 
-		try:
-			results = self._detoxify.predict(input_text)
-		except:
-			logging.exception(f"Exception when trying to run detoxify prediction on {input_text}")
+	def get_threshold_profile(self, config_section):
+		# Each section's thresholds are only parsed the first time they are used
+		with self._threshold_profiles_lock:
+			if config_section not in self._threshold_profiles:
+				logging.info(f"Configuring toxicity helper with section {config_section}...")
+				self._threshold_profiles[config_section] = ThresholdProfile.from_config_section(self._config[config_section])
 
-		# logging.info(f"ToxicityHelper, results are {results}")
+			return self._threshold_profiles[config_section]
 
-		if self._threshold_map.keys() != results.keys():
-			logging.warning(f"Detoxify results keys and threshold map keys do not match. The toxicity level of the input text cannot be calculated.")
-			return True
+	def text_above_toxicity_threshold(self, input_text, threshold_profile=None):
+		return self.texts_above_toxicity_threshold([input_text], threshold_profile)[0]
+
+	def texts_above_toxicity_threshold(self, input_texts, threshold_profile=None):
+		# logging.info(f"ToxicityHelper, testing {input_texts}")
+
+		results = [self._score_cache.get(input_text) for input_text in input_texts]
+		uncached_texts = list(dict.fromkeys(text for text, result in zip(input_texts, results) if result is None))
+
+		if uncached_texts:
+			try:
+				scores = dict(zip(uncached_texts, self._toxicity_service.score_many(uncached_texts)))
+			except:
+				logging.exception(f"Exception when trying to run detoxify prediction on {uncached_texts}")
+				# The toxicity can't be measured, so err on the side of caution
+				return [True] * len(input_texts)
+
+			for text, text_scores in scores.items():
+				self._score_cache.add(text, text_scores)
+
+			results = [scores[text] if result is None else result for text, result in zip(input_texts, results)]
+
+		# logging.info(f"ToxicityHelper, results are {results}")
 
-		for key in self._threshold_map:
-			if results[key] > self._threshold_map[key]:
-				return True
+		return (threshold_profile or self._threshold_profile).texts_exceeded(results)
@@ -0,0 +1,109 @@
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+from configparser import ConfigParser
+
+from utils import ROOT_DIR
+from utils.toxicity_backends import load_detoxify
+
+default_toxicity_onnx_path = 'models/detoxify-unbiased-small-onnx/'
+
+_toxicity_service = None
+_toxicity_service_lock = threading.Lock()
+
+
+def get_toxicity_service():
+	"""
+	Return the process-wide toxicity service, starting it on first use.
+	"""
+	global _toxicity_service
+
+	with _toxicity_service_lock:
+		if _toxicity_service is None:
+			config = ConfigParser()
+			config.read(ROOT_DIR / 'ssi-bot.ini')
+
+			_toxicity_service = ToxicityService(
+				backend=config['DEFAULT'].get('toxicity_backend', 'pytorch'),
+				onnx_path=ROOT_DIR / config['DEFAULT'].get('toxicity_onnx_path', default_toxicity_onnx_path),
+				max_batch_size=config['DEFAULT'].getint('toxicity_batch_size', 32),
+				max_batch_wait=config['DEFAULT'].getfloat('toxicity_batch_wait', 10) / 1000)
+			_toxicity_service.start()
+
+		return _toxicity_service
+
+
+class ToxicityService(threading.Thread):
+	"""
+	A single Detoxify model shared by every bot and the text generator.
+	Any thread can queue texts to be scored. The service waits up to max_batch_wait seconds
+	for other texts to arrive, then scores everything queued in one predict call.
+	It returns the raw score of every label, so each bot can apply its own thresholds.
+	"""
+
+	daemon = True
+	name = "ToxicityService"
+
+	def __init__(self, model_type='unbiased-small', backend='pytorch', onnx_path=None, max_batch_size=32, max_batch_wait=0.01):
+		super().__init__()
+
+		self._max_batch_size = max_batch_size
+		self._max_batch_wait = max_batch_wait
+		self._queue = queue.Queue()
+
+		logging.info(f"Loading the {backend} detoxify model..")
+		self._detoxify = load_detoxify(model_type, backend, onnx_path)
+
+		self.batches = 0
+		self.texts_scored = 0
+
+	def score(self, text):
+		"""
+		Returns a dict of the score of each toxicity label for the text.
+		"""
+		return self.score_async(text).result()
+
+	def score_many(self, texts):
+		# Queue every text before waiting, so they are scored together
+		futures = [self.score_async(text) for text in texts]
+		return [future.result() for future in futures]
+
+	def score_async(self, text):
+		future = Future()
+		self._queue.put((text, future))
+		return future
+
+	def run(self):
+
+		while True:
+			batch = [self._queue.get()]
+
+			# Collect the texts queued by other threads in the meantime
+			deadline = time.time() + self._max_batch_wait
+			while len(batch) < self._max_batch_size:
+				try:
+					batch.append(self._queue.get(timeout=max(0, deadline - time.time())))
+				except queue.Empty:
+					break
+
+			self._score_batch(batch)
+
+	def _score_batch(self, batch):
+		texts = [text for text, _ in batch]
+
+		try:
+			results = self._detoxify.predict(texts)
+		except Exception as e:
+			logging.exception(f"Exception when trying to run detoxify prediction on a batch of {len(texts)} texts")
+			for _, future in batch:
+				future.set_exception(e)
+			return
+
+		self.batches += 1
+		self.texts_scored += len(texts)
+
+		for i, (_, future) in enumerate(batch):
+			future.set_result({label: scores[i] for label, scores in results.items()})